@@ -1,11 +1,15 @@
 from typing import *
 import random
+import itertools
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
 from ...modules.utils import zero_module, convert_module_to_f16, convert_module_to_f32
 from ...modules import sparse as sp
+from ...modules.sparse.keys import pack_coords, stable_argsort, lookup_keys
+from ...modules.sparse.conv import kernel_map
 from .base import SparseTransformerBase
+from ...utils.telemetry import span
 
 
 class SparseSubdivideBlock3d(nn.Module):
@@ -105,6 +109,11 @@ class SparseSDFDecoder(SparseTransformerBase):
         self.out_layer = sp.SparseLinear(model_channels // 16, self.out_channels)
         self.out_active = sp.SparseTanh()
 
+        self.prune_subdivision = False
+        self.prune_margin = 0.05
+        self.prune_keep_below = 0.95
+        self.last_pruning_report = None
+
         self.initialize_weights()
         if use_fp16:
             self.convert_to_fp16()
@@ -274,10 +283,143 @@ class SparseSDFDecoder(SparseTransformerBase):
 
         return sp.SparseTensor(final_feats, final_coords)
 
-    def upsamples(self, x, return_feat: bool = False):
+    def set_pruning(self, enabled: bool = True, margin: float = 0.05, keep_below: float = 0.95):
+        """
+        Enable pruned subdivision for inference.
+
+        After every subdivide stage but the last, a linear probe on the stage features predicts
+        the minimum final SDF over each voxel's descendants. Voxels predicted above a calibrated
+        threshold, i.e. saturated on the outside where an inactive voxel reads as +1 anyway, are
+        dropped unless they neighbour a kept voxel. Probes are fitted per decode on one chunk,
+        with the threshold set `margin` above the highest prediction of any voxel whose
+        descendants reach below `keep_below`, and their accuracy is reported on another chunk.
+        """
+        self.prune_subdivision = enabled
+        self.prune_margin = margin
+        self.prune_keep_below = keep_below
+
+    @staticmethod
+    def _dilate_keep(coords: torch.Tensor, keep: torch.Tensor) -> torch.Tensor:
+        """
+        Extend a keep mask by the 26-neighbourhood of the kept voxels.
+        """
+        candidates = (~keep).nonzero().squeeze(-1)
+        if candidates.numel() == 0 or not keep.any():
+            return keep
+        kept_keys, _ = stable_argsort(pack_coords(coords[keep]))
+        cand_coords = coords[candidates].long()
+        hit = torch.zeros_like(candidates, dtype=torch.bool)
+        for offset in itertools.product((-1, 0, 1), repeat=3):
+            if offset == (0, 0, 0):
+                continue
+            neighbour = cand_coords.clone()
+            neighbour[:, 1:] += torch.tensor(offset, device=coords.device).unsqueeze(0)
+            valid = (neighbour[:, 1:] >= 0).all(dim=-1)
+            found, _ = lookup_keys(kept_keys, pack_coords(neighbour.clamp(min=0)))
+            hit |= found & valid
+        keep = keep.clone()
+        keep[candidates[hit]] = True
+        return keep
+
+    def _prune(self, x: sp.SparseTensor, probe) -> sp.SparseTensor:
+        weight, threshold = probe
+        pred = x.feats.float() @ weight[:-1] + weight[-1]
+        keep = pred <= threshold
+        if keep.all():
+            return x
+        if not keep.any():
+            keep[pred.argmin()] = True
+        keep = self._dilate_keep(x.coords, keep)
+        out = sp.SparseTensor(x.feats[keep], x.coords[keep])
+        out._scale = x._scale
+        return out
+
+    def _calibrate_pruning(self, chunks: List[sp.SparseTensor]):
+        """
+        Fit the probes on the largest chunk and report their accuracy on the second largest one.
+        """
+        chunks = sorted(chunks, key=lambda c: c.feats.shape[0], reverse=True)
+        return self._fit_pruning(chunks[0], chunks[1] if len(chunks) > 1 else None)
+
+    @torch.no_grad()
+    def _fit_pruning(self, chunk: sp.SparseTensor, held_out: Optional[sp.SparseTensor] = None):
+        """
+        Decode a calibration chunk without pruning and fit one probe per intermediate stage.
+        The accuracy of the pruned decode is measured on `held_out`, which the probes and thresholds
+        were not fitted on; only without one (a single chunk) it falls back to the calibration chunk.
+        """
+        dtype = chunk.dtype
+        stages = []
+        h = chunk
+        for i, block in enumerate(self.upsample):
+            h = block(h)
+            if i < len(self.upsample) - 1:
+                stages.append((h.coords, h.feats))
+        reference = self.out_active(self.out_layer(h.type(dtype)))
+        final_coords = reference.coords.long()
+        final_sdf = reference.feats[:, 0].float()
+
+        probes, stage_pruned = [], []
+        for i, (coords, feats) in enumerate(stages):
+            depth = len(self.upsample) - 1 - i
+            parent = torch.cat([final_coords[:, :1], final_coords[:, 1:] >> depth], dim=-1)
+            stage_keys, order = stable_argsort(pack_coords(coords))
+            found, pos = lookup_keys(stage_keys, pack_coords(parent))
+            target = torch.ones(coords.shape[0], device=final_sdf.device).scatter_reduce(
+                0, order[pos[found]], final_sdf[found], reduce='amin')
+            A = torch.cat([feats.float(), torch.ones_like(feats[:, :1], dtype=torch.float32)], dim=-1)
+            gram = A.T @ A
+            gram += 1e-4 * gram.diagonal().mean() * torch.eye(gram.shape[0], device=gram.device)
+            weight = torch.linalg.solve(gram, A.T @ target)
+            pred = A @ weight
+            near = target < self.prune_keep_below
+            threshold = pred[near].max().item() + self.prune_margin if near.any() else float('inf')
+            probes.append((weight, threshold))
+            stage_pruned.append((pred > threshold).float().mean().item())
+        probes.append(None)
+        del stages, reference, h
+
+        if held_out is not None:
+            measured_on = 'held-out'
+            reference = self.upsamples(held_out)
+            final_coords = reference.coords.long()
+            final_sdf = reference.feats[:, 0].float()
+            del reference
+        else:
+            measured_on = 'calibration'
+            held_out = chunk
+        pruned = self.upsamples(held_out, probes=probes)
+        ref_keys, ref_order = stable_argsort(pack_coords(final_coords))
+        found, pos = lookup_keys(ref_keys, pack_coords(pruned.coords))
+        ref_sdf = final_sdf[ref_order[pos[found]]]
+        max_error = (pruned.feats[found, 0].float() - ref_sdf).abs().max().item() if found.any() else 0.0
+        pruned_keys, _ = stable_argsort(pack_coords(pruned.coords))
+        kept, _ = lookup_keys(pruned_keys, pack_coords(final_coords))
+        lost = ((~kept) & (final_sdf < self.prune_keep_below)).sum().item()
+
+        self.last_pruning_report = {
+            'calibration_tokens': chunk.feats.shape[0],
+            'stage_pruned_fraction': stage_pruned,
+            'measured_on': measured_on,
+            'measured_tokens': held_out.feats.shape[0],
+            'kept_fraction': pruned.feats.shape[0] / max(final_coords.shape[0], 1),
+            'max_abs_sdf_error': max_error,
+            'lost_near_surface_voxels': lost,
+        }
+        print(f"[SparseSDFDecoder] pruning calibrated on {chunk.feats.shape[0]} tokens "
+              f"(stage pruned {', '.join(f'{p:.1%}' for p in stage_pruned)}); "
+              f"{measured_on} chunk of {held_out.feats.shape[0]} tokens: "
+              f"output kept {self.last_pruning_report['kept_fraction']:.1%}, "
+              f"max |sdf error| {max_error:.4f}, near-surface voxels lost {lost}")
+        return probes
+
+    def upsamples(self, x, return_feat: bool = False, probes=None):
         dtype = x.dtype
-        for block in self.upsample:
-            x = block(x)
+        for i, block in enumerate(self.upsample):
+            with kernel_map.kernel_map_stage(f'upsample_{i}'):
+                x = block(x)
+            if probes is not None and probes[i] is not None:
+                x = self._prune(x, probes[i])
         x = x.type(dtype)
 
         output = self.out_active(self.out_layer(x))
@@ -288,10 +430,26 @@ class SparseSDFDecoder(SparseTransformerBase):
             return output
     
     def forward(self, x: sp.SparseTensor, factor: float = None, return_feat: bool = False):
+        output = self._decode(x, factor, return_feat)
+        if kernel_map.PROFILE:
+            print(kernel_map.kernel_map_profile_report())
+        return output
+
+    def _decode(self, x: sp.SparseTensor, factor: float = None, return_feat: bool = False):
         h = super().forward(x, factor)
+        prune = self.prune_subdivision and not self.training
+        if self.chunk_size <= 1 and prune:
+            chunks = self.split_for_meshing(h, chunk_size=4)
+            probes = self._calibrate_pruning(chunks)
+            del chunks
+            output = self.upsamples(h, return_feat=return_feat, probes=probes)
+            out_tokens = (output[0] if return_feat else output).feats.shape[0]
+            print(f"[SparseSDFDecoder] pruned decode produced {out_tokens} of {h.feats.shape[0] * 8 ** len(self.upsample)} voxels")
+            return output
         if self.chunk_size <= 1:
-            for block in self.upsample:
-                h = block(h)
+            for i, block in enumerate(self.upsample):
+                with kernel_map.kernel_map_stage(f'upsample_{i}'):
+                    h = block(h)
             h = h.type(x.dtype)
 
             if return_feat:
@@ -306,9 +464,11 @@ class SparseSDFDecoder(SparseTransformerBase):
             else:
                 batch_size = x.shape[0]                
                 chunks = self.split_for_meshing(h, chunk_size=self.chunk_size)
+                probes = self._calibrate_pruning(chunks) if prune else None
                 all_coords, all_feats = [], []
                 for chunk_idx, chunk in enumerate(chunks):
-                    chunk_result = self.upsamples(chunk)
+                    with span('decode_chunk', chunk=chunk_idx, tokens=chunk.feats.shape[0]):
+                        chunk_result = self.upsamples(chunk, probes=probes)
 
                     for b in range(batch_size):
                         mask = torch.nonzero(chunk_result.coords[:, 0] == b).squeeze(-1)
@@ -348,6 +508,8 @@ class SparseSDFDecoder(SparseTransformerBase):
 
                 final_coords = torch.cat(all_coords)
                 final_feats = torch.cat(all_feats)
+                if prune:
+                    print(f"[SparseSDFDecoder] pruned decode produced {final_feats.shape[0]} of {h.feats.shape[0] * 8 ** len(self.upsample)} voxels")
                 
                 return sp.SparseTensor(final_feats, final_coords)
             
\ No newline at end of file
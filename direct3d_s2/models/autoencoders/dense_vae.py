@@ -3,11 +3,11 @@ import torch
 import torch.nn as nn
 import torch.nn.functional as F
 import trimesh
-from skimage import measure
 from ...modules.norm import GroupNorm32, ChannelLayerNorm32
 from ...modules.spatial import pixel_shuffle_3d
 from ...modules.utils import zero_module, convert_module_to_f16, convert_module_to_f32
 from .distributions import DiagonalGaussianDistribution
+from ...utils.marching_cubes import slab_marching_cubes
 
 
 def norm_layer(norm_type: str, *args, **kwargs) -> nn.Module:
@@ -390,11 +390,7 @@ class DenseShapeVAE(nn.Module):
         for i in range(len(x)):
             occ = x[i].sigmoid()
             occ = (occ >= 0.1).float().squeeze(0).cpu().detach().numpy()
-            vertices, faces, _, _ = measure.marching_cubes(
-                occ,
-                mc_threshold,
-                method="lewiner",
-            )
+            vertices, faces = slab_marching_cubes(occ, mc_threshold)
             vertices = vertices / voxel_resolution * 2 - 1
             meshes.append(trimesh.Trimesh(vertices, faces))
 
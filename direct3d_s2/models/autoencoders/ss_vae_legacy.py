@@ -9,6 +9,9 @@ from skimage import measure
 from ...modules import sparse as sp
 from .encoder import SparseSDFEncoder
 from .decoder import SparseSDFDecoder
+from ...utils.sparse import remove_small_components
+from ...utils.adaptive_mesh import adaptive_mesh
+from ...utils.telemetry import span
 from .distributions import DiagonalGaussianDistribution
 
 
@@ -95,21 +98,30 @@ class SparseSDFVAE(nn.Module):
                     voxel_resolution: int = 512,
                     mc_threshold: float = 0.2,
                     return_feat: bool = False,
-                    factor: float = 1.0):
+                    factor: float = 1.0,
+                    floater_ratio: float = 0.0,
+                    face_budget: int = 0):
         voxel_resolution = int(voxel_resolution / factor)
         reconst_x = self.decoder(latents, factor=factor, return_feat=return_feat)
         if return_feat:            
             return reconst_x
-        outputs = self.sparse2mesh(reconst_x, voxel_resolution=voxel_resolution, mc_threshold=mc_threshold)
+        outputs = self.sparse2mesh(reconst_x, voxel_resolution=voxel_resolution, mc_threshold=mc_threshold,
+                                   floater_ratio=floater_ratio, face_budget=face_budget)
         
         return outputs
 
     def sparse2mesh(self,
                     reconst_x: torch.FloatTensor,
                     voxel_resolution: int = 512,
-                    mc_threshold: float = 0.0):
+                    mc_threshold: float = 0.0,
+                    floater_ratio: float = 0.0,
+                    face_budget: int = 0):
 
         sparse_sdf, sparse_index = reconst_x.feats.float(), reconst_x.coords
+        if floater_ratio > 0:
+            # drop small disconnected voxel components before meshing
+            keep = remove_small_components(sparse_index, floater_ratio)
+            sparse_sdf, sparse_index = sparse_sdf[keep], sparse_index[keep]
         batch_size = int(sparse_index[..., 0].max().cpu().numpy() + 1)
 
         meshes = []
@@ -118,11 +130,14 @@ class SparseSDFVAE(nn.Module):
             sparse_sdf_i, sparse_index_i = sparse_sdf[idx].squeeze(-1).cpu(),  sparse_index[idx][..., 1:].detach().cpu()
             sdf = torch.ones((voxel_resolution, voxel_resolution, voxel_resolution))
             sdf[sparse_index_i[..., 0], sparse_index_i[..., 1], sparse_index_i[..., 2]] = sparse_sdf_i
-            vertices, faces, _, _ = measure.marching_cubes(
-                sdf.numpy(),
-                mc_threshold,
-                method="lewiner",
-            )
+            with span('marching_cubes', resolution=voxel_resolution):
+                vertices, faces, _, _ = measure.marching_cubes(
+                    sdf.numpy(),
+                    mc_threshold,
+                    method="lewiner",
+                )
+            if face_budget > 0:
+                vertices, faces = adaptive_mesh(vertices, faces, face_budget)
             vertices = vertices / voxel_resolution * 2 - 1
             meshes.append(trimesh.Trimesh(vertices, faces))
 
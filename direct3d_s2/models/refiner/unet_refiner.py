@@ -7,8 +7,9 @@ import torch.nn.functional as F
 from .unet3d import UNet3DModel
 import trimesh
 from tqdm import tqdm
-from skimage import measure
 from direct3d_s2.modules.utils import convert_module_to_f16, convert_module_to_f32
+from direct3d_s2.utils.marching_cubes import slab_marching_cubes, UpsampledSignField
+from direct3d_s2.utils.telemetry import span
 import direct3d_s2.modules.sparse as sp
 
 
@@ -33,6 +34,43 @@ def adaptive_block(inputs,conv,weights_=None):
         inputs = adaptive_conv(inputs, weights)
     return inputs
 
+def active_patches(coords, res, origins, patch_size, band=8, cell=8):
+    """
+    Patches that intersect the surface band, i.e. the sparse voxels dilated by `band` voxels.
+
+    Occupancy is tracked on a coarse grid of `cell`^3 voxel cells, so the test is conservative.
+    Returns a dict mapping the patch grid position (i, j, k) to whether it has to be run.
+    """
+    grid_res = (res + cell - 1) // cell
+    occupancy = torch.zeros((1, 1, grid_res, grid_res, grid_res), dtype=torch.float32, device=coords.device)
+    cells = coords[:, 1:].long() // cell
+    occupancy[0, 0, cells[:, 0], cells[:, 1], cells[:, 2]] = 1
+    radius = (band + cell - 1) // cell
+    if radius > 0:
+        occupancy = F.max_pool3d(occupancy, 2 * radius + 1, stride=1, padding=radius)
+    occupancy = occupancy[0, 0] > 0
+    spans = [(o // cell, (o + patch_size + cell - 1) // cell) for o in origins]
+    active = {}
+    for i, (x0, x1) in enumerate(spans):
+        for j, (y0, y1) in enumerate(spans):
+            for k, (z0, z1) in enumerate(spans):
+                active[(i, j, k)] = bool(occupancy[x0:x1, y0:y1, z0:z1].any())
+    return active
+
+
+def gather_patch(coords, values, batch_size, origin, patch_size, fill):
+    """
+    Dense [B, C, P, P, P] crop at `origin` built from the sparse voxels inside it, `fill` elsewhere.
+    """
+    local = coords[:, 1:].long() - torch.tensor(origin, dtype=torch.long, device=coords.device)
+    inside = ((local >= 0) & (local < patch_size)).all(dim=1)
+    local, batch = local[inside], coords[inside, 0].long()
+    crop = torch.full((batch_size, values.shape[-1], patch_size, patch_size, patch_size), fill,
+                      dtype=values.dtype, device=values.device)
+    crop[batch, :, local[:, 0], local[:, 1], local[:, 2]] = values[inside]
+    return crop
+
+
 class GeoDecoder(nn.Module):
 
     def __init__(self, 
@@ -95,6 +133,8 @@ class Voxel_RefinerXL(nn.Module):
         self.conv_out = nn.Conv3d(8, out_channels, kernel_size=3, padding=1)
         self.patch_size = patch_size
         self.res = res
+        self.sparse_patches = False
+        self.patch_band = 8
 
         self.use_fp16 = use_fp16
         self.dtype = torch.float16 if use_fp16 else torch.float32
@@ -108,6 +148,15 @@ class Voxel_RefinerXL(nn.Module):
         # self.blocks.apply(convert_module_to_f16)
         self.apply(convert_module_to_f16)
 
+    def set_sparse_patches(self, enabled: bool = True, band: int = 8):
+        """
+        Only run the UNet on patches that intersect the surface band (the sparse voxels dilated
+        by `band` voxels). Their inputs are gathered from the sparse tensors instead of dense
+        grids, and skipped patches output a constant outside value.
+        """
+        self.sparse_patches = enabled
+        self.patch_band = band
+
     def run(self,
             reconst_x,
             feat, 
@@ -122,56 +171,71 @@ class Voxel_RefinerXL(nn.Module):
             dtype = sparse_sdf.dtype
             res = self.res
 
-            sdfs = []
-            for i in tqdm(range(batch_size), desc="Building SDFs"):
-                idx = sparse_index[..., 0] == i
-                sparse_sdf_i, sparse_index_i = sparse_sdf[idx].squeeze(-1), sparse_index[idx][..., 1:]
-                sdf = torch.ones((res, res, res), dtype=sparse_sdf_i.dtype, device='cpu')
-                sdf[sparse_index_i[..., 0], sparse_index_i[..., 1], sparse_index_i[..., 2]] = sparse_sdf_i.cpu()
-                sdfs.append(sdf.unsqueeze(0))
-
-            sdfs = torch.stack(sdfs, dim=0)
-            feats = torch.zeros((batch_size, sparse_feat.shape[-1], res, res, res), dtype=dtype, device='cpu')
-
-            chunk_size = 10000
-            num_points = sparse_index.shape[0]
-
-            for start in tqdm(range(0, num_points, chunk_size), desc="Streaming feats"):
-                end = min(start + chunk_size, num_points)
-                
-                batch_coords = sparse_index[start:end]
-                batch_feats = sparse_feat[start:end]
-                batch_coords = batch_coords.cpu()
-                batch_feats = batch_feats.cpu() 
-                feats[batch_coords[:,0], :, batch_coords[:,1], batch_coords[:,2], batch_coords[:,3]] = batch_feats
-
-            N = sdfs.shape[0]
-            outputs = torch.ones([N,1,res,res,res], dtype=dtype, device='cpu')
             stride = 160
             patch_size = self.patch_size
             step = 3
+            N = batch_size
+            if self.sparse_patches:
+                # inputs are gathered per patch from the sparse tensors, no dense grids are built
+                active = active_patches(sparse_index, res, [stride * i for i in range(step)], patch_size, self.patch_band)
+                print(f"[Voxel_RefinerXL] {sum(active.values())}/{len(active)} patches intersect the surface band")
+            else:
+                sdfs = []
+                for i in tqdm(range(batch_size), desc="Building SDFs"):
+                    idx = sparse_index[..., 0] == i
+                    sparse_sdf_i, sparse_index_i = sparse_sdf[idx].squeeze(-1), sparse_index[idx][..., 1:]
+                    sdf = torch.ones((res, res, res), dtype=sparse_sdf_i.dtype, device='cpu')
+                    sdf[sparse_index_i[..., 0], sparse_index_i[..., 1], sparse_index_i[..., 2]] = sparse_sdf_i.cpu()
+                    sdfs.append(sdf.unsqueeze(0))
+
+                sdfs = torch.stack(sdfs, dim=0)
+                feats = torch.zeros((batch_size, sparse_feat.shape[-1], res, res, res), dtype=dtype, device='cpu')
+
+                chunk_size = 10000
+                num_points = sparse_index.shape[0]
+
+                for start in tqdm(range(0, num_points, chunk_size), desc="Streaming feats"):
+                    end = min(start + chunk_size, num_points)
+                    
+                    batch_coords = sparse_index[start:end]
+                    batch_feats = sparse_feat[start:end]
+                    batch_coords = batch_coords.cpu()
+                    batch_feats = batch_feats.cpu() 
+                    feats[batch_coords[:,0], :, batch_coords[:,1], batch_coords[:,2], batch_coords[:,3]] = batch_feats
+
+            outputs = torch.ones([N,1,res,res,res], dtype=dtype, device='cpu')
             #sdfs = sdfs.to(dtype)
             patchs=[]
             for i in range(step):
                 for j in range(step):
                     for k in tqdm(range(step)):
-                        sdf = sdfs[:, :, stride * i: stride * i + patch_size,
-                                stride * j: stride * j + patch_size,
-                                stride * k: stride * k + patch_size].to(device)
-                        crop_feats = feats[:, :, stride * i: stride * i + patch_size, 
-                                        stride * j: stride * j + patch_size, 
-                                        stride * k: stride * k + patch_size].to(device)
-                        inputs = self.conv_in(sdf)
-                        crop_feats = self.latent_mlp(crop_feats.permute(0,2,3,4,1)).permute(0,4,1,2,3)
-                        inputs = torch.cat([inputs, crop_feats],dim=1)
-                        mid_feat = self.unet3d1(inputs)  
-                        mid_feat = adaptive_block(mid_feat, self.adaptive_conv1)
-                        mid_feat = self.mid_conv(mid_feat)
-                        mid_feat = adaptive_block(mid_feat, self.adaptive_conv2)
-                        final_feat = self.conv_out(mid_feat)
-                        final_feat = adaptive_block(final_feat, self.adaptive_conv3, weights_=mid_feat)
-                        output = F.tanh(final_feat)
-                        patchs.append(output)
+                        origin = (stride * i, stride * j, stride * k)
+                        if self.sparse_patches:
+                            if not active[(i, j, k)]:
+                                # empty space reads as outside
+                                patchs.append(torch.ones([N, 1, patch_size, patch_size, patch_size], dtype=dtype, device=device))
+                                continue
+                            sdf = gather_patch(sparse_index, sparse_sdf, N, origin, patch_size, 1.0)
+                            crop_feats = gather_patch(sparse_index, sparse_feat, N, origin, patch_size, 0.0)
+                        else:
+                            sdf = sdfs[:, :, stride * i: stride * i + patch_size,
+                                    stride * j: stride * j + patch_size,
+                                    stride * k: stride * k + patch_size].to(device)
+                            crop_feats = feats[:, :, stride * i: stride * i + patch_size, 
+                                            stride * j: stride * j + patch_size, 
+                                            stride * k: stride * k + patch_size].to(device)
+                        with span('refiner_patch', origin=origin):
+                            inputs = self.conv_in(sdf)
+                            crop_feats = self.latent_mlp(crop_feats.permute(0,2,3,4,1)).permute(0,4,1,2,3)
+                            inputs = torch.cat([inputs, crop_feats],dim=1)
+                            mid_feat = self.unet3d1(inputs)  
+                            mid_feat = adaptive_block(mid_feat, self.adaptive_conv1)
+                            mid_feat = self.mid_conv(mid_feat)
+                            mid_feat = adaptive_block(mid_feat, self.adaptive_conv2)
+                            final_feat = self.conv_out(mid_feat)
+                            final_feat = adaptive_block(final_feat, self.adaptive_conv3, weights_=mid_feat)
+                            output = F.tanh(final_feat)
+                            patchs.append(output)
 
             weights = torch.linspace(0, 1, steps=32, device=device, dtype=dtype)
 
@@ -209,7 +273,7 @@ class Voxel_RefinerXL(nn.Module):
 
             meshes = []
             for i in range(outputs.shape[0]):
-                vertices, faces, _, _ = measure.marching_cubes(outputs[i, 0].cpu().numpy(), level=mc_threshold, method='lewiner')
+                vertices, faces = slab_marching_cubes(outputs[i, 0].cpu().numpy(), level=mc_threshold)
                 vertices = vertices / res * 2 - 1
                 meshes.append(trimesh.Trimesh(vertices, faces))
             
@@ -238,6 +302,8 @@ class Voxel_RefinerXL_sign(nn.Module):
         self.patch_size = patch_size
         self.infer_patch_size = infer_patch_size
         self.res = res
+        self.sparse_patches = False
+        self.patch_band = 8
        
         self.use_fp16 = use_fp16
         self.dtype = torch.float16 if use_fp16 else torch.float32
@@ -246,6 +312,13 @@ class Voxel_RefinerXL_sign(nn.Module):
         
     def convert_to_fp16(self) -> None:
         self.apply(convert_module_to_f16)
+
+    def set_sparse_patches(self, enabled: bool = True, band: int = 8):
+        """
+        Only run the UNet on patches that intersect the surface band, see Voxel_RefinerXL.set_sparse_patches.
+        """
+        self.sparse_patches = enabled
+        self.patch_band = band
     
     def run(self,
              reconst_x=None,
@@ -254,23 +327,10 @@ class Voxel_RefinerXL_sign(nn.Module):
         ):
 
         with torch.no_grad():
-            device = reconst_x.feats.device
-            reconst_x.feats.cpu()
-            reconst_x.coords.cpu()
-            batch_size = int(reconst_x.coords[..., 0].max()) + 1
-            sparse_sdf, sparse_index = reconst_x.feats, reconst_x.coords        
-            voxel_resolution = 1024
-            sdfs = []
-
-            for i in tqdm(range(batch_size), desc="Building SDFs"):
-                idx = sparse_index[..., 0] == i
-                sparse_sdf_i, sparse_index_i = sparse_sdf[idx].squeeze(-1), sparse_index[idx][..., 1:]
-                sdf = torch.ones((voxel_resolution, voxel_resolution, voxel_resolution), dtype=sparse_sdf_i.dtype, device='cpu')
-                sdf[sparse_index_i[..., 0], sparse_index_i[..., 1], sparse_index_i[..., 2]] = sparse_sdf_i.cpu()
-                sdfs.append(sdf.unsqueeze(0))
-
-            sdfs1024 = torch.stack(sdfs,dim=0)
-            reconst_x1024 = reconst_x.cpu()
+            # the 1024 field is never materialized: sparse values are kept as they are and the
+            # 512 sign volume is upsampled lazily, one slab at a time, while meshing
+            sparse_index1024 = reconst_x.coords.cpu().numpy()
+            sparse_sdf1024 = reconst_x.feats.squeeze(-1).float().cpu().numpy()
             reconst_x = self.downsample(reconst_x)
             batch_size = int(reconst_x.coords[..., 0].max()) + 1
             sparse_sdf, sparse_index = reconst_x.feats, reconst_x.coords
@@ -278,45 +338,48 @@ class Voxel_RefinerXL_sign(nn.Module):
             dtype = sparse_sdf.dtype
             voxel_resolution = 512
 
-            sdfs = torch.ones((batch_size, 1, voxel_resolution, voxel_resolution, voxel_resolution),
-                            device="cpu", dtype=dtype)
-
-            for i in tqdm(range(batch_size), desc="Building 2nd set of SDFs"):
-                idx = sparse_index[..., 0] == i
-                sparse_sdf_i, sparse_index_i = sparse_sdf[idx].squeeze(-1), sparse_index[idx][..., 1:]
-                sdfs[i, 0, sparse_index_i[..., 0], sparse_index_i[..., 1], sparse_index_i[..., 2]] = sparse_sdf_i.cpu()
-
-            N = sdfs.shape[0]
-            outputs = torch.ones([N,1,512,512,512],device="cpu", dtype=dtype)
+            N = batch_size
             stride = 128
             patch_size = self.patch_size
             step = 3
+            if self.sparse_patches:
+                active = active_patches(sparse_index, voxel_resolution, [stride * i for i in range(step)], patch_size, self.patch_band)
+                print(f"[Voxel_RefinerXL_sign] {sum(active.values())}/{len(active)} patches intersect the surface band")
+            else:
+                sdfs = torch.ones((batch_size, 1, voxel_resolution, voxel_resolution, voxel_resolution),
+                                device="cpu", dtype=torch.float16)
+
+                for i in tqdm(range(batch_size), desc="Building 2nd set of SDFs"):
+                    idx = sparse_index[..., 0] == i
+                    sparse_sdf_i, sparse_index_i = sparse_sdf[idx].squeeze(-1), sparse_index[idx][..., 1:]
+                    sdfs[i, 0, sparse_index_i[..., 0], sparse_index_i[..., 1], sparse_index_i[..., 2]] = sparse_sdf_i.cpu().half()
+
+            # skipped patches keep the outside sign
+            outputs = torch.ones([N,1,512,512,512],device="cpu", dtype=torch.int8)
             for i in range(step):
                 for j in range(step):
                     for k in tqdm(range(step)):
-                        sdf = sdfs[:,:,stride*i:stride*i+patch_size,stride*j:stride*j+patch_size,stride*k:stride*k+patch_size].to(device)
-                        inputs = self.conv_in(sdf)
-                        mid_feat = self.unet3d1(inputs)  
-                        final_feat = self.conv_out(mid_feat)
-                        output = F.sigmoid(final_feat)
-                        output[output>=0.5] = 1
-                        output[output<0.5] = -1
-                        outputs[:, :, stride*i:stride*i+patch_size, stride*j:stride*j+patch_size, stride*k:stride*k+patch_size] = output.cpu()
-            outputs = outputs.repeat_interleave(2, dim=2).repeat_interleave(2, dim=3).repeat_interleave(2, dim=4)
-            sdfs = sdfs1024.clone()
-            sdfs = sdfs.abs()*outputs
-     
-            
-            sparse_index1024 = reconst_x1024.coords.cpu()
-            
-            sdfs[sparse_index1024[...,0], :, sparse_index1024[...,1], sparse_index1024[...,2],sparse_index1024[...,3]] = sdfs1024[sparse_index1024[...,0], :, sparse_index1024[...,1], sparse_index1024[...,2], sparse_index1024[...,3]]
-            outputs = sdfs.cpu().numpy()
-            grid_size = outputs.shape[2]
+                        if self.sparse_patches:
+                            if not active[(i, j, k)]:
+                                continue
+                            sdf = gather_patch(sparse_index, sparse_sdf, N, (stride*i, stride*j, stride*k), patch_size, 1.0)
+                        else:
+                            sdf = sdfs[:,:,stride*i:stride*i+patch_size,stride*j:stride*j+patch_size,stride*k:stride*k+patch_size].to(device, dtype)
+                        with span('refiner_patch', origin=(stride*i, stride*j, stride*k)):
+                            inputs = self.conv_in(sdf)
+                            mid_feat = self.unet3d1(inputs)  
+                            final_feat = self.conv_out(mid_feat)
+                            output = F.sigmoid(final_feat)
+                            output = torch.where(output >= 0.5, 1, -1).to(torch.int8)
+                            outputs[:, :, stride*i:stride*i+patch_size, stride*j:stride*j+patch_size, stride*k:stride*k+patch_size] = output.cpu()
+            outputs = outputs.numpy()
+            grid_size = outputs.shape[2] * 2
 
             meshes = []
             for i in range(outputs.shape[0]):
-                outputs_torch = outputs[i,0]
-                vertices, faces, _, _ = measure.marching_cubes(outputs_torch, level=mc_threshold, method="lewiner")
+                idx = sparse_index1024[:, 0] == i
+                field = UpsampledSignField(outputs[i, 0], sparse_index1024[idx, 1:], sparse_sdf1024[idx], factor=2)
+                vertices, faces = slab_marching_cubes(field, level=mc_threshold, size=grid_size)
                 vertices = vertices / grid_size * 2 - 1
                 meshes.append(trimesh.Trimesh(vertices, faces))
             return meshes
@@ -6,6 +6,8 @@ from ...modules.utils import zero_module, convert_module_to_f16, convert_module_
 from ...modules.transformer import AbsolutePositionEmbedder
 from ...modules import sparse as sp
 from ...modules.sparse.transformer.modulated import ModulatedSparseTransformerCrossBlock
+from ...modules.step_cache import StepCache
+from ...modules.ssa_profiler import SSAProfiler
 from .dense_dit import TimestepEmbedder
     
 
@@ -99,6 +101,11 @@ class SparseDiT(nn.Module):
         ])
         
         self.out_layer = sp.SparseLinear(model_channels, out_channels)
+        self.step_cache = None
+        self.token_merge_ratio = 0.0
+        self.token_merge_blocks = (0, 0)
+        self.merged_tokens = []
+        self.ssa_profiler = None
 
         self.initialize_weights()
         if use_fp16:
@@ -111,6 +118,55 @@ class SparseDiT(nn.Module):
         """
         return next(self.parameters()).device
 
+    def set_step_cache(self, threshold: float = 0.0, max_skips: int = 3) -> Optional[StepCache]:
+        """
+        Reuse the residual of the middle blocks across sampling steps while the first block's output
+        changes by less than `threshold` (see StepCache). A threshold of 0 disables the cache.
+        """
+        self.step_cache = StepCache(threshold, max_skips) if threshold > 0 else None
+        return self.step_cache
+
+    def set_token_merge(self, ratio: float = 0.0, start: Optional[int] = None, end: Optional[int] = None) -> None:
+        """
+        Merge `ratio` of the tokens with similar neighbours in their selection block before block `start`
+        and unmerge them before block `end` (see sp.TokenMerge). The range defaults to the middle half of
+        the blocks. A ratio of 0 disables merging.
+        """
+        start = self.num_blocks // 4 if start is None else start
+        end = self.num_blocks - self.num_blocks // 4 if end is None else end
+        self.token_merge_ratio = ratio
+        self.token_merge_blocks = (max(start, 0), min(end, self.num_blocks))
+        self.merged_tokens = []
+
+    def set_ssa_profiler(self, enabled: bool = False, collect_stats: bool = True) -> Optional[SSAProfiler]:
+        """
+        Profile the sub-stages of the spatial sparse attention of every block (see SSAProfiler).
+        Disabling detaches the profiler.
+        """
+        self.ssa_profiler = SSAProfiler(collect_stats) if enabled else None
+        for i, block in enumerate(self.blocks):
+            if hasattr(block.self_attn, 'profiler'):
+                block.self_attn.profiler = self.ssa_profiler
+                block.self_attn.block_index = i
+        return self.ssa_profiler
+
+    def _forward_blocks(self, h, t_emb, cond, start, stop):
+        merge_start, merge_end = self.token_merge_blocks
+        merging = self.token_merge_ratio > 0 and merge_start < merge_end
+        merge = None
+        for i in range(start, stop):
+            if merging and i == merge_start:
+                merge = sp.TokenMerge(h, self.token_merge_ratio, self.selection_block_size)
+                self.merged_tokens.append((merge.num_merged, merge.num_tokens))
+                unmerged, h = h, merge.merge(h)
+                merged = h
+            if merge is not None and i == merge_end:
+                h, merge = merge.unmerge(h, merged, unmerged), None
+            h = self.blocks[i](h, t_emb, cond)
+        if merge is not None:
+            h = merge.unmerge(h, merged, unmerged)
+        return h
+
     def convert_to_fp16(self) -> None:
         """
         Convert the torso of the model to float16.
@@ -151,6 +207,8 @@ class SparseDiT(nn.Module):
         nn.init.constant_(self.out_layer.bias, 0)
 
     def forward(self, x: sp.SparseTensor, t: torch.Tensor, cond: Union[torch.Tensor, sp.SparseTensor]) -> sp.SparseTensor:
+        # the conditioning object stays the same across steps, so it tells the CFG passes apart
+        cache_key = id(cond)
         h = self.input_layer(x).type(self.dtype)
         t_emb = self.t_embedder(t)
         if self.share_mod:
@@ -163,8 +221,19 @@ class SparseDiT(nn.Module):
             cond = cond + self.pos_embedder_cond(cond.coords[:, 1:]).type(self.dtype)
         if self.pe_mode == "ape":
             h = h + self.pos_embedder(h.coords[:, 1:], factor=self.factor).type(self.dtype)
-        for block in self.blocks:
-            h = block(h, t_emb, cond)
+        num_blocks = len(self.blocks)
+        if self.step_cache is not None and num_blocks > 2:
+            h = self._forward_blocks(h, t_emb, cond, 0, 1)
+            residual = self.step_cache.lookup(cache_key, h.feats)
+            if residual is not None:
+                h = h.replace(h.feats + residual)
+            else:
+                probe = h.feats
+                h = self._forward_blocks(h, t_emb, cond, 1, num_blocks - 1)
+                self.step_cache.store(cache_key, probe, h.feats - probe)
+            h = self._forward_blocks(h, t_emb, cond, num_blocks - 1, num_blocks)
+        else:
+            h = self._forward_blocks(h, t_emb, cond, 0, num_blocks)
 
         h = h.replace(F.layer_norm(h.feats, h.feats.shape[-1:]))
         h = self.out_layer(h.type(x.dtype))
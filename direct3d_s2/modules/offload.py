@@ -0,0 +1,125 @@
+from typing import *
+import torch
+import torch.nn as nn
+
+
+class BlockStreamer:
+    """
+    Sequential offload for a list of blocks executed in order.
+
+    The blocks live in (pinned) host memory and at most `resident` of them are kept on the device.
+    Before block i runs, blocks i+1 .. i+resident-1 are copied to the device on a side stream, so
+    transfers overlap with compute. Block i is returned to host memory once it finished.
+    Prefetching wraps around to the first blocks, which suits models run once per sampling step.
+    Blocks may also be skipped: anything resident outside the window of the block about to run is
+    evicted first, so the bound holds when callers jump over blocks.
+
+    The scheduling does not depend on CUDA: with a CPU `device` the copies are synchronous and the
+    `trace` of loads and evictions can be checked directly.
+
+    Args:
+        blocks (List[nn.Module]): Blocks in execution order.
+        device (torch.device): Execution device.
+        resident (int): Number of blocks kept on the device at once (at least 1).
+        pin_memory (bool): Pin the host copies of the weights when CUDA is available.
+    """
+    def __init__(self, blocks: List[nn.Module], device, resident: int = 2, pin_memory: bool = True):
+        self.blocks = list(blocks)
+        self.device = torch.device(device)
+        self.resident = max(1, min(resident, len(self.blocks)))
+        self.use_stream = self.device.type == 'cuda' and torch.cuda.is_available()
+        self.stream = torch.cuda.Stream(self.device) if self.use_stream else None
+        self.trace = []
+        self._host = []
+        self._loaded = {}
+        self._handles = []
+        for block in self.blocks:
+            tensors = []
+            for module in block.modules():
+                for name, tensor in list(module._parameters.items()) + list(module._buffers.items()):
+                    if tensor is None:
+                        continue
+                    host = tensor.data.to('cpu')
+                    if pin_memory and self.use_stream:
+                        host = host.pin_memory()
+                    tensor.data = host
+                    tensors.append((tensor, host))
+            self._host.append(tensors)
+        for i, block in enumerate(self.blocks):
+            self._handles.append(block.register_forward_pre_hook(self._make_pre_hook(i)))
+            self._handles.append(block.register_forward_hook(self._make_post_hook(i)))
+
+    def _make_pre_hook(self, i):
+        def hook(module, args):
+            # blocks prefetched for blocks that were then skipped (e.g. by the step cache) are
+            # never run or evicted by their own post-hook, so drop whatever is outside the window
+            n = len(self.blocks)
+            for j in self.resident_blocks():
+                if (j - i) % n >= self.resident:
+                    self._evict(j)
+            self._load(i)
+            if i in self._loaded and self._loaded[i] is not None:
+                torch.cuda.current_stream(self.device).wait_event(self._loaded[i])
+                for tensor, _ in self._host[i]:
+                    tensor.data.record_stream(torch.cuda.current_stream(self.device))
+                self._loaded[i] = None
+            for k in range(1, self.resident):
+                self._load((i + k) % len(self.blocks))
+        return hook
+
+    def _make_post_hook(self, i):
+        def hook(module, args, output):
+            if self.resident < len(self.blocks):
+                self._evict(i)
+        return hook
+
+    def _load(self, i):
+        if i in self._loaded:
+            return
+        self.trace.append(('load', i))
+        if self.use_stream:
+            self.stream.wait_stream(torch.cuda.current_stream(self.device))
+            with torch.cuda.stream(self.stream):
+                for tensor, host in self._host[i]:
+                    tensor.data = host.to(self.device, non_blocking=True)
+                event = torch.cuda.Event()
+                event.record(self.stream)
+            self._loaded[i] = event
+        else:
+            for tensor, host in self._host[i]:
+                tensor.data = host.to(self.device)
+            self._loaded[i] = None
+
+    def _evict(self, i):
+        if i not in self._loaded:
+            return
+        self.trace.append(('evict', i))
+        for tensor, host in self._host[i]:
+            tensor.data = host
+        del self._loaded[i]
+
+    def resident_blocks(self) -> List[int]:
+        return sorted(self._loaded.keys())
+
+    def release(self):
+        """
+        Return every block to host memory and remove the hooks.
+        """
+        for i in list(self._loaded.keys()):
+            self._evict(i)
+        for handle in self._handles:
+            handle.remove()
+        self._handles = []
+
+
+def stream_module_blocks(model: nn.Module, blocks: List[nn.Module], device, resident: int = 2) -> BlockStreamer:
+    """
+    Move `model` to `device` except for `blocks`, which are streamed by a BlockStreamer.
+    """
+    streamer = BlockStreamer(blocks, device, resident)
+    block_tensors = set(id(tensor) for tensors in streamer._host for tensor, _ in tensors)
+    for module in model.modules():
+        for name, tensor in list(module._parameters.items()) + list(module._buffers.items()):
+            if tensor is not None and id(tensor) not in block_tensors:
+                tensor.data = tensor.data.to(device)
+    return streamer
@@ -17,7 +17,7 @@ def __from_env():
     if env_sparse_attn is None:
         env_sparse_attn = os.environ.get('ATTN_BACKEND')
 
-    if env_sparse_backend is not None and env_sparse_backend in ['spconv', 'torchsparse']:
+    if env_sparse_backend is not None and env_sparse_backend in ['spconv', 'torchsparse', 'torch']:
         BACKEND = env_sparse_backend
     if env_sparse_debug is not None:
         DEBUG = env_sparse_debug == '1'
@@ -30,7 +30,7 @@ def __from_env():
 __from_env()
     
 
-def set_backend(backend: Literal['spconv', 'torchsparse']):
+def set_backend(backend: Literal['spconv', 'torchsparse', 'torch']):
     global BACKEND
     BACKEND = backend
 
@@ -72,10 +72,13 @@ __attributes = {
     'sparseconv3d_func': 'conv',
     'SparseDownsample': 'spatial',
     'SparseUpsample': 'spatial',
-    'SparseSubdivide' : 'spatial'
+    'SparseSubdivide' : 'spatial',
+    'chunked_token_apply': 'chunk',
+    'set_token_chunk_size': 'chunk',
+    'TokenMerge': 'token_merge',
 }
 
-__submodules = ['transformer']
+__submodules = ['transformer', 'keys']
 
 __all__ = list(__attributes.keys()) + __submodules
 
@@ -102,4 +105,6 @@ if __name__ == '__main__':
     from .attention import *
     from .conv import *
     from .spatial import *
+    from .chunk import *
+    from .token_merge import *
     import transformer
@@ -3,6 +3,7 @@ import torch
 import torch.nn as nn
 import torch.nn.functional as F
 from .. import SparseTensor
+from ..chunk import chunked_token_apply
 from .full_attn import sparse_scaled_dot_product_attention
 from .serialized_attn import SerializeMode, sparse_serialized_scaled_dot_product_self_attention
 from .windowed_attn import sparse_windowed_scaled_dot_product_self_attention
@@ -15,14 +16,13 @@ class SparseMultiHeadRMSNorm(nn.Module):
         self.scale = dim ** 0.5
         self.gamma = nn.Parameter(torch.ones(heads, dim))
 
+    def _norm(self, x: torch.Tensor) -> torch.Tensor:
+        return (F.normalize(x.float(), dim=-1) * self.gamma * self.scale).to(x.dtype)
+
     def forward(self, x: Union[SparseTensor, torch.Tensor]) -> Union[SparseTensor, torch.Tensor]:
-        x_type = x.dtype
-        x = x.float()
         if isinstance(x, SparseTensor):
-            x = x.replace(F.normalize(x.feats, dim=-1))
-        else:
-            x = F.normalize(x, dim=-1)            
-        return (x * self.gamma * self.scale).to(x_type)
+            return x.replace(chunked_token_apply(self._norm, x.feats))
+        return self._norm(x)
 
 
 class SparseMultiHeadAttention(nn.Module):
@@ -77,7 +77,7 @@ class SparseMultiHeadAttention(nn.Module):
     @staticmethod
     def _linear(module: nn.Linear, x: Union[SparseTensor, torch.Tensor]) -> Union[SparseTensor, torch.Tensor]:
         if isinstance(x, SparseTensor):
-            return x.replace(module(x.feats))
+            return x.replace(chunked_token_apply(module, x.feats))
         else:
             return module(x)
 
@@ -1,9 +1,11 @@
 from typing import *
 from enum import Enum
+from collections import OrderedDict
 import torch
 import math
 from .. import SparseTensor
 from .. import DEBUG, ATTN
+from . import vox2seq
 
 if ATTN == 'xformers':
     import xformers.ops as xops
@@ -18,6 +20,18 @@ __all__ = [
 ]
 
 
+# Serializations of recently seen coordinate tensors. The sampling loop reuses the same
+# coordinate tensor for every step, so its serialization only has to be computed once.
+# Entries hold a reference to their coordinates, which keeps data_ptr keys from being reused, so
+# the pipeline clears the cache after every job to release those device tensors.
+SERIALIZATION_CACHE_SIZE = 16
+_serialization_cache = OrderedDict()
+
+
+def clear_serialization_cache():
+    _serialization_cache.clear()
+
+
 class SerializeMode(Enum):
     Z_ORDER = 0
     Z_ORDER_TRANSPOSED = 1
@@ -58,9 +72,6 @@ def calc_serialization(
     seq_lens = []
     seq_batch_indices = []
     offsets = [0]
-    
-    if 'vox2seq' not in globals():
-        import vox2seq
 
     # Serialize the input
     serialize_coords = tensor.coords[:, 1:].clone()
@@ -140,8 +151,19 @@ def sparse_serialized_scaled_dot_product_self_attention(
     serialization_spatial_cache_name = f'serialization_{serialize_mode}_{window_size}_{shift_sequence}_{shift_window}'
     serialization_spatial_cache = qkv.get_spatial_cache(serialization_spatial_cache_name)
     if serialization_spatial_cache is None:
-        fwd_indices, bwd_indices, seq_lens, seq_batch_indices = calc_serialization(qkv, window_size, serialize_mode, shift_sequence, shift_window)
-        qkv.register_spatial_cache(serialization_spatial_cache_name, (fwd_indices, bwd_indices, seq_lens, seq_batch_indices))
+        coords = qkv.coords
+        key = (coords.data_ptr(), tuple(coords.shape), coords._version, str(coords.device), serialization_spatial_cache_name)
+        cached = _serialization_cache.get(key)
+        if cached is not None and cached[0] is coords:
+            _serialization_cache.move_to_end(key)
+            serialization = cached[1]
+        else:
+            serialization = calc_serialization(qkv, window_size, serialize_mode, shift_sequence, shift_window)
+            _serialization_cache[key] = (coords, serialization)
+            while len(_serialization_cache) > SERIALIZATION_CACHE_SIZE:
+                _serialization_cache.popitem(last=False)
+        fwd_indices, bwd_indices, seq_lens, seq_batch_indices = serialization
+        qkv.register_spatial_cache(serialization_spatial_cache_name, serialization)
     else:
         fwd_indices, bwd_indices, seq_lens, seq_batch_indices = serialization_spatial_cache
 
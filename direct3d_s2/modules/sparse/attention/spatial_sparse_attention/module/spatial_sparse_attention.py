@@ -1,5 +1,6 @@
 import torch
 import torch.nn as nn
+from contextlib import nullcontext
 from einops import rearrange
 from flash_attn import flash_attn_varlen_func
 from ..ops import (
@@ -78,6 +79,10 @@ class SpatialSparseAttention(torch.nn.Module):
             sp.SparseLinear(hidden_size, 3, bias=False), sp.SparseSigmoid(),
         )
 
+        # set by SparseDiT.set_ssa_profiler
+        self.profiler = None
+        self.block_index = None
+
     def sparse3d_compression(self, x, key=True):
         _, num_heads, num_dim = x.feats.shape
         x = x.replace(x.feats.view(-1, num_heads * num_dim))
@@ -92,18 +97,25 @@ class SpatialSparseAttention(torch.nn.Module):
         y = y.replace(y.feats.view(-1, num_heads, num_dim))
         return y
 
+    def _stage(self, name, device):
+        if self.profiler is None:
+            return nullcontext()
+        return self.profiler.stage(name, self.block_index, device)
+
     def forward(self, x: sp.SparseTensor):
         # dtype and shape check
         assert x.shape[-1] == self.hidden_size
         assert self.selection_block_size % self.compression_block_size == 0
         # qkv proj
-        q = x.replace(self.proj_q(x).feats.view(-1, self.num_q_heads, self.head_dim))
-        k = x.replace(self.proj_k(x).feats.view(-1, self.num_kv_heads, self.head_dim))
-        v = x.replace(self.proj_v(x).feats.view(-1, self.num_kv_heads, self.head_dim))
+        with self._stage('qkv', x.device):
+            q = x.replace(self.proj_q(x).feats.view(-1, self.num_q_heads, self.head_dim))
+            k = x.replace(self.proj_k(x).feats.view(-1, self.num_kv_heads, self.head_dim))
+            v = x.replace(self.proj_v(x).feats.view(-1, self.num_kv_heads, self.head_dim))
 
         # compression attention
-        compressed_k = self.sparse3d_compression(k, key=True)
-        compressed_v = self.sparse3d_compression(v, key=False)
+        with self._stage('compression', x.device):
+            compressed_k = self.sparse3d_compression(k, key=True)
+            compressed_v = self.sparse3d_compression(v, key=False)
         
         compressed_cu_seqlens = torch.tensor([s.start for s in compressed_v.layout] + [s.stop for s in compressed_v.layout if s.stop not in [s.start for s in compressed_v.layout]]).to(compressed_v.device).to(torch.int32)
         compressed_seqlens = compressed_cu_seqlens[1:] - compressed_cu_seqlens[:-1]
@@ -111,45 +123,61 @@ class SpatialSparseAttention(torch.nn.Module):
         cu_seqlens = torch.tensor([s.start for s in x.layout] + [s.stop for s in x.layout if s.stop not in [s.start for s in x.layout]]).to(x.device).to(torch.int32)
         seqlens = cu_seqlens[1:] - cu_seqlens[:-1]
 
-        compressed_attn_output, lse, _ = flash_attn_varlen_func(
-            q.feats,
-            compressed_k.feats,
-            compressed_v.feats,
-            cu_seqlens,
-            compressed_cu_seqlens,
-            seqlens.max().item(),
-            compressed_seqlens.max().item(),
-            causal=False,
-            return_attn_probs=True,
-        )
+        with self._stage('compressed_attention', x.device):
+            compressed_attn_output, lse, _ = flash_attn_varlen_func(
+                q.feats,
+                compressed_k.feats,
+                compressed_v.feats,
+                cu_seqlens,
+                compressed_cu_seqlens,
+                seqlens.max().item(),
+                compressed_seqlens.max().item(),
+                causal=False,
+                return_attn_probs=True,
+            )
 
-        with torch.no_grad():
+        with torch.no_grad(), self._stage('block_score', x.device):
             block_topk, cu_seqblocks, cu_block_include_tokens = get_block_score(
                 q, compressed_k, lse, self.resolution, self.compression_block_size,
                 self.selection_block_size, self.topk, cu_seqlens, compressed_cu_seqlens,
                 seqlens, compressed_seqlens, None)
+        if self.profiler is not None:
+            self.profiler.record_selection(self.block_index, block_topk, cu_seqblocks, cu_block_include_tokens, cu_seqlens)
 
         # spatial selection attention
-        selection_attn_output = spatial_selection_attention(
-            q.feats, k.feats, v.feats, block_topk, cu_seqblocks,
-            cu_block_include_tokens, self.selection_block_size, cu_seqlens, None,
-        )
+        with self._stage('selection_attention', x.device):
+            selection_attn_output = spatial_selection_attention(
+                q.feats, k.feats, v.feats, block_topk, cu_seqblocks,
+                cu_block_include_tokens, self.selection_block_size, cu_seqlens, None,
+            )
         
         # window attention
-        window_attn_output = sparse_window_attention(
-            q, k, v, window_size=self.window_size, shift_window=self.shift_window,
-        ).feats
+        with self._stage('window_attention', x.device):
+            window_attn_output = sparse_window_attention(
+                q, k, v, window_size=self.window_size, shift_window=self.shift_window,
+            ).feats
+        if self.profiler is not None:
+            # the window partition is cached on q by sparse_window_attention
+            partition = q.get_spatial_cache(f'window_partition_{self.window_size}_{self.shift_window}')
+            if partition is not None:
+                self.profiler.record_windows(self.block_index, partition[2], self.window_size)
         
-        # gate average
-        gate = self.gate(x).feats
+        # gate average, rearrange and output proj, token-wise in chunks
+        with self._stage('gating', x.device):
+            gate = self.gate(x).feats
+            attn_output = sp.chunked_token_apply(
+                self._gate_and_project, gate, compressed_attn_output, selection_attn_output, window_attn_output
+            )
+        if self.profiler is not None:
+            self.profiler.record_gate(self.block_index, gate)
+
+        return x.replace(attn_output)
+
+    def _gate_and_project(self, gate, compressed_attn_output, selection_attn_output, window_attn_output):
         attn_output = (
             gate[:, 0:1, None] * compressed_attn_output
             + gate[:, 1:2, None] * selection_attn_output
             + gate[:, 2:3, None] * window_attn_output
         )
-
-        # rearrange and output proj
         attn_output = rearrange(attn_output, "n h d -> n (h d)")
-        attn_output = self.proj_o(attn_output)
-
-        return x.replace(attn_output)
+        return self.proj_o(attn_output)
@@ -21,6 +21,7 @@ from copy import deepcopy
 import triton
 import triton.language as tl
 import direct3d_s2.modules.sparse as sp
+from direct3d_s2.modules.sparse.keys import linear_index, unique_keys
 
 
 @triton.jit
@@ -236,7 +237,7 @@ def get_block_score(
             block_topk[:, q_start: q_end, :real_topk] = block_topk_b
         else:
             compressed_block_coords_b[:, 1:] = compressed_block_coords_b[:, 1:] // (block_size//kernel_stride)
-            compressed_block_coords_flatten_b = compressed_block_coords_b[:, 1] * block_res**2 + compressed_block_coords_b[:, 2] * block_res + compressed_block_coords_b[:, 3]
+            compressed_block_coords_flatten_b = linear_index(compressed_block_coords_b[:, 1:], block_res)
             score_block_b = torch.scatter_reduce(
                 torch.zeros((num_kv_head, q_len, block_res**3), device=attn_score_b.device, dtype=attn_score_b.dtype),
                 index=compressed_block_coords_flatten_b.long().unsqueeze(0).unsqueeze(0).expand_as(attn_score_b),
@@ -244,7 +245,7 @@ def get_block_score(
                 reduce="sum",
                 dim=2,
             )
-            compressed_block_coords_flatten_unique_b = compressed_block_coords_flatten_b.unique()
+            compressed_block_coords_flatten_unique_b = unique_keys(compressed_block_coords_flatten_b)
             score_block_b = score_block_b[..., compressed_block_coords_flatten_unique_b]
             real_topk = min(topk, len(compressed_block_coords_flatten_unique_b))
             block_topk_b = score_block_b.topk(real_topk, dim=-1).indices.sort(-1).values
@@ -252,14 +253,14 @@ def get_block_score(
 
         block_coords_b = q_coords[q_start: q_end]
         block_coords_b[:, 1:] = block_coords_b[:, 1:] // block_size
-        block_coords_flatten_b = block_coords_b[:, 1] * block_res**2 + block_coords_b[:, 2] * block_res + block_coords_b[:, 3]
-        block_bins_b = torch.histc(block_coords_flatten_b, bins=block_res**3, min=0, max=block_res**3-1)
-        block_include_tokens.append(block_bins_b[block_bins_b > 0])
+        block_coords_flatten_b = linear_index(block_coords_b[:, 1:], block_res)
+        _, block_bins_b = unique_keys(block_coords_flatten_b, return_counts=True)
+        block_include_tokens.append(block_bins_b)
         seqblocks.append(len(block_include_tokens[-1]))
     seqblocks = torch.Tensor(seqblocks).to(attn_score.device)
     cu_seqblocks = torch.cat(
         [
-            torch.zeros(1, dtype=torch.int32, device="cuda"),
+            torch.zeros(1, dtype=torch.int32, device=attn_score.device),
             torch.cumsum(seqblocks, dim=0),
         ],
         dim=0,
@@ -267,7 +268,7 @@ def get_block_score(
     block_include_tokens = torch.cat(block_include_tokens)
     cu_block_include_tokens = torch.cat(
         [
-            torch.zeros(1, dtype=torch.int32, device="cuda"),
+            torch.zeros(1, dtype=torch.int32, device=attn_score.device),
             torch.cumsum(block_include_tokens, dim=0),
         ],
         dim=0,
@@ -0,0 +1,36 @@
+from typing import *
+import torch
+from ..keys import morton_encode, hilbert_encode
+
+__all__ = [
+    'encode',
+]
+
+
+def encode(
+    coords: torch.Tensor,
+    permute: List[int] = [0, 1, 2],
+    mode: Literal['z_order', 'hilbert'] = 'z_order'
+) -> torch.Tensor:
+    """
+    Encode 3D coordinates into Z-order or Hilbert codes.
+    Drop-in replacement for the vox2seq extension that runs on CPU and GPU tensors.
+
+    Args:
+        coords (torch.Tensor): [N, 3] non-negative integer coordinates in [0, 1023].
+        permute (List[int]): Axis order; the first axis is the most significant.
+        mode (str): 'z_order' or 'hilbert'.
+
+    Returns:
+        (torch.Tensor): [N] int64 codes.
+    """
+    assert coords.shape[-1] == 3 and coords.ndim == 2, "Input coordinates must be of shape [N, 3]"
+    x = coords[:, permute[0]].int()
+    y = coords[:, permute[1]].int()
+    z = coords[:, permute[2]].int()
+    if mode == 'z_order':
+        return morton_encode(x, y, z)
+    elif mode == 'hilbert':
+        return hilbert_encode(x, y, z, bits=10)
+    else:
+        raise ValueError(f"Unknown encode mode: {mode}")
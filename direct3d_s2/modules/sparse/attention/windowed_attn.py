@@ -3,6 +3,7 @@ import torch
 import math
 from .. import SparseTensor
 from .. import DEBUG, ATTN
+from ..keys import window_keys, stable_argsort, invert_permutation, COORD_BITS
 
 if ATTN == 'xformers':
     import xformers.ops as xops
@@ -36,26 +37,14 @@ def calc_window_partition(
         (List[int]): Sequence lengths.
         (List[int]): Sequence batch indices.
     """
+    keys = window_keys(tensor.coords, window_size, shift_window)
+    sorted_keys, fwd_indices = stable_argsort(keys)
+    bwd_indices = invert_permutation(fwd_indices)
+    windows, seq_lens = torch.unique_consecutive(sorted_keys, return_counts=True)
     DIM = tensor.coords.shape[1] - 1
-    shift_window = (shift_window,) * DIM if isinstance(shift_window, int) else shift_window
-    window_size = (window_size,) * DIM if isinstance(window_size, int) else window_size
-    shifted_coords = tensor.coords.clone().detach()
-    shifted_coords[:, 1:] += torch.tensor(shift_window, device=tensor.device, dtype=torch.int32).unsqueeze(0)
-
-    MAX_COORDS = shifted_coords[:, 1:].max(dim=0).values.tolist()
-    NUM_WINDOWS = [math.ceil((mc + 1) / ws) for mc, ws in zip(MAX_COORDS, window_size)]
-    OFFSET = torch.cumprod(torch.tensor([1] + NUM_WINDOWS[::-1]), dim=0).tolist()[::-1]
-
-    shifted_coords[:, 1:] //= torch.tensor(window_size, device=tensor.device, dtype=torch.int32).unsqueeze(0)
-    shifted_indices = (shifted_coords * torch.tensor(OFFSET, device=tensor.device, dtype=torch.int32).unsqueeze(0)).sum(dim=1)
-    fwd_indices = torch.argsort(shifted_indices)
-    bwd_indices = torch.empty_like(fwd_indices)
-    bwd_indices[fwd_indices] = torch.arange(fwd_indices.shape[0], device=tensor.device)
-    seq_lens = torch.bincount(shifted_indices)
-    seq_batch_indices = torch.arange(seq_lens.shape[0], device=tensor.device, dtype=torch.int32) // OFFSET[0]
-    mask = seq_lens != 0
-    seq_lens = seq_lens[mask].tolist()
-    seq_batch_indices = seq_batch_indices[mask].tolist()
+    seq_batch_indices = windows >> (COORD_BITS * DIM)
+    seq_lens = seq_lens.tolist()
+    seq_batch_indices = seq_batch_indices.tolist()
 
     return fwd_indices, bwd_indices, seq_lens, seq_batch_indices
     
@@ -14,9 +14,27 @@ __all__ = [
 ]
 
 
+class TorchSparseTensorData:
+    """
+    Minimal sparse tensor container for the pure PyTorch backend.
+    Kernel maps are kept in the spatial cache of SparseTensor instead of on the data object.
+    """
+    def __init__(self, feats: torch.Tensor, coords: torch.Tensor):
+        self.feats = feats
+        self.coords = coords
+
+    def dense(self) -> torch.Tensor:
+        coords = self.coords.long()
+        spatial_shape = (coords[:, 1:].max(0)[0] + 1).tolist()
+        batch_size = coords[:, 0].max().item() + 1
+        out = torch.zeros((batch_size, *spatial_shape, *self.feats.shape[1:]), dtype=self.feats.dtype, device=self.feats.device)
+        out[coords[:, 0], coords[:, 1], coords[:, 2], coords[:, 3]] = self.feats
+        return out
+
+
 class SparseTensor:
     """
-    Sparse tensor with support for both torchsparse and spconv backends.
+    Sparse tensor with support for torchsparse, spconv and pure PyTorch backends.
     
     Parameters:
     - feats (torch.Tensor): Features of the sparse tensor.
@@ -44,6 +62,8 @@ class SparseTensor:
                 SparseTensorData = importlib.import_module('torchsparse').SparseTensor
             elif BACKEND == 'spconv':
                 SparseTensorData = importlib.import_module('spconv.pytorch').SparseConvTensor
+            elif BACKEND == 'torch':
+                SparseTensorData = TorchSparseTensorData
                 
         method_id = 0
         if len(args) != 0:
@@ -76,6 +96,8 @@ class SparseTensor:
                 spatial_shape = list(coords.max(0)[0] + 1)[1:]
                 self.data = SparseTensorData(feats.reshape(feats.shape[0], -1), coords, spatial_shape, shape[0], **kwargs)
                 self.data._features = feats
+            elif BACKEND == 'torch':
+                self.data = SparseTensorData(feats, coords)
         elif method_id == 1:
             data, shape, layout = args + (None,) * (3 - len(args))
             if 'data' in kwargs:
@@ -143,6 +165,8 @@ class SparseTensor:
             return self.data.F
         elif BACKEND == 'spconv':
             return self.data.features
+        elif BACKEND == 'torch':
+            return self.data.feats
     
     @feats.setter
     def feats(self, value: torch.Tensor):
@@ -150,6 +174,8 @@ class SparseTensor:
             self.data.F = value
         elif BACKEND == 'spconv':
             self.data.features = value
+        elif BACKEND == 'torch':
+            self.data.feats = value
 
     @property
     def coords(self) -> torch.Tensor:
@@ -157,6 +183,8 @@ class SparseTensor:
             return self.data.C
         elif BACKEND == 'spconv':
             return self.data.indices
+        elif BACKEND == 'torch':
+            return self.data.coords
         
     @coords.setter
     def coords(self, value: torch.Tensor):
@@ -164,6 +192,8 @@ class SparseTensor:
             self.data.C = value
         elif BACKEND == 'spconv':
             self.data.indices = value
+        elif BACKEND == 'torch':
+            self.data.coords = value
 
     @property
     def dtype(self):
@@ -232,6 +262,8 @@ class SparseTensor:
             return self.data.dense()
         elif BACKEND == 'spconv':
             return self.data.dense()
+        elif BACKEND == 'torch':
+            return self.data.dense()
 
     def reshape(self, *shape) -> 'SparseTensor':
         new_feats = self.feats.reshape(self.feats.shape[0], *shape)
@@ -270,6 +302,8 @@ class SparseTensor:
             new_data.int8_scale = self.data.int8_scale
             if coords is not None:
                 new_data.indices = coords
+        elif BACKEND == 'torch':
+            new_data = SparseTensorData(feats, self.data.coords if coords is None else coords)
         new_tensor = SparseTensor(new_data, shape=torch.Size(new_shape), layout=self.layout, scale=self._scale, spatial_cache=self._spatial_cache)
         return new_tensor
 
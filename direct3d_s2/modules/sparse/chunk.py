@@ -0,0 +1,58 @@
+from typing import *
+import torch
+
+__all__ = [
+    'chunked_token_apply',
+    'set_token_chunk_size',
+    'get_token_chunk_size',
+]
+
+# Token-wise layers (FFN, projections, norms) are applied to at most TOKEN_CHUNK_SIZE rows at a time,
+# so their transient activations scale with the chunk size instead of the token count.
+# 0 disables chunking. Chunking is only used when autograd is disabled.
+TOKEN_CHUNK_SIZE = 0
+
+def __from_env():
+    import os
+
+    global TOKEN_CHUNK_SIZE
+    env_chunk_size = os.environ.get('SPARSE_TOKEN_CHUNK')
+    if env_chunk_size is not None and env_chunk_size.isdigit():
+        TOKEN_CHUNK_SIZE = int(env_chunk_size)
+        print(f"[SPARSE] Token chunk size: {TOKEN_CHUNK_SIZE}")
+
+
+__from_env()
+
+
+def set_token_chunk_size(chunk_size: int):
+    global TOKEN_CHUNK_SIZE
+    TOKEN_CHUNK_SIZE = max(int(chunk_size), 0)
+
+
+def get_token_chunk_size() -> int:
+    return TOKEN_CHUNK_SIZE
+
+
+def chunked_token_apply(fn: Callable[..., torch.Tensor], *inputs: torch.Tensor, chunk_size: Optional[int] = None) -> torch.Tensor:
+    """
+    Apply a token-wise function to the rows of `inputs` in chunks, writing into a preallocated output.
+
+    Args:
+        fn (Callable): Function mapping [n, ...] rows of each input to [n, ...] output rows.
+            It must not mix information across rows.
+        inputs (torch.Tensor): Tensors sharing the same number of rows.
+        chunk_size (int): Rows per chunk. Defaults to the global token chunk size.
+    """
+    chunk_size = TOKEN_CHUNK_SIZE if chunk_size is None else chunk_size
+    num_tokens = inputs[0].shape[0]
+    if chunk_size <= 0 or num_tokens <= chunk_size or torch.is_grad_enabled():
+        return fn(*inputs)
+    out = None
+    for start in range(0, num_tokens, chunk_size):
+        res = fn(*[t[start:start + chunk_size] for t in inputs])
+        if out is None:
+            out = torch.empty((num_tokens, *res.shape[1:]), dtype=res.dtype, device=res.device)
+        out[start:start + res.shape[0]] = res
+        del res
+    return out
@@ -3,6 +3,7 @@ import torch.nn as nn
 from .. import SparseTensor
 from .. import DEBUG
 from . import SPCONV_ALGO
+from .kernel_map import coords_id, lookup_kernel_map, register_kernel_map, kernel_map_timer
 
 class SparseConv3d(nn.Module):
     def __init__(self, in_channels, out_channels, kernel_size, stride=1, dilation=1, padding=None, bias=True, indice_key=None):
@@ -14,6 +15,10 @@ class SparseConv3d(nn.Module):
             algo = spconv.ConvAlgo.Native
         elif SPCONV_ALGO == 'implicit_gemm':
             algo = spconv.ConvAlgo.MaskImplicitGemm
+        # submanifold convs without an explicit indice_key share their indice pairs through the kernel map registry.
+        # Convs with an explicit padding (e.g. the padding=1 convs of the decoder and encoder) are regular spconv
+        # convolutions that grow the active set, so their pairs are not submanifold maps and are never shared.
+        self.auto_indice_key = stride == 1 and (padding is None) and indice_key is None
         if stride == 1 and (padding is None):
             self.conv = spconv.SubMConv3d(in_channels, out_channels, kernel_size, dilation=dilation, bias=bias, indice_key=indice_key, algo=algo)
         else:
@@ -24,7 +29,17 @@ class SparseConv3d(nn.Module):
     def forward(self, x: SparseTensor) -> SparseTensor:
 
         spatial_changed = any(s != 1 for s in self.stride) or (self.padding is not None)
-        new_data = self.conv(x.data)
+        if self.auto_indice_key:
+            kernel_size, dilation = self.conv.kernel_size, self.conv.dilation
+            self.conv.indice_key = f'kmap_{hash(coords_id(x.coords))}_{kernel_size}_{dilation}'
+            pairs = lookup_kernel_map(x, kernel_size, 1, dilation)
+            if pairs is not None:
+                x.data.indice_dict[self.conv.indice_key] = pairs
+            with kernel_map_timer('compute' if pairs is not None else 'build'):
+                new_data = self.conv(x.data)
+            register_kernel_map(x, kernel_size, 1, dilation, new_data.indice_dict[self.conv.indice_key])
+        else:
+            new_data = self.conv(x.data)
         new_shape = [x.shape[0], self.conv.out_channels]
         new_layout = None if spatial_changed else x.layout
 
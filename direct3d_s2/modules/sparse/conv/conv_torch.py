@@ -0,0 +1,208 @@
+import math
+import torch
+import torch.nn as nn
+from .. import SparseTensor
+from ..keys import pack_coords, stable_argsort, lookup_keys
+from .kernel_map import lookup_kernel_map, register_kernel_map, kernel_map_timer
+
+
+def _ntuple(x, ndim=3):
+    return tuple(x) if isinstance(x, (list, tuple)) else (x,) * ndim
+
+
+def kernel_offsets(kernel_size, dilation=1, device=None) -> torch.Tensor:
+    """
+    Kernel offsets in the weight layout used by torchsparse, so checkpoints trained with
+    torchsparse load unchanged: x varies fastest for odd kernel volumes, z for even ones.
+    """
+    kernel_size = _ntuple(kernel_size)
+    dilation = _ntuple(dilation)
+    axes = [torch.arange(-k // 2 + 1, k // 2 + 1) * d for k, d in zip(kernel_size, dilation)]
+    if math.prod(kernel_size) % 2 == 1:
+        offsets = [[x, y, z] for z in axes[2] for y in axes[1] for x in axes[0]]
+    else:
+        offsets = [[x, y, z] for x in axes[0] for y in axes[1] for z in axes[2]]
+    return torch.tensor(offsets, dtype=torch.long, device=device)
+
+
+def build_neighbor_table(in_coords: torch.Tensor, out_coords: torch.Tensor, offsets: torch.Tensor, stride=1) -> torch.Tensor:
+    """
+    Neighbour table of a sparse convolution built by coordinate hashing.
+
+    Returns:
+        (torch.Tensor): [K, N_out] index of the input voxel at `out * stride + offset[k]`, or -1.
+    """
+    stride = torch.tensor(_ntuple(stride), dtype=torch.long, device=out_coords.device)
+    in_keys, order = stable_argsort(pack_coords(in_coords))
+    base = out_coords.long().clone()
+    base[:, 1:] *= stride
+    table = torch.empty((offsets.shape[0], out_coords.shape[0]), dtype=torch.long, device=out_coords.device)
+    for k in range(offsets.shape[0]):
+        query = base.clone()
+        query[:, 1:] += offsets[k].to(query.device)
+        valid = (query[:, 1:] >= 0).all(dim=-1)
+        found, pos = lookup_keys(in_keys, pack_coords(query.clamp(min=0)))
+        table[k] = torch.where(found & valid, order[pos], torch.full_like(pos, -1))
+    return table
+
+
+def subdivide_neighbor_table(parent_table: torch.Tensor) -> torch.Tensor:
+    """
+    Derive the 3x3x3 neighbour table of a SparseSubdivide output from the 3x3x3 table of its input.
+    Child `p * 8 + (ox * 4 + oy * 2 + oz)` of parent p has its neighbour at offset d in child
+    `q * 8 + code((o + d) mod 2)`, where q is the parent neighbour at offset floor((o + d) / 2).
+    """
+    device = parent_table.device
+    num_parents = parent_table.shape[1]
+    code = torch.arange(8, device=device)
+    children = torch.stack([(code >> 2) & 1, (code >> 1) & 1, code & 1], dim=-1)
+    offsets = kernel_offsets(3, device=device)
+    shifted = children.unsqueeze(0) + offsets.unsqueeze(1)                          # [27, 8, 3]
+    parent_offset = torch.div(shifted, 2, rounding_mode='floor')
+    child_offset = shifted - 2 * parent_offset
+    parent_k = (parent_offset[..., 2] + 1) * 9 + (parent_offset[..., 1] + 1) * 3 + (parent_offset[..., 0] + 1)
+    child_code = child_offset[..., 0] * 4 + child_offset[..., 1] * 2 + child_offset[..., 2]
+    gathered = parent_table[parent_k.flatten()].reshape(27, 8, num_parents)
+    table = torch.where(gathered >= 0, gathered * 8 + child_code.unsqueeze(-1), torch.full_like(gathered, -1))
+    return table.permute(0, 2, 1).reshape(27, num_parents * 8)
+
+
+def get_kernel_map(x: SparseTensor, kernel_size, stride=1, dilation=1) -> dict:
+    """
+    Kernel map of `x` for a convolution, shared through the kernel map registry.
+    Maps of subdivided tensors are derived from the map of their parent when available.
+    """
+    kernel_size, stride, dilation = _ntuple(kernel_size), _ntuple(stride), _ntuple(dilation)
+    kmap = lookup_kernel_map(x, kernel_size, stride, dilation)
+    if kmap is not None:
+        return kmap
+
+    with kernel_map_timer('build'):
+        submanifold = all(s == 1 for s in stride)
+        table = None
+        if submanifold and kernel_size == (3, 3, 3) and dilation == (1, 1, 1):
+            parent = x.get_spatial_cache('subdivide_parent')
+            if parent is not None and parent[1] is x.coords:
+                parent_map = lookup_kernel_map(x, kernel_size, stride, dilation, coords=parent[0])
+                if parent_map is not None:
+                    table = subdivide_neighbor_table(parent_map['table'])
+        if submanifold:
+            out_coords = x.coords
+        else:
+            stride_t = torch.tensor(stride, device=x.device).unsqueeze(0)
+            out_coords = torch.cat([x.coords[:, :1], x.coords[:, 1:] // stride_t], dim=-1)
+            out_coords = torch.unique(out_coords, dim=0).int()
+        if table is None:
+            table = build_neighbor_table(x.coords, out_coords, kernel_offsets(kernel_size, dilation, x.device), stride)
+
+    kmap = {'out_coords': out_coords, 'table': table}
+    register_kernel_map(x, kernel_size, stride, dilation, kmap)
+    return kmap
+
+
+def gather_gemm_scatter(feats: torch.Tensor, table: torch.Tensor, weight: torch.Tensor, num_out: int, transposed: bool = False) -> torch.Tensor:
+    """
+    Sparse convolution as one gather-GEMM-scatter per kernel offset.
+    `weight` is [K, C_in, C_out] (or [C_in, C_out] for a 1x1x1 kernel).
+    For transposed convolutions `table` indexes outputs by input instead of inputs by output.
+    """
+    if weight.dim() == 2:
+        weight = weight.unsqueeze(0)
+    out = torch.zeros((num_out, weight.shape[-1]), dtype=feats.dtype, device=feats.device)
+    for k in range(table.shape[0]):
+        idx = table[k]
+        valid = (idx >= 0).nonzero().squeeze(-1)
+        if valid.numel() == 0:
+            continue
+        if transposed:
+            out.index_add_(0, idx[valid], feats[valid] @ weight[k])
+        else:
+            out.index_add_(0, valid, feats[idx[valid]] @ weight[k])
+    return out
+
+
+class TorchConv3d(nn.Module):
+    """
+    Parameter holder with the same names and shapes as torchsparse.nn.Conv3d.
+    """
+    def __init__(self, in_channels, out_channels, kernel_size, stride=1, dilation=1, bias=True, transposed=False):
+        super(TorchConv3d, self).__init__()
+        self.in_channels = in_channels
+        self.out_channels = out_channels
+        self.kernel_size = _ntuple(kernel_size)
+        self.stride = _ntuple(stride)
+        self.dilation = _ntuple(dilation)
+        self.transposed = transposed
+        self.kernel_volume = math.prod(self.kernel_size)
+        if self.kernel_volume > 1:
+            self.kernel = nn.Parameter(torch.zeros(self.kernel_volume, in_channels, out_channels))
+        else:
+            self.kernel = nn.Parameter(torch.zeros(in_channels, out_channels))
+        if bias:
+            self.bias = nn.Parameter(torch.zeros(out_channels))
+        else:
+            self.register_parameter('bias', None)
+        self.reset_parameters()
+
+    def reset_parameters(self):
+        std = 1 / math.sqrt((self.out_channels if self.transposed else self.in_channels) * self.kernel_volume)
+        self.kernel.data.uniform_(-std, std)
+        if self.bias is not None:
+            self.bias.data.uniform_(-std, std)
+
+
+def sparseconv3d_func(input: SparseTensor, weight: torch.Tensor, kernel_size: int, stride: int = 1, dilation: int = 1, padding: int = 0, bias: torch.Tensor = None, training: bool = True):
+    stride = _ntuple(stride)
+    kmap = get_kernel_map(input, kernel_size, stride, dilation)
+    with kernel_map_timer('compute'):
+        out_feats = gather_gemm_scatter(input.feats, kmap['table'], weight, kmap['out_coords'].shape[0])
+    if bias is not None:
+        out_feats = out_feats + bias
+    if all(s == 1 for s in stride):
+        return input.replace(out_feats)
+    out = SparseTensor(out_feats, kmap['out_coords'])
+    out._spatial_cache = input._spatial_cache
+    out._scale = tuple([s * st for s, st in zip(input._scale, stride)])
+    return out
+
+
+class SparseConv3d(nn.Module):
+    def __init__(self, in_channels, out_channels, kernel_size, stride=1, dilation=1, padding=0, bias=True, indice_key=None):
+        super(SparseConv3d, self).__init__()
+        self.conv = TorchConv3d(in_channels, out_channels, kernel_size, stride, dilation, bias)
+
+    def forward(self, x: SparseTensor) -> SparseTensor:
+        conv = self.conv
+        if conv.kernel_volume == 1 and all(s == 1 for s in conv.stride):
+            out_feats = x.feats @ conv.kernel
+            if conv.bias is not None:
+                out_feats = out_feats + conv.bias
+            return x.replace(out_feats)
+
+        out = sparseconv3d_func(x, conv.kernel, conv.kernel_size, conv.stride, conv.dilation, bias=conv.bias)
+        if any(s != 1 for s in conv.stride):
+            table = get_kernel_map(x, conv.kernel_size, conv.stride, conv.dilation)['table']
+            out.register_spatial_cache(f'torch_conv_{conv.stride}_source', (x.coords, x.layout, x._scale, table))
+        return out
+
+
+class SparseInverseConv3d(nn.Module):
+    def __init__(self, in_channels, out_channels, kernel_size, stride=1, dilation=1, bias=True, indice_key=None):
+        super(SparseInverseConv3d, self).__init__()
+        self.conv = TorchConv3d(in_channels, out_channels, kernel_size, stride, dilation, bias, transposed=True)
+
+    def forward(self, x: SparseTensor) -> SparseTensor:
+        conv = self.conv
+        source = x.get_spatial_cache(f'torch_conv_{conv.stride}_source')
+        if source is None:
+            raise ValueError('SparseInverseConv3d needs the tensor produced by a strided SparseConv3d')
+        coords, layout, scale, table = source
+        # table indexes fine inputs by coarse output, which is the transpose of this convolution
+        with kernel_map_timer('compute'):
+            out_feats = gather_gemm_scatter(x.feats, table, conv.kernel, coords.shape[0], transposed=True)
+        if conv.bias is not None:
+            out_feats = out_feats + conv.bias
+        out = SparseTensor(out_feats, coords, layout=layout)
+        out._spatial_cache = x._spatial_cache
+        out._scale = scale
+        return out
@@ -2,6 +2,7 @@ import torch
 import torch.nn as nn
 from .. import SparseTensor
 from torchsparse.utils import make_ntuple
+from .kernel_map import lookup_kernel_map, register_kernel_map, kernel_map_timer
 
 
 def sparseconv3d_func(input: SparseTensor, weight: torch.Tensor, kernel_size: int, stride: int = 1, dilation: int = 1, padding: int = 0, bias: torch.Tensor = None, training: bool = True):
@@ -33,7 +34,15 @@ class SparseConv3d(nn.Module):
         self.conv = torchsparse.nn.Conv3d(in_channels, out_channels, kernel_size, stride, padding, dilation, bias)
 
     def forward(self, x: SparseTensor) -> SparseTensor:
-        out = self.conv(x.data)
+        # torchsparse keeps its maps in `data._caches`, which is lost whenever a SparseTensor is rebuilt
+        # from the same coordinates; reattach the caches registered for these coordinates before the call.
+        # A call that has to build its map is timed as a whole as 'build'.
+        caches = lookup_kernel_map(x, self.conv.kernel_size, self.conv.stride, self.conv.dilation)
+        if caches is not None:
+            x.data._caches = caches
+        with kernel_map_timer('compute' if caches is not None else 'build'):
+            out = self.conv(x.data)
+        register_kernel_map(x, self.conv.kernel_size, self.conv.stride, self.conv.dilation, x.data._caches)
 
         spatial_range = out.spatial_range
 
@@ -0,0 +1,133 @@
+from typing import *
+import time
+from contextlib import contextmanager
+import torch
+from .. import SparseTensor
+
+__all__ = [
+    'coords_id',
+    'lookup_kernel_map',
+    'register_kernel_map',
+    'kernel_map_stage',
+    'kernel_map_timer',
+    'kernel_map_profile_report',
+]
+
+# Kernel maps are stored in the spatial cache of a SparseTensor under a single registry entry,
+# keyed by (coordinate-set id, kernel size, stride, dilation). The coordinate-set id is derived
+# from the storage of the coords tensor, so every SparseTensor built on the same coordinates
+# (replace(), type(), the outputs of submanifold convolutions, ...) finds the same map no matter
+# which scale it was registered at. Entries hold a reference to their coords, which keeps the
+# storage alive and the id unique for the lifetime of the cache.
+
+PROFILE = False
+
+def __from_env():
+    import os
+
+    global PROFILE
+    env_profile = os.environ.get('SPARSE_KMAP_PROFILE')
+    if env_profile is not None:
+        PROFILE = env_profile == '1'
+
+
+__from_env()
+
+
+def set_profile(profile: bool):
+    global PROFILE
+    PROFILE = profile
+
+
+def _ntuple(x, ndim=3):
+    return tuple(x) if isinstance(x, (list, tuple)) else (x,) * ndim
+
+
+def coords_id(coords: torch.Tensor) -> tuple:
+    return (coords.data_ptr(), tuple(coords.shape), tuple(coords.stride()), str(coords.device))
+
+
+def _registry(x: SparseTensor) -> dict:
+    return x._spatial_cache.setdefault('kernel_maps', {})
+
+
+def _key(coords, kernel_size, stride, dilation):
+    return (coords_id(coords), _ntuple(kernel_size), _ntuple(stride), _ntuple(dilation))
+
+
+def lookup_kernel_map(x: SparseTensor, kernel_size, stride=1, dilation=1, coords: Optional[torch.Tensor] = None):
+    """
+    Kernel map registered for the coordinates of `x` (or `coords`, which must share the spatial cache of `x`).
+    """
+    coords = x.coords if coords is None else coords
+    entry = _registry(x).get(_key(coords, kernel_size, stride, dilation))
+    if entry is None:
+        return None
+    _record('hits', 1)
+    return entry[1]
+
+
+def register_kernel_map(x: SparseTensor, kernel_size, stride, dilation, value, coords: Optional[torch.Tensor] = None) -> None:
+    coords = x.coords if coords is None else coords
+    _registry(x)[_key(coords, kernel_size, stride, dilation)] = (coords, value)
+
+
+# Profiling
+
+_stage = None
+_stats = {}
+
+
+def _record(field, value):
+    if not PROFILE:
+        return
+    stats = _stats.setdefault(_stage or 'global', {'build': 0.0, 'compute': 0.0, 'builds': 0, 'hits': 0, 'calls': 0})
+    stats[field] += value
+
+
+@contextmanager
+def kernel_map_stage(name: str):
+    """
+    Attribute the kernel map timings recorded inside the context to stage `name`.
+    """
+    global _stage
+    prev, _stage = _stage, name
+    try:
+        yield
+    finally:
+        _stage = prev
+
+
+@contextmanager
+def kernel_map_timer(kind: Literal['build', 'compute']):
+    """
+    Time a kernel map build or a convolution when SPARSE_KMAP_PROFILE=1.
+    """
+    if not PROFILE:
+        yield
+        return
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if torch.cuda.is_available():
+            torch.cuda.synchronize()
+        _record(kind, time.perf_counter() - start)
+        _record('builds' if kind == 'build' else 'calls', 1)
+
+
+def kernel_map_profile_report(reset: bool = True) -> str:
+    """
+    Per-stage map-build vs. compute time collected since the last reset.
+    """
+    lines = []
+    for stage, stats in _stats.items():
+        lines.append(
+            f"[SPARSE][KMAP] {stage}: build {stats['build'] * 1000:.1f} ms ({stats['builds']} maps), "
+            f"compute {stats['compute'] * 1000:.1f} ms ({stats['calls']} convs), {stats['hits']} map reuses"
+        )
+    if reset:
+        _stats.clear()
+    return '\n'.join(lines)
@@ -0,0 +1,192 @@
+from typing import *
+import torch
+
+__all__ = [
+    'pack_coords',
+    'unpack_coords',
+    'linear_index',
+    'block_keys',
+    'window_keys',
+    'morton_encode',
+    'hilbert_encode',
+    'stable_argsort',
+    'unique_keys',
+    'invert_permutation',
+    'lookup_keys',
+]
+
+# Coordinate keys packed into int64 on the coordinates' device.
+# Coordinates follow the SparseTensor layout [N, 1 + D] with the batch index in column 0
+# and non-negative spatial coordinates. Keys preserve the lexicographic order of the
+# packed fields, so sorting keys sorts the coordinates without leaving the device.
+COORD_BITS = 16
+
+
+def pack_coords(coords: torch.Tensor, bits: int = COORD_BITS) -> torch.Tensor:
+    """
+    Pack [batch, x, y, z] coordinates into int64 keys ordered lexicographically.
+
+    Args:
+        coords (torch.Tensor): [N, 1 + D] integer coordinates.
+        bits (int): Bits per spatial axis; the batch index uses the remaining high bits.
+    """
+    DIM = coords.shape[-1] - 1
+    assert DIM * bits < 63, f'Cannot pack {DIM} axes of {bits} bits into an int64 key'
+    coords = coords.long()
+    keys = coords[:, 0]
+    for i in range(DIM):
+        keys = (keys << bits) | coords[:, i + 1]
+    return keys
+
+
+def unpack_coords(keys: torch.Tensor, dim: int = 3, bits: int = COORD_BITS) -> torch.Tensor:
+    """
+    Inverse of pack_coords. Returns [N, 1 + dim] int32 coordinates.
+    """
+    mask = (1 << bits) - 1
+    columns = []
+    for i in range(dim):
+        columns.append((keys >> (bits * i)) & mask)
+    columns.append(keys >> (bits * dim))
+    return torch.stack(columns[::-1], dim=-1).int()
+
+
+def linear_index(coords: torch.Tensor, resolution: Union[int, Tuple[int, ...]]) -> torch.Tensor:
+    """
+    Flatten [N, D] spatial coordinates into row-major indices of a dense grid.
+    """
+    DIM = coords.shape[-1]
+    resolution = (resolution,) * DIM if isinstance(resolution, int) else resolution
+    index = coords[:, 0].long()
+    for i in range(1, DIM):
+        index = index * resolution[i] + coords[:, i]
+    return index
+
+
+def block_keys(coords: torch.Tensor, block_size: int, bits: int = 10) -> torch.Tensor:
+    """
+    Block-major keys: coordinates are ordered by batch, then by the block they fall in
+    (coords // block_size), then by their position inside the block (coords % block_size).
+
+    Args:
+        coords (torch.Tensor): [N, 1 + D] integer coordinates.
+        block_size (int): Edge length of a block.
+        bits (int): Bits per axis for block coordinates.
+    """
+    DIM = coords.shape[-1] - 1
+    inblock_bits = max(int(block_size - 1).bit_length(), 1)
+    assert DIM * (bits + inblock_bits) < 63, f'Cannot pack block keys with block size {block_size}'
+    coords = coords.long()
+    keys = coords[:, 0]
+    for i in range(DIM):
+        keys = (keys << bits) | (coords[:, i + 1] // block_size)
+    for i in range(DIM):
+        keys = (keys << inblock_bits) | (coords[:, i + 1] % block_size)
+    return keys
+
+
+def window_keys(
+    coords: torch.Tensor,
+    window_size: Union[int, Tuple[int, ...]],
+    shift_window: Union[int, Tuple[int, ...]] = 0,
+    bits: int = COORD_BITS
+) -> torch.Tensor:
+    """
+    Keys identifying the (shifted) window each coordinate falls in, ordered by batch and window.
+    """
+    DIM = coords.shape[-1] - 1
+    window_size = (window_size,) * DIM if isinstance(window_size, int) else window_size
+    shift_window = (shift_window,) * DIM if isinstance(shift_window, int) else shift_window
+    window_coords = coords.long().clone()
+    for i in range(DIM):
+        window_coords[:, i + 1] = (window_coords[:, i + 1] + shift_window[i]) // window_size[i]
+    return pack_coords(window_coords, bits)
+
+
+def _spread_bits(x: torch.Tensor) -> torch.Tensor:
+    """
+    Insert two zero bits between each of the low 21 bits of x.
+    """
+    x = x.long() & 0x1fffff
+    x = (x | (x << 32)) & 0x1f00000000ffff
+    x = (x | (x << 16)) & 0x1f0000ff0000ff
+    x = (x | (x << 8)) & 0x100f00f00f00f00f
+    x = (x | (x << 4)) & 0x10c30c30c30c30c3
+    x = (x | (x << 2)) & 0x1249249249249249
+    return x
+
+
+def morton_encode(x: torch.Tensor, y: torch.Tensor, z: torch.Tensor) -> torch.Tensor:
+    """
+    Z-order (Morton) code of 3D coordinates with up to 21 bits per axis; x is the most significant axis.
+    """
+    return (_spread_bits(x) << 2) | (_spread_bits(y) << 1) | _spread_bits(z)
+
+
+def hilbert_encode(x: torch.Tensor, y: torch.Tensor, z: torch.Tensor, bits: int = 10) -> torch.Tensor:
+    """
+    Hilbert code of 3D coordinates with `bits` bits per axis (Skilling's transpose algorithm).
+    """
+    X = [x.long().clone(), y.long().clone(), z.long().clone()]
+    M = 1 << (bits - 1)
+    # Inverse undo
+    Q = M
+    while Q > 1:
+        P = Q - 1
+        for i in range(3):
+            flip = (X[i] & Q) != 0
+            t = torch.where(flip, torch.zeros_like(X[0]), (X[0] ^ X[i]) & P)
+            X[0] = torch.where(flip, X[0] ^ P, X[0] ^ t)
+            if i != 0:
+                X[i] = X[i] ^ t
+        Q >>= 1
+    # Gray encode
+    for i in range(1, 3):
+        X[i] = X[i] ^ X[i - 1]
+    t = torch.zeros_like(X[0])
+    Q = M
+    while Q > 1:
+        t = torch.where((X[2] & Q) != 0, t ^ (Q - 1), t)
+        Q >>= 1
+    for i in range(3):
+        X[i] = X[i] ^ t
+    # The transposed form interleaved with X[0] as the most significant axis is the Hilbert index
+    return morton_encode(X[0], X[1], X[2])
+
+
+def stable_argsort(keys: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+    """
+    Stable sort of keys on device.
+
+    Returns:
+        (torch.Tensor): Sorted keys.
+        (torch.Tensor): Permutation that sorts the keys.
+    """
+    return torch.sort(keys, stable=True)
+
+
+def unique_keys(keys: torch.Tensor, return_inverse: bool = False, return_counts: bool = False):
+    """
+    Sorted unique keys, optionally with the inverse mapping and the count of each key.
+    """
+    return torch.unique(keys, sorted=True, return_inverse=return_inverse, return_counts=return_counts)
+
+
+def invert_permutation(perm: torch.Tensor) -> torch.Tensor:
+    inv = torch.empty_like(perm)
+    inv[perm] = torch.arange(perm.shape[0], device=perm.device, dtype=perm.dtype)
+    return inv
+
+
+def lookup_keys(sorted_keys: torch.Tensor, query: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+    """
+    Find query keys in a sorted key tensor.
+
+    Returns:
+        (torch.Tensor): Bool mask of queries that were found.
+        (torch.Tensor): Position of each query in `sorted_keys` (only meaningful where found).
+    """
+    if sorted_keys.numel() == 0:
+        return torch.zeros_like(query, dtype=torch.bool), torch.zeros_like(query)
+    pos = torch.searchsorted(sorted_keys, query).clamp_(max=sorted_keys.shape[0] - 1)
+    return sorted_keys[pos] == query, pos
@@ -1,6 +1,8 @@
+from typing import *
 import torch
 import torch.nn as nn
 from . import SparseTensor
+from .chunk import chunked_token_apply
 
 __all__ = [
     'SparseLinear'
@@ -11,5 +13,8 @@ class SparseLinear(nn.Linear):
     def __init__(self, in_features, out_features, bias=True):
         super(SparseLinear, self).__init__(in_features, out_features, bias)
 
-    def forward(self, input: SparseTensor) -> SparseTensor:
-        return input.replace(super().forward(input.feats))
+    def forward(self, input: Union[SparseTensor, torch.Tensor]) -> Union[SparseTensor, torch.Tensor]:
+        # plain feature tensors come from callers that already chunk the tokens (e.g. SparseFeedForwardNet)
+        if isinstance(input, torch.Tensor):
+            return super().forward(input)
+        return input.replace(chunked_token_apply(super().forward, input.feats))
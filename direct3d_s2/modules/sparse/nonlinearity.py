@@ -1,3 +1,4 @@
+from typing import *
 import torch
 import torch.nn as nn
 from . import SparseTensor
@@ -25,7 +26,9 @@ class SparseSiLU(nn.SiLU):
         return input.replace(super().forward(input.feats))
 
 class SparseGELU(nn.GELU):
-    def forward(self, input: SparseTensor) -> SparseTensor:
+    def forward(self, input: Union[SparseTensor, torch.Tensor]) -> Union[SparseTensor, torch.Tensor]:
+        if isinstance(input, torch.Tensor):
+            return super().forward(input)
         return input.replace(super().forward(input.feats))
 
 class SparseTanh(nn.Tanh):
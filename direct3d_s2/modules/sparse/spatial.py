@@ -2,6 +2,7 @@ from typing import *
 import torch
 import torch.nn as nn
 from . import SparseTensor
+from .keys import pack_coords, unpack_coords, unique_keys
 
 __all__ = [
     'SparseDownsample',
@@ -25,14 +26,9 @@ class SparseDownsample(nn.Module):
         factor = self.factor if isinstance(self.factor, tuple) else (self.factor,) * DIM
         assert DIM == len(factor), 'Input coordinates must have the same dimension as the downsample factor.'
 
-        coord = list(input.coords.unbind(dim=-1))
-        for i, f in enumerate(factor):
-            coord[i+1] = coord[i+1] // f
-
-        MAX = [coord[i+1].max().item() + 1 for i in range(DIM)]
-        OFFSET = torch.cumprod(torch.tensor(MAX[::-1]), 0).tolist()[::-1] + [1]
-        code = sum([c * o for c, o in zip(coord, OFFSET)])
-        code, idx = code.unique(return_inverse=True)
+        coord = input.coords.long()
+        coord = torch.cat([coord[:, :1], coord[:, 1:] // torch.tensor(factor, device=coord.device).unsqueeze(0)], dim=-1)
+        code, idx = unique_keys(pack_coords(coord), return_inverse=True)
 
         #### using fp16 could cause overflow when factor is large ######
         dtype = input.feats.dtype
@@ -45,11 +41,7 @@ class SparseDownsample(nn.Module):
         )
         new_feats = new_feats.to(dtype)
         
-        new_coords = torch.stack(
-            [code // OFFSET[0]] +
-            [(code // OFFSET[i+1]) % MAX[i] for i in range(DIM)],
-            dim=-1
-        )
+        new_coords = unpack_coords(code, DIM)
         out = SparseTensor(new_feats, new_coords, input.shape,)
         out._scale = tuple([s // f for s, f in zip(input._scale, factor)])
         out._spatial_cache = input._spatial_cache
@@ -111,5 +103,7 @@ class SparseSubdivide(nn.Module):
         out = SparseTensor(new_feats.flatten(0, 1), new_coords.flatten(0, 1), input.shape)
         out._scale = input._scale * 2
         out._spatial_cache = input._spatial_cache
+        # lets convolution backends derive the kernel map of `out` from the one of `input`
+        out.register_spatial_cache('subdivide_parent', (input.coords, out.coords))
         return out
 
@@ -0,0 +1,95 @@
+from typing import *
+import torch
+from .basic import SparseTensor
+from .keys import pack_coords, stable_argsort, lookup_keys, COORD_BITS
+
+__all__ = [
+    'TokenMerge',
+]
+
+FACE_OFFSETS = [(1, 0, 0), (-1, 0, 0), (0, 1, 0), (0, -1, 0), (0, 0, 1), (0, 0, -1)]
+
+
+class TokenMerge:
+    """
+    Bipartite merging of neighbouring tokens of a sparse tensor, and the matching unmerge.
+
+    Tokens are split by the parity of x + y + z. Every odd token (source) is matched to its most
+    similar face neighbour (destination, always even) inside the same selection block, by cosine
+    similarity of the features. The `ratio` of all tokens with the most similar matches are merged:
+    the destination becomes the mean of itself and its sources and the sources are dropped. The kept
+    tokens keep their order and coordinates, so the block-sorted layout expected by
+    SpatialSparseAttention stays valid and every merged token stays in its block.
+
+    Unmerging is residual: every token gets its own input plus the update that the token it was merged
+    into received, which is exactly the block output for the tokens that were kept.
+
+    Args:
+        x (SparseTensor): Tokens before the merged blocks.
+        ratio (float): Fraction of all tokens to merge away (at most about one half).
+        block_size (int): Selection block size; tokens only merge within a block.
+    """
+    def __init__(self, x: SparseTensor, ratio: float, block_size: int):
+        coords = x.coords.long()
+        feats = x.feats
+        device = feats.device
+        N = coords.shape[0]
+        self.num_tokens = N
+
+        src = torch.nonzero((coords[:, 1:].sum(dim=1) % 2) == 1).squeeze(1)
+        src_coords = coords[src]
+        src_block = src_coords[:, 1:] // block_size
+        src_feats = feats[src].float()
+        src_norm = src_feats.norm(dim=-1).clamp_min(1e-6)
+        norm = feats.float().norm(dim=-1).clamp_min(1e-6)
+        sorted_keys, order = stable_argsort(pack_coords(coords))
+        limit = 1 << COORD_BITS
+
+        best_sim = torch.full((len(src),), -float('inf'), device=device)
+        best_dst = torch.zeros(len(src), dtype=torch.long, device=device)
+        for offset in FACE_OFFSETS:
+            neighbor = src_coords.clone()
+            neighbor[:, 1:] += torch.tensor(offset, device=device)
+            valid = ((neighbor[:, 1:] >= 0) & (neighbor[:, 1:] < limit)).all(dim=1)
+            valid &= (neighbor[:, 1:] // block_size == src_block).all(dim=1)
+            neighbor[~valid] = src_coords[~valid]
+            found, pos = lookup_keys(sorted_keys, pack_coords(neighbor))
+            found &= valid
+            dst = order[pos]
+            sim = (src_feats * feats[dst].float()).sum(dim=-1) / (src_norm * norm[dst])
+            sim = torch.where(found, sim, torch.full_like(sim, -float('inf')))
+            better = sim > best_sim
+            best_sim = torch.where(better, sim, best_sim)
+            best_dst = torch.where(better, dst, best_dst)
+        del src_feats
+
+        num_merge = min(int(ratio * N), int(torch.isfinite(best_sim).sum()))
+        top = torch.topk(best_sim, num_merge).indices if num_merge > 0 else best_sim.new_zeros(0, dtype=torch.long)
+        merged_src, merged_dst = src[top], best_dst[top]
+
+        kept = torch.ones(N, dtype=torch.bool, device=device)
+        kept[merged_src] = False
+        self.kept = torch.nonzero(kept).squeeze(1)
+        position = torch.full((N,), -1, dtype=torch.long, device=device)
+        position[self.kept] = torch.arange(len(self.kept), device=device)
+        # kept position every token contributes to and reads its update from
+        self.assign = position.clone()
+        self.assign[merged_src] = position[merged_dst]
+        self.counts = torch.bincount(self.assign, minlength=len(self.kept))
+        self.coords = x.coords[self.kept]
+
+    @property
+    def num_merged(self) -> int:
+        return self.num_tokens - len(self.kept)
+
+    def merge(self, x: SparseTensor) -> SparseTensor:
+        feats = torch.zeros((len(self.kept), *x.feats.shape[1:]), dtype=x.feats.dtype, device=x.feats.device)
+        feats.index_add_(0, self.assign, x.feats)
+        feats /= self.counts.view(-1, *([1] * (feats.dim() - 1))).to(feats.dtype)
+        return SparseTensor(feats, self.coords)
+
+    def unmerge(self, out: SparseTensor, merged: SparseTensor, x: SparseTensor) -> SparseTensor:
+        """
+        Tokens of `x` updated with the change from `merged` (the merged input) to `out` (the merged output).
+        """
+        return x.replace(x.feats + (out.feats - merged.feats)[self.assign])
@@ -3,6 +3,7 @@ import torch
 import torch.nn as nn
 from ..basic import SparseTensor
 from ..linear import SparseLinear
+from ..chunk import chunked_token_apply
 from ..nonlinearity import SparseGELU
 from ..attention import SparseMultiHeadAttention, SerializeMode
 from ...norm import LayerNorm32
@@ -17,8 +18,14 @@ class SparseFeedForwardNet(nn.Module):
             SparseLinear(int(channels * mlp_ratio), channels),
         )
 
+    def _mlp(self, feats: torch.Tensor) -> torch.Tensor:
+        fc1, act, fc2 = self.mlp
+        # the layers take plain feature tensors here, through __call__ so hooks and autocast still apply
+        return fc2(act(fc1(feats)))
+
     def forward(self, x: SparseTensor) -> SparseTensor:
-        return self.mlp(x)
+        # the [N, mlp_ratio * C] hidden activation only exists for one chunk of tokens at a time
+        return x.replace(chunked_token_apply(self._mlp, x.feats))
 
 
 class SparseTransformerBlock(nn.Module):
@@ -63,10 +70,10 @@ class SparseTransformerBlock(nn.Module):
         )
 
     def _forward(self, x: SparseTensor) -> SparseTensor:
-        h = x.replace(self.norm1(x.feats))
+        h = x.replace(chunked_token_apply(self.norm1, x.feats))
         h = self.attn(h)
         x = x + h
-        h = x.replace(self.norm2(x.feats))
+        h = x.replace(chunked_token_apply(self.norm2, x.feats))
         h = self.mlp(h)
         x = x + h
         return x
@@ -133,13 +140,13 @@ class SparseTransformerCrossBlock(nn.Module):
         )
 
     def _forward(self, x: SparseTensor, mod: torch.Tensor, context: torch.Tensor):
-        h = x.replace(self.norm1(x.feats))
+        h = x.replace(chunked_token_apply(self.norm1, x.feats))
         h = self.self_attn(h)
         x = x + h
-        h = x.replace(self.norm2(x.feats))
+        h = x.replace(chunked_token_apply(self.norm2, x.feats))
         h = self.cross_attn(h, context)
         x = x + h
-        h = x.replace(self.norm3(x.feats))
+        h = x.replace(chunked_token_apply(self.norm3, x.feats))
         h = self.mlp(h)
         x = x + h
         return x
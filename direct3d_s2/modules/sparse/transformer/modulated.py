@@ -4,6 +4,7 @@ import torch.nn as nn
 from ..basic import SparseTensor
 from ..attention import SparseMultiHeadAttention, SerializeMode, SpatialSparseAttention
 from ...norm import LayerNorm32
+from ..chunk import chunked_token_apply
 from .blocks import SparseFeedForwardNet
 
 
@@ -59,12 +60,12 @@ class ModulatedSparseTransformerBlock(nn.Module):
             shift_msa, scale_msa, gate_msa, shift_mlp, scale_mlp, gate_mlp = mod.chunk(6, dim=1)
         else:
             shift_msa, scale_msa, gate_msa, shift_mlp, scale_mlp, gate_mlp = self.adaLN_modulation(mod).chunk(6, dim=1)
-        h = x.replace(self.norm1(x.feats))
+        h = x.replace(chunked_token_apply(self.norm1, x.feats))
         h = h * (1 + scale_msa) + shift_msa
         h = self.attn(h)
         h = h * gate_msa
         x = x + h
-        h = x.replace(self.norm2(x.feats))
+        h = x.replace(chunked_token_apply(self.norm2, x.feats))
         h = h * (1 + scale_mlp) + shift_mlp
         h = self.mlp(h)
         h = h * gate_mlp
@@ -165,7 +166,7 @@ class ModulatedSparseTransformerCrossBlock(nn.Module):
             shift_msa, scale_msa, gate_msa, shift_mlp, scale_mlp, gate_mlp = mod.chunk(6, dim=1)
         else:
             shift_msa, scale_msa, gate_msa, shift_mlp, scale_mlp, gate_mlp = self.adaLN_modulation(mod).chunk(6, dim=1)
-        h = x.replace(self.norm1(x.feats))
+        h = x.replace(chunked_token_apply(self.norm1, x.feats))
         
         feats_h = h.feats
         layouts = h.layout
@@ -183,10 +184,10 @@ class ModulatedSparseTransformerCrossBlock(nn.Module):
         h = h.replace(torch.cat(ada_r2, dim=0))
 
         x = x + h
-        h = x.replace(self.norm2(x.feats))
+        h = x.replace(chunked_token_apply(self.norm2, x.feats))
         h = self.cross_attn(h, context)
         x = x + h
-        h = x.replace(self.norm3(x.feats))
+        h = x.replace(chunked_token_apply(self.norm3, x.feats))
 
         feats_h = h.feats
         layouts = h.layout
@@ -0,0 +1,166 @@
+from typing import *
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+import torch
+
+STAGES = ['qkv', 'compression', 'compressed_attention', 'block_score', 'selection_attention', 'window_attention', 'gating']
+GATE_BRANCHES = ['compressed', 'selection', 'window']
+
+
+class SSAProfiler:
+    """
+    Opt-in profiler of the sub-stages of SpatialSparseAttention, keyed by sampling step and block index.
+
+    Every stage of the attention (see STAGES) is timed with CUDA events, or with the host clock on the
+    CPU. The events are only resolved in `report`, so timing never synchronizes the device; both CFG
+    passes of a step add up under the same key.
+
+    With `collect_stats` the profiler also records, per block:
+        - selection: selected blocks per query and head, their share of the blocks of the sample, the
+          share of the tokens a query attends to through them and the share of blocks any query selects
+        - windows: a histogram of the window sequence lengths in power-of-two bins and their fill
+        - gate: mean and standard deviation of the three branch weights and how often each dominates
+    Collecting them reads a few values back to the host per block, which slows the step a little
+    but does not change the device time of the stages.
+
+    Args:
+        collect_stats (bool): Collect the selection, window and gate statistics.
+        cuda_timing (bool): Time stages on CUDA tensors with CUDA events.
+    """
+    def __init__(self, collect_stats: bool = True, cuda_timing: bool = True):
+        self.collect_stats = collect_stats
+        self.cuda_timing = cuda_timing
+        self.step = 0
+        self.reset()
+
+    def reset(self):
+        self.timings = []
+        self.selection = defaultdict(list)
+        self.windows = defaultdict(Counter)
+        self.window_capacity = {}
+        self.gates = defaultdict(list)
+
+    @contextmanager
+    def stage(self, name: str, block: int, device: torch.device):
+        key = (self.step, block)
+        if self.cuda_timing and device.type == 'cuda':
+            start = torch.cuda.Event(enable_timing=True)
+            end = torch.cuda.Event(enable_timing=True)
+            start.record()
+            yield
+            end.record()
+            self.timings.append((key, name, start, end))
+        else:
+            start = time.perf_counter()
+            yield
+            self.timings.append((key, name, start, time.perf_counter()))
+
+    def record_selection(self, block: int, block_topk: torch.Tensor, cu_seqblocks: torch.Tensor,
+                         cu_block_include_tokens: torch.Tensor, cu_seqlens: torch.Tensor):
+        """
+        Record the coverage of the top-k block selection (the outputs of get_block_score).
+        """
+        if not self.collect_stats:
+            return
+        block_tokens = (cu_block_include_tokens[1:] - cu_block_include_tokens[:-1]).float()
+        cu_seqblocks, cu_seqlens = cu_seqblocks.tolist(), cu_seqlens.tolist()
+        for b in range(len(cu_seqlens) - 1):
+            topk_b = block_topk[:, cu_seqlens[b]:cu_seqlens[b + 1]].long()
+            tokens_b = block_tokens[cu_seqblocks[b]:cu_seqblocks[b + 1]]
+            num_blocks = len(tokens_b)
+            valid = topk_b >= 0
+            selected = valid.sum(dim=-1).float()
+            attended = (tokens_b[topk_b.clamp_min(0)] * valid).sum(dim=-1)
+            used = torch.zeros(num_blocks, dtype=torch.bool, device=topk_b.device)
+            used[topk_b[valid]] = True
+            self.selection[block].append(torch.stack([
+                selected.mean(),
+                selected.mean() / num_blocks,
+                attended.mean() / tokens_b.sum(),
+                used.float().mean(),
+            ]))
+
+    def record_windows(self, block: int, seq_lens: List[int], window_size: int):
+        """
+        Record the sequence lengths of the attention windows.
+        """
+        if not self.collect_stats:
+            return
+        self.windows[block].update(int(l).bit_length() - 1 for l in seq_lens)
+        self.window_capacity[block] = window_size ** 3
+
+    def record_gate(self, block: int, gate: torch.Tensor):
+        """
+        Record the [N, 3] gate weights of the compressed, selection and window branches.
+        """
+        if not self.collect_stats:
+            return
+        gate = gate.float()
+        dominant = torch.bincount(gate.argmax(dim=-1), minlength=3).float() / max(len(gate), 1)
+        self.gates[block].append(torch.cat([gate.mean(dim=0), gate.std(dim=0), dominant]))
+
+    def report(self) -> Dict[str, Any]:
+        """
+        Aggregate everything recorded so far: total time per stage, per block and per step, and the
+        mean statistics of every block.
+        """
+        if any(isinstance(start, torch.cuda.Event) for _, _, start, _ in self.timings):
+            torch.cuda.synchronize()
+        stages = {name: {'ms': 0.0, 'calls': 0} for name in STAGES}
+        blocks, steps = {}, {}
+        for (step, block), name, start, end in self.timings:
+            ms = start.elapsed_time(end) if isinstance(start, torch.cuda.Event) else (end - start) * 1e3
+            stages.setdefault(name, {'ms': 0.0, 'calls': 0})
+            stages[name]['ms'] += ms
+            stages[name]['calls'] += 1
+            block_ms = blocks.setdefault(block, {}).setdefault('ms', {})
+            block_ms[name] = block_ms.get(name, 0.0) + ms
+            steps.setdefault(step, {})
+            steps[step][name] = steps[step].get(name, 0.0) + ms
+        total = sum(stage['ms'] for stage in stages.values())
+        for stage in stages.values():
+            stage['share'] = stage['ms'] / total if total > 0 else 0.0
+
+        for block, records in self.selection.items():
+            mean = torch.stack(records).mean(dim=0).tolist()
+            blocks.setdefault(block, {})['selection'] = {
+                'selected_blocks': mean[0],
+                'selected_block_share': mean[1],
+                'attended_token_share': mean[2],
+                'used_block_share': mean[3],
+            }
+        for block, histogram in self.windows.items():
+            count = sum(histogram.values())
+            capacity = self.window_capacity[block]
+            blocks.setdefault(block, {})['windows'] = {
+                'capacity': capacity,
+                'histogram': {f'{2 ** k}-{2 ** (k + 1) - 1}': n / count for k, n in sorted(histogram.items())},
+                'full_share': histogram.get(capacity.bit_length() - 1, 0) / count if capacity & (capacity - 1) == 0 else None,
+            }
+        for block, records in self.gates.items():
+            mean = torch.stack(records).mean(dim=0).tolist()
+            blocks.setdefault(block, {})['gate'] = {
+                branch: {'mean': mean[i], 'std': mean[3 + i], 'dominant_share': mean[6 + i]}
+                for i, branch in enumerate(GATE_BRANCHES)
+            }
+        return {'total_ms': total, 'stages': stages, 'blocks': dict(sorted(blocks.items())), 'steps': dict(sorted(steps.items()))}
+
+    @staticmethod
+    def format_report(report: Dict[str, Any], prefix: str = '[SSAProfiler]') -> str:
+        lines = [f"{prefix} {report['total_ms']:.1f}ms in spatial sparse attention: " + ", ".join(
+            f"{name} {stage['share'] * 100:.0f}%" for name, stage in report['stages'].items() if stage['calls'])]
+        for block, entry in report['blocks'].items():
+            parts = [f"{sum(entry.get('ms', {}).values()):.1f}ms"]
+            if 'selection' in entry:
+                selection = entry['selection']
+                parts.append(f"selects {selection['selected_blocks']:.1f} blocks ({selection['selected_block_share'] * 100:.1f}%, "
+                             f"{selection['attended_token_share'] * 100:.1f}% of tokens, {selection['used_block_share'] * 100:.0f}% of blocks used)")
+            if 'windows' in entry:
+                windows = entry['windows']
+                full = f", {windows['full_share'] * 100:.0f}% full" if windows['full_share'] is not None else ""
+                parts.append(f"windows " + " ".join(f"{k}:{v * 100:.0f}%" for k, v in windows['histogram'].items()) + full)
+            if 'gate' in entry:
+                parts.append("gate " + " ".join(f"{branch} {g['mean']:.2f}" for branch, g in entry['gate'].items()))
+            lines.append(f"{prefix}   block {block}: " + "; ".join(parts))
+        return "\n".join(lines)
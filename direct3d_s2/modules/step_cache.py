@@ -0,0 +1,56 @@
+from typing import *
+import torch
+
+
+class StepCache:
+    """
+    Cross-step residual cache for the middle blocks of a DiT.
+
+    The output of the first block serves as a probe: its mean relative L1 change from the previous
+    call is accumulated, and while the sum stays below `threshold` the middle blocks are skipped and
+    the residual they added on the last computed call is reused. The sum is reset whenever the
+    middle blocks run. Every conditioning (e.g. the conditional and unconditional CFG passes) has its
+    own entry, keyed by the caller.
+
+    An entry holds the probe and the residual, two [N, C] tensors of the block width.
+
+    Args:
+        threshold (float): Accumulated relative change up to which the cached residual is reused.
+        max_skips (int): Consecutive reuses after which the middle blocks are recomputed anyway.
+    """
+    def __init__(self, threshold: float = 0.05, max_skips: int = 3):
+        self.threshold = threshold
+        self.max_skips = max_skips
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+
+    def reset(self):
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, key, probe: torch.Tensor) -> Optional[torch.Tensor]:
+        """
+        The cached residual for `key` if `probe` changed little enough since the last call, else None.
+        """
+        entry = self.entries.get(key)
+        if entry is None or entry['probe'].shape != probe.shape:
+            self.misses += 1
+            return None
+        previous = entry['probe']
+        change = ((probe - previous).abs().mean() / previous.abs().mean().clamp_min(1e-6)).item()
+        entry['probe'] = probe
+        entry['change'] += change
+        if entry['change'] < self.threshold and entry['skips'] < self.max_skips:
+            entry['skips'] += 1
+            self.hits += 1
+            return entry['residual']
+        self.misses += 1
+        return None
+
+    def store(self, key, probe: torch.Tensor, residual: torch.Tensor):
+        self.entries[key] = {'probe': probe, 'residual': residual, 'change': 0.0, 'skips': 0}
+
+    def stats(self) -> Dict[str, int]:
+        return {'cache_hits': self.hits, 'cache_misses': self.misses}
@@ -4,12 +4,13 @@ import numpy as np
 import trimesh as Trimesh
 import gc
 import sys
+import time
 from typing import Any
 from PIL import Image
 from tqdm import tqdm
 from omegaconf import OmegaConf
 from huggingface_hub import hf_hub_download
-from typing import Union, List, Optional
+from typing import Union, List, Optional, Tuple
 
 comfy_path = os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
 direct3ds2_path = os.path.join(comfy_path, "models", "wushuang98", "Direct3D-S2")
@@ -21,6 +22,9 @@ print(f'Adding to PATH : {current_folder}')
 sys.path.append(current_folder)
 
 from direct3d_s2.modules import sparse as sp
+from direct3d_s2.modules.sparse.chunk import set_token_chunk_size, get_token_chunk_size
+from direct3d_s2.modules.sparse.attention.serialized_attn import clear_serialization_cache
+from direct3d_s2.modules.offload import stream_module_blocks
 from direct3d_s2.utils import (
     instantiate_from_config, 
     preprocess_image, 
@@ -28,13 +32,52 @@ from direct3d_s2.utils import (
     extract_tokens_and_coords,
     normalize_mesh,
     mesh2index,
+    mesh_geometry_hash,
+    LatentIndexCache,
+    plan_memory,
+    estimate_stages,
+    remove_small_components,
+    mark_floaters_removed,
 )
+from direct3d_s2.utils.samplers import resolve_sampler, scheduler_sigmas, sample, guidance_scale_at
+from direct3d_s2.utils.telemetry import get_telemetry, traced_job
+
+# Cheaper configurations tried in order when a sparse stage runs out of device memory.
+OOM_FALLBACKS = [
+    {},
+    {'decoder_chunk_size': 2, 'token_chunk_size': 32768},
+    {'decoder_chunk_size': 4, 'token_chunk_size': 16384},
+    {'decoder_chunk_size': 4, 'token_chunk_size': 8192, 'offload_idle': True},
+    {'decoder_chunk_size': 8, 'token_chunk_size': 4096, 'offload_idle': True},
+]
+OOM_BUCKET_TOKENS = 20000
+# Token budget reductions applied by the mesh refine methods once every fallback level failed.
+OOM_TOKEN_SCALES = [1.0, 0.75, 0.5]
+# Voxel components smaller than this fraction of the voxels are removed as floaters before meshing,
+# the voxel-space counterpart of the face ratio used by workers.postprocessors.remove_floater.
+FLOATER_RATIO = 0.005
+
+
+def is_oom_error(error):
+    if isinstance(error, getattr(torch.cuda, 'OutOfMemoryError', ())):
+        return True
+    return isinstance(error, RuntimeError) and 'out of memory' in str(error)
+
 
 class Direct3DS2Pipeline(object):
 
-    def __init__(self, device):
+    def __init__(self, device, index_cache_dir=None, stream_blocks=0):
         self.dtype=torch.float16
         self.device = torch.device(device)  
+        self.stream_blocks = stream_blocks
+        self.latent_index_cache = LatentIndexCache(cache_dir=index_cache_dir)
+        self.memory_plans = {}
+        self.memory_peaks = {}
+        self.sampling_stats = {}
+        self.ssa_reports = {}
+        self.telemetry = get_telemetry()
+        self.oom_fallback_levels = {}
+        self.oom_token_scales = {}
         print(f'Comfy_path: {comfy_path}')
 
     def init_config(self, pipeline_path, subfolder, use_legacy_config):
@@ -168,18 +211,52 @@ class Direct3DS2Pipeline(object):
             del self.sparse_image_encoder
             self.sparse_image_encoder = None
             
+        clear_serialization_cache()
         torch.cuda.empty_cache()
         gc.collect()
 
+    def resident_model_bytes(self):
+        total = 0
+        for name in ['dense_vae', 'dense_dit', 'sparse_vae_512', 'sparse_dit_512', 'sparse_vae_1024', 'sparse_dit_1024',
+                     'refiner', 'refiner_1024', 'dense_image_encoder', 'sparse_image_encoder']:
+            module = getattr(self, name, None)
+            if isinstance(module, torch.nn.Module):
+                total += sum(p.numel() * p.element_size() for p in module.parameters() if p.device == self.device)
+        return total
+
+    def plan_memory(self, mode='sparse1024', vram_budget_gb=0, apply=True):
+        """
+        Estimate stage peaks for `mode` and choose max_latent_tokens, decoder chunking, token chunking
+        and idle-module offload for the free device memory. Models held by the pipeline count as free
+        because every refine call releases them first. With `apply`, later runs of `mode` use the plan.
+        """
+        plan = plan_memory(self.cfg, self.device, mode, vram_budget=vram_budget_gb * 1024 ** 3,
+                           reclaimable=self.resident_model_bytes())
+        if apply:
+            self.memory_plans[mode] = plan
+        return plan, plan.report(self.memory_peaks.get(mode))
+
+    def _reset_peak_memory(self):
+        if self.device.type == 'cuda':
+            torch.cuda.synchronize(self.device)
+            torch.cuda.reset_peak_memory_stats(self.device)
+
+    def _peak_memory(self):
+        if self.device.type == 'cuda':
+            return torch.cuda.max_memory_allocated(self.device)
+        return 0
+
     def preprocess(self, image):
         if image.mode == 'RGBA':
             image = np.array(image)
         else:
-            if getattr(self, 'birefnet_model', None) is None:
-                from .utils import BiRefNet
-                self.birefnet_model = BiRefNet(self.device)
-            image = self.birefnet_model.run(image)
-        image = preprocess_image(image)
+            with self.telemetry.span('birefnet'):
+                if getattr(self, 'birefnet_model', None) is None:
+                    from .utils import BiRefNet
+                    self.birefnet_model = BiRefNet(self.device)
+                image = self.birefnet_model.run(image)
+        with self.telemetry.span('preprocess_image'):
+            image = preprocess_image(image)
         return image
 
     def prepare_image(self, image: Union[str, List[str], Image.Image, List[Image.Image]]):
@@ -187,16 +264,18 @@ class Direct3DS2Pipeline(object):
             image = [image]
         if isinstance(image[0], str):
             image = [Image.open(img) for img in image]
-        image = [self.preprocess(img) for img in image]
-        image = torch.stack([img for img in image]).to(self.device)
+        with self.telemetry.span('preprocess', images=len(image)):
+            image = [self.preprocess(img) for img in image]
+            image = torch.stack([img for img in image]).to(self.device)
         return image
     
     def encode_image(self, image: torch.Tensor, conditioner: Any, 
                      do_classifier_free_guidance: bool = True, use_mask: bool = False):
-        if use_mask:
-            cond = conditioner(image[:, :3], image[:, 3:])
-        else:
-            cond = conditioner(image[:, :3])
+        with self.telemetry.span('dino'):
+            if use_mask:
+                cond = conditioner(image[:, :3], image[:, 3:])
+            else:
+                cond = conditioner(image[:, :3])
 
         if isinstance(cond, tuple):
             cond, cond_mask = cond
@@ -216,7 +295,50 @@ class Direct3DS2Pipeline(object):
 
         return cond, uncond
 
-    def inference(
+    def _memory_settings(self, vae, mode, level, baseline):
+        """
+        Apply the memory plan of `mode`, or the `baseline` (decoder chunk size, token chunk size) the
+        job started with, and the OOM fallback `level` on top of it.
+        Returns whether idle modules should be offloaded to the CPU.
+        """
+        plan = self.memory_plans.get(mode)
+        offload_idle = plan is not None and plan.offload_idle
+        decoder_chunk_size = plan.decoder_chunk_size if plan is not None else baseline[0]
+        token_chunk_size = plan.token_chunk_size if plan is not None else baseline[1]
+        fallback = OOM_FALLBACKS[level]
+        if 'decoder_chunk_size' in fallback:
+            decoder_chunk_size = max(decoder_chunk_size, fallback['decoder_chunk_size'])
+        if 'token_chunk_size' in fallback:
+            token_chunk_size = min(token_chunk_size or fallback['token_chunk_size'], fallback['token_chunk_size'])
+        offload_idle = offload_idle or fallback.get('offload_idle', False)
+        vae.decoder.chunk_size = decoder_chunk_size
+        set_token_chunk_size(token_chunk_size)
+        return offload_idle
+
+    def _recover_from_oom(self, stage, level, error):
+        print(f'[Direct3DS2Pipeline] out of memory during {stage} at fallback level {level}: {str(error).splitlines()[0]}')
+        print(f'[Direct3DS2Pipeline] retrying {stage} with {OOM_FALLBACKS[level + 1]}')
+        clear_serialization_cache()
+        gc.collect()
+        torch.cuda.empty_cache()
+
+    def inference(self, image, vae, *args, **kwargs):
+        """
+        Run one stage (see `_inference`). The memory plan and the OOM fallback levels change the decoder
+        chunk size and the token chunk size for the job only; the loader settings are restored after it,
+        and the serialization cache is emptied so no coordinates outlive the job.
+        """
+        baseline = (vae.decoder.chunk_size, get_token_chunk_size()) if kwargs.get('mode', 'dense') != 'dense' else None
+        try:
+            return self._inference(image, vae, *args, memory_baseline=baseline, **kwargs)
+        finally:
+            if baseline is not None:
+                vae.decoder.chunk_size = baseline[0]
+                set_token_chunk_size(baseline[1])
+            # the serializations reference the device coordinates of this job
+            clear_serialization_cache()
+
+    def _inference(
             self,
             image,
             vae,
@@ -229,9 +351,22 @@ class Direct3DS2Pipeline(object):
             latent_index: torch.Tensor = None,
             mode: str = 'dense', # 'dense', 'sparse512' or 'sparse1024
             remove_interior: bool = False,
-            mc_threshold: float = 0.02):
+            mc_threshold: float = 0.02,
+            prune_decoder: bool = False,
+            sparse_refiner: bool = False,
+            remove_floaters: bool = False,
+            face_budget: int = 0,
+            sampler: str = 'scheduler',
+            guidance_start: float = 1.0,
+            guidance_end: float = 0.0,
+            guidance_ramp: str = 'constant',
+            step_cache_threshold: float = 0.0,
+            token_merge_ratio: float = 0.0,
+            ssa_profile: bool = False,
+            memory_baseline: Optional[Tuple[int, int]] = None):
         
         do_classifier_free_guidance = guidance_scale > 0
+        conditioner.to(self.device)
         if mode == 'dense':
             sparse_conditions = False
         else:
@@ -242,52 +377,50 @@ class Direct3DS2Pipeline(object):
 
         if mode == 'dense':
             latent_shape = (batch_size, *dit.latent_shape)
+            latent_coords = None
         else:
             latent_shape = (len(latent_index), dit.out_channels)
-        
-        latents = torch.randn(latent_shape, dtype=self.dtype, device=self.device, generator=generator)            
-
-        scheduler.set_timesteps(num_inference_steps, device=self.device)
-        timesteps = scheduler.timesteps
-
-        extra_step_kwargs = {
-            "generator": generator
-        }
-
-        for i, t in enumerate(tqdm(timesteps, desc=f"{mode} Sampling:")):
-            latent_model_input = latents
-            timestep_tensor = torch.tensor([t], dtype=latent_model_input.dtype, device=self.device)
-
-            if mode == 'dense':
-                x_input = latent_model_input
-            elif mode in ['sparse512', 'sparse1024']:
-                x_input = sp.SparseTensor(latent_model_input, latent_index.int())
-
-            diffusion_inputs = {
-                "x": x_input,
-                "t": timestep_tensor,
-                "cond": cond,
-            }
-
-            noise_pred_cond = dit(**diffusion_inputs)
-            if mode != 'dense':
-                noise_pred_cond = noise_pred_cond.feats
-
-            if do_classifier_free_guidance:
-                diffusion_inputs["cond"] = uncond
-                noise_pred_uncond = dit(**diffusion_inputs)
-                if mode != 'dense':
-                    noise_pred_uncond = noise_pred_uncond.feats
-                noise_pred = noise_pred_uncond + guidance_scale * (noise_pred_cond - noise_pred_uncond)
+            self.telemetry.counter('latent_tokens', tokens=len(latent_index))
+            # one coordinate tensor for every step, so coordinate-keyed caches stay valid across steps
+            latent_coords = latent_index.int()
+
+        # Sparse stages that run out of memory are retried with the next OOM_FALLBACKS level.
+        # The level that succeeded is remembered per token-count bucket, so later jobs of that size start there.
+        bucket = (mode, len(latent_index) // OOM_BUCKET_TOKENS) if mode != 'dense' else None
+        level = self.oom_fallback_levels.get(bucket, 0) if mode != 'dense' else 0
+        peaks = {}
+        seed = generator.initial_seed() if generator is not None else None
+        while True:
+            offload_idle = self._memory_settings(vae, mode, level, memory_baseline) if mode != 'dense' else False
+            if offload_idle:
+                conditioner.to('cpu')
+                self._move(vae, 'cpu')
+                torch.cuda.empty_cache()
             else:
-                noise_pred = noise_pred_cond
-            
-            latents = scheduler.step(noise_pred, t, latents, **extra_step_kwargs).prev_sample
+                self._move(vae, self.device)
+            self._move(dit, self.device)
+            if generator is not None:
+                generator.manual_seed(seed)
+            self._reset_peak_memory()
+            try:
+                with self.telemetry.span('sampling', mode=mode, level=level):
+                    latents = self._sample(dit, scheduler, cond, uncond, latent_shape, latent_coords, mode,
+                                           num_inference_steps, guidance_scale, generator, sampler,
+                                           guidance_start, guidance_end, guidance_ramp, step_cache_threshold,
+                                           token_merge_ratio, ssa_profile)
+                break
+            except Exception as e:
+                if mode == 'dense' or not is_oom_error(e) or level + 1 >= len(OOM_FALLBACKS):
+                    raise
+                self._recover_from_oom('sampling', level, e)
+                level += 1
+        peaks['sampling'] = self._peak_memory()
+        del cond, uncond
         
         latents = 1. / vae.latents_scale * latents + vae.latents_shift
         
         if mode != 'dense':
-            latents = sp.SparseTensor(latents, latent_index.int())
+            latents = sp.SparseTensor(latents, latent_coords)
         
         decoder_inputs = {
             "latents": latents,
@@ -297,31 +430,213 @@ class Direct3DS2Pipeline(object):
             decoder_inputs['return_index'] = True
         elif remove_interior and self.use_legacy_config:
             decoder_inputs['return_feat'] = True
+        else:
+            if remove_floaters:
+                decoder_inputs['floater_ratio'] = FLOATER_RATIO
+            if face_budget > 0:
+                decoder_inputs['face_budget'] = face_budget
         if mode == 'sparse1024':
             decoder_inputs['voxel_resolution'] = 1024      
+        if mode != 'dense':
+            vae.decoder.set_pruning(prune_decoder)
         
-        outputs = vae.decode_mesh(**decoder_inputs)
+        while True:
+            if offload_idle:
+                self._move(dit, 'cpu')
+                torch.cuda.empty_cache()
+                self._move(vae, self.device)
+            self._reset_peak_memory()
+            try:
+                with self.telemetry.span('decode', mode=mode, level=level):
+                    outputs = vae.decode_mesh(**decoder_inputs)
+                break
+            except Exception as e:
+                if mode == 'dense' or not is_oom_error(e) or level + 1 >= len(OOM_FALLBACKS):
+                    raise
+                self._recover_from_oom('decoding', level, e)
+                level += 1
+                offload_idle = self._memory_settings(vae, mode, level, memory_baseline)
+
+        if mode != 'dense':
+            if level > self.oom_fallback_levels.get(bucket, 0):
+                print(f'[Direct3DS2Pipeline] {mode} jobs with about {len(latent_index)} tokens now start at fallback level {level}')
+            self.oom_fallback_levels[bucket] = level
+        if mode != 'dense' and self.device.type == 'cuda':
+            peaks['decoding'] = self._peak_memory()
+            self.memory_peaks[mode] = {
+                'tokens': len(latent_index),
+                'peaks': peaks,
+                'estimates': estimate_stages(self.cfg, mode, len(latent_index), vae.decoder.chunk_size,
+                                             get_token_chunk_size(), offload_idle),
+            }
         
         if remove_interior and self.use_legacy_config:            
-            del latents, noise_pred, noise_pred_cond, noise_pred_uncond, x_input, cond, uncond
+            del latents, decoder_inputs
+            if remove_floaters:
+                # the refiner meshes the decoded voxels itself, so drop the small components before it runs
+                reconst_x, feat = outputs
+                keep = remove_small_components(reconst_x.coords, FLOATER_RATIO)
+                outputs = (sp.SparseTensor(reconst_x.feats[keep], reconst_x.coords[keep]),
+                           sp.SparseTensor(feat.feats[keep], feat.coords[keep]))
+                del reconst_x, feat
             self.clear_memory()
             
             if mode == 'sparse512':
                 self.init_refiner()
-                outputs = self.refiner.run(*outputs, mc_threshold=mc_threshold*2.0)
+                self.refiner.set_sparse_patches(sparse_refiner)
+                with self.telemetry.span('refiner', mode=mode):
+                    outputs = self.refiner.run(*outputs, mc_threshold=mc_threshold*2.0)
             elif mode == 'sparse1024':
                 self.init_refiner_1024()                
-                outputs = self.refiner_1024.run(*outputs, mc_threshold=mc_threshold)
+                self.refiner_1024.set_sparse_patches(sparse_refiner)
+                with self.telemetry.span('refiner', mode=mode):
+                    outputs = self.refiner_1024.run(*outputs, mc_threshold=mc_threshold)
+
+        if mode != 'dense' and remove_floaters:
+            outputs = [mark_floaters_removed(m) for m in outputs]
+        if mode != 'dense' and all(hasattr(m, 'faces') for m in outputs):
+            self.telemetry.counter('mesh', vertices=sum(len(m.vertices) for m in outputs),
+                                   faces=sum(len(m.faces) for m in outputs))
 
         return outputs
-        
+
+    def _sample(self, dit, scheduler, cond, uncond, latent_shape, latent_coords, mode,
+                num_inference_steps, guidance_scale, generator, sampler='scheduler',
+                guidance_start=1.0, guidance_end=0.0, guidance_ramp='constant', step_cache_threshold=0.0,
+                token_merge_ratio=0.0, ssa_profile=False):
+        """
+        Integrate the flow from noise with `sampler`: 'scheduler' steps the config scheduler, any name in
+        utils.samplers.SAMPLERS runs that solver on the scheduler's sigma schedule, and 'auto' picks the
+        stage default of utils.samplers.STAGE_DEFAULTS.
+        Classifier-free guidance only runs for sigmas in [guidance_end, guidance_start]; elsewhere the
+        unconditional pass is skipped. `guidance_ramp` shapes the scale inside that interval.
+        With `step_cache_threshold` > 0 the sparse DiT reuses the residual of its middle blocks on steps
+        where its first block output barely changed (see modules.step_cache).
+        With `token_merge_ratio` > 0 the middle blocks of the sparse DiT run on merged tokens (see sp.TokenMerge).
+        With `ssa_profile` the sub-stages of the sparse DiT's attention are profiled per step and block
+        (see modules.ssa_profiler); the report is kept in `ssa_reports`.
+        """
+        do_classifier_free_guidance = uncond is not None
+        latents = torch.randn(latent_shape, dtype=self.dtype, device=self.device, generator=generator)            
+        sampler, num_inference_steps = resolve_sampler(sampler, mode, num_inference_steps)
+        stats = {'sampler': sampler, 'steps': num_inference_steps, 'nfe': 0, 'dit_calls': 0, 'guided': 0}
+        num_train_timesteps = scheduler.config.num_train_timesteps
+        step_cache = dit.set_step_cache(step_cache_threshold) if mode != 'dense' else None
+        if mode != 'dense':
+            dit.set_token_merge(token_merge_ratio)
+        ssa_profiler = dit.set_ssa_profiler(ssa_profile) if mode != 'dense' else None
+
+        def predict(latents, t):
+            with self.telemetry.span('step', cat='sampling', nfe=stats['nfe'], t=float(t)):
+                return _predict(latents, t)
+
+        def _predict(latents, t):
+            stats['nfe'] += 1
+            if ssa_profiler is not None:
+                ssa_profiler.step = stats['nfe'] - 1
+            timestep_tensor = torch.tensor([t], dtype=latents.dtype, device=self.device)
+
+            if mode == 'dense':
+                x_input = latents
+            elif mode in ['sparse512', 'sparse1024']:
+                x_input = sp.SparseTensor(latents, latent_coords)
+
+            diffusion_inputs = {
+                "x": x_input,
+                "t": timestep_tensor,
+                "cond": cond,
+            }
+
+            with self.telemetry.span('dit_cond', cat='sampling'):
+                noise_pred_cond = dit(**diffusion_inputs)
+            stats['dit_calls'] += 1
+            if mode != 'dense':
+                noise_pred_cond = noise_pred_cond.feats
+
+            scale = None
+            if do_classifier_free_guidance:
+                scale = guidance_scale_at(float(t) / num_train_timesteps, guidance_scale,
+                                          guidance_start, guidance_end, guidance_ramp)
+            if scale is not None:
+                diffusion_inputs["cond"] = uncond
+                with self.telemetry.span('dit_uncond', cat='sampling'):
+                    noise_pred_uncond = dit(**diffusion_inputs)
+                stats['dit_calls'] += 1
+                stats['guided'] += 1
+                if mode != 'dense':
+                    noise_pred_uncond = noise_pred_uncond.feats
+                return noise_pred_uncond + scale * (noise_pred_cond - noise_pred_uncond)
+            return noise_pred_cond
+
+        start = time.perf_counter()
+        if sampler == 'scheduler':
+            scheduler.set_timesteps(num_inference_steps, device=self.device)
+            extra_step_kwargs = {
+                "generator": generator
+            }
+            for i, t in enumerate(tqdm(scheduler.timesteps, desc=f"{mode} Sampling:")):
+                noise_pred = predict(latents, t)
+                latents = scheduler.step(noise_pred, t, latents, **extra_step_kwargs).prev_sample
+        else:
+            sigmas = scheduler_sigmas(scheduler, num_inference_steps, device=self.device)
+            velocity = lambda x, sigma: predict(x.to(self.dtype), sigma * num_train_timesteps).to(x.dtype)
+            latents = sample(sampler, velocity, latents.float(), sigmas, desc=f"{mode} Sampling ({sampler}):").to(self.dtype)
+        stats['seconds'] = time.perf_counter() - start
+        self.sampling_stats[mode] = stats
+        print(f"[Direct3DS2Pipeline] {mode} sampling with {sampler}: {num_inference_steps} steps, "
+              f"{stats['nfe']} model evaluations ({stats['guided']} guided), {stats['dit_calls']} DiT calls, {stats['seconds']:.1f}s")
+        if step_cache is not None:
+            stats.update(step_cache.stats())
+            print(f"[Direct3DS2Pipeline] step cache (threshold {step_cache_threshold}): {stats['cache_hits']} hits, "
+                  f"{stats['cache_misses']} misses")
+            dit.set_step_cache(0)
+        if mode != 'dense' and dit.merged_tokens:
+            merged = sum(m for m, _ in dit.merged_tokens) / len(dit.merged_tokens)
+            stats['merged_tokens'] = merged
+            start_block, end_block = dit.token_merge_blocks
+            print(f"[Direct3DS2Pipeline] token merging: {merged:.0f} of {dit.merged_tokens[0][1]} tokens merged "
+                  f"in blocks {start_block}-{end_block - 1} ({len(dit.merged_tokens)} passes)")
+            dit.set_token_merge(0)
+        if ssa_profiler is not None:
+            report = ssa_profiler.report()
+            self.ssa_reports[mode] = report
+            stats['ssa_ms'] = {name: stage['ms'] for name, stage in report['stages'].items()}
+            self.telemetry.annotate(**{f'ssa_{mode}': stats['ssa_ms']})
+            print(ssa_profiler.format_report(report, prefix=f"[Direct3DS2Pipeline] {mode} SSA profile:"))
+            dit.set_ssa_profiler(False)
+
+        return latents
+        
+    def _place(self, model, blocks):
+        """
+        Move `model` to the device. With `stream_blocks` set, `blocks` stay in host memory
+        and only `stream_blocks` of them at a time are streamed to the device.
+        """
+        if self.stream_blocks > 0:
+            model.block_streamer = stream_module_blocks(model, list(blocks), self.device, self.stream_blocks)
+        else:
+            model.to(self.device)
+
+    @staticmethod
+    def _unet_blocks(unet):
+        blocks = list(unet.down_blocks)
+        if unet.mid_block is not None:
+            blocks.append(unet.mid_block)
+        return blocks + list(unet.up_blocks)
+
+    @staticmethod
+    def _move(model, device):
+        # streamed models manage the placement of their blocks themselves
+        if getattr(model, 'block_streamer', None) is None:
+            model.to(device)
+
     def init_refiner(self):
         state_dict_refiner = torch.load(self.model_refiner_path, map_location='cpu', weights_only=True)
         self.refiner = instantiate_from_config(self.cfg.refiner)
         self.refiner.load_state_dict(state_dict_refiner["refiner"], strict=True)
         self.refiner.eval()
         
-        self.refiner.to(self.device)
+        self._place(self.refiner, self._unet_blocks(self.refiner.unet3d1))
         
     def init_refiner_1024(self):
         state_dict_refiner_1024 = torch.load(self.model_refiner_1024_path, map_location='cpu', weights_only=True)
@@ -329,18 +644,18 @@ class Direct3DS2Pipeline(object):
         self.refiner_1024.load_state_dict(state_dict_refiner_1024["refiner"], strict=True)
         self.refiner_1024.eval()
         
-        self.refiner_1024.to(self.device)
+        self._place(self.refiner_1024, self._unet_blocks(self.refiner_1024.unet3d1))
 
     def init_sparse_512(self):
         state_dict_sparse_512 = torch.load(self.model_sparse_512_path, map_location='cpu', weights_only=True)
         self.sparse_vae_512 = instantiate_from_config(self.cfg.sparse_vae_512) 
         self.sparse_vae_512.load_state_dict(state_dict_sparse_512["vae"], strict=True)
         self.sparse_vae_512.eval()
-        self.sparse_vae_512.to(self.device)
+        self._place(self.sparse_vae_512, self.sparse_vae_512.decoder.blocks)
         self.sparse_dit_512 = instantiate_from_config(self.cfg.sparse_dit_512)                                     
         self.sparse_dit_512.load_state_dict(state_dict_sparse_512["dit"], strict=True)
         self.sparse_dit_512.eval()
-        self.sparse_dit_512.to(self.device)
+        self._place(self.sparse_dit_512, self.sparse_dit_512.blocks)
         
         self.sparse_scheduler_512 = instantiate_from_config(self.cfg.sparse_scheduler_512)
         
@@ -352,11 +667,11 @@ class Direct3DS2Pipeline(object):
         self.sparse_vae_1024 = instantiate_from_config(self.cfg.sparse_vae_1024)                                        
         self.sparse_vae_1024.load_state_dict(state_dict_sparse_1024["vae"], strict=True)
         self.sparse_vae_1024.eval()
-        self.sparse_vae_1024.to(self.device)
+        self._place(self.sparse_vae_1024, self.sparse_vae_1024.decoder.blocks)
         self.sparse_dit_1024 = instantiate_from_config(self.cfg.sparse_dit_1024)
         self.sparse_dit_1024.load_state_dict(state_dict_sparse_1024["dit"], strict=True)
         self.sparse_dit_1024.eval()
-        self.sparse_dit_1024.to(self.device)
+        self._place(self.sparse_dit_1024, self.sparse_dit_1024.blocks)
 
         self.sparse_scheduler_1024 = instantiate_from_config(self.cfg.sparse_scheduler_1024)
         
@@ -380,8 +695,70 @@ class Direct3DS2Pipeline(object):
         self.sparse_image_encoder.to(self.device)
         
         
+    def mesh_to_latent_index(self, mesh, size, block_size, max_latent_tokens, scale, factor=8, method='udf'):
+        """
+        Voxelize `mesh` into a block-sorted latent index, shrinking the normalization scale
+        by 0.01 until the index has at most `max_latent_tokens` tokens.
+        `method` selects the full-resolution UDF route ('udf') or the coarse cell test ('coarse').
+        Both the per-scale indices and the final search result are cached by geometry hash,
+        so repeated runs on the same mesh skip voxelization. The input mesh is not modified.
+        """
+        geometry_hash = mesh_geometry_hash(mesh)
+        cached = self.latent_index_cache.get_search(geometry_hash, scale, size, factor, block_size, max_latent_tokens, method)
+        if cached is not None:
+            found_scale, latent_index = cached
+            print(f"number of latent tokens: {len(latent_index)} (cached, scale {found_scale:.2f})")
+            return latent_index.to(self.device)
+
+        start_scale = scale
+        mesh = mesh.copy()
+        while True:
+            latent_index = self.latent_index_cache.get(geometry_hash, scale, size, factor, block_size, method)
+            if latent_index is None:
+                mesh = normalize_mesh(mesh, scale=scale)
+                with self.telemetry.span('mesh2index', size=size, method=method, scale=scale):
+                    latent_index = mesh2index(mesh, size=size, factor=factor, method=method).to(self.device)
+                latent_index = sort_block(latent_index, block_size)
+                self.latent_index_cache.put(geometry_hash, scale, size, factor, block_size, latent_index, method)
+            else:
+                latent_index = latent_index.to(self.device)
+            print(f"number of latent tokens: {len(latent_index)}")
+
+            if len(latent_index) <= max_latent_tokens:
+                break
+
+            scale -= 0.01
+
+        self.latent_index_cache.put_search(geometry_hash, start_scale, size, factor, block_size, 
+                                           max_latent_tokens, scale, latent_index, method)
+        return latent_index
+
+    def _run_with_token_fallback(self, mode, max_latent_tokens, run):
+        """
+        Call `run(max_latent_tokens)`, shrinking the token budget by OOM_TOKEN_SCALES when it still
+        runs out of memory after every fallback level of `inference`. The scale that succeeded is
+        remembered for later jobs with the same requested budget.
+        """
+        key = (mode, max_latent_tokens // OOM_BUCKET_TOKENS)
+        start = self.oom_token_scales.get(key, 0)
+        for i in range(start, len(OOM_TOKEN_SCALES)):
+            tokens = int(max_latent_tokens * OOM_TOKEN_SCALES[i])
+            try:
+                mesh = run(tokens)
+            except Exception as e:
+                if not is_oom_error(e) or i + 1 >= len(OOM_TOKEN_SCALES):
+                    raise
+                print(f'[Direct3DS2Pipeline] out of memory with {tokens} latent tokens, '
+                      f'retrying with {int(max_latent_tokens * OOM_TOKEN_SCALES[i + 1])}')
+                gc.collect()
+                torch.cuda.empty_cache()
+                continue
+            self.oom_token_scales[key] = i
+            return mesh
+
     @torch.no_grad()
-    def refine_1024(self, image, mesh, steps, guidance_scale, remove_interior, mc_threshold, seed, max_latent_tokens, scale):
+    @traced_job('refine_1024')
+    def refine_1024(self, image, mesh, steps, guidance_scale, remove_interior, mc_threshold, seed, max_latent_tokens, scale, index_method='udf', **inference_kwargs):
         self.clear_memory()
         self.init_sparse_1024()
 
@@ -389,53 +766,53 @@ class Direct3DS2Pipeline(object):
             
         generator=torch.Generator(device=self.device).manual_seed(seed)
         
-        while True:
-            mesh = normalize_mesh(mesh, scale=scale)
-            latent_index = mesh2index(mesh, size=1024, factor=8)
-            latent_index = sort_block(latent_index, self.sparse_dit_1024.selection_block_size) 
-            print(f"number of latent tokens: {len(latent_index)}")
+        def run(max_latent_tokens):
+            if self.sparse_dit_1024 is None:
+                # the legacy remove_interior path clears the models before its refiner runs, so a
+                # refiner OOM reaches the retry without them
+                self.clear_memory()
+                self.init_sparse_1024()
+            latent_index = self.mesh_to_latent_index(mesh, 1024, self.sparse_dit_1024.selection_block_size, 
+                                                     max_latent_tokens, scale, method=index_method)
+            return self.inference(image, self.sparse_vae_1024, self.sparse_dit_1024, 
+                                self.sparse_image_encoder, self.sparse_scheduler_1024, 
+                                generator=generator, mode='sparse1024', 
+                                mc_threshold=mc_threshold, latent_index=latent_index, 
+                                remove_interior=remove_interior, num_inference_steps=steps, guidance_scale=guidance_scale, 
+                                **inference_kwargs)[0]
 
-            if len(latent_index) <= max_latent_tokens:
-                break
-            
-            scale -= 0.01            
-        
-        mesh = self.inference(image, self.sparse_vae_1024, self.sparse_dit_1024, 
-                            self.sparse_image_encoder, self.sparse_scheduler_1024, 
-                            generator=generator, mode='sparse1024', 
-                            mc_threshold=mc_threshold, latent_index=latent_index, 
-                            remove_interior=remove_interior, num_inference_steps=steps, guidance_scale=guidance_scale)[0]         
-        return mesh
+        return self._run_with_token_fallback('sparse1024', max_latent_tokens, run)
         
     @torch.no_grad()
-    def refine_512(self, image, mesh, steps, guidance_scale, remove_interior, mc_threshold, seed, max_latent_tokens, scale):
+    @traced_job('refine_512')
+    def refine_512(self, image, mesh, steps, guidance_scale, remove_interior, mc_threshold, seed, max_latent_tokens, scale, index_method='udf', **inference_kwargs):
         self.clear_memory()
         self.init_sparse_512()    
             
         generator=torch.Generator(device=self.device).manual_seed(seed)
         
-        while True:
-            mesh = normalize_mesh(mesh, scale=scale)
-            latent_index = mesh2index(mesh, size=512, factor=8)
-            latent_index = sort_block(latent_index, self.sparse_dit_512.selection_block_size) 
-            print(f"number of latent tokens: {len(latent_index)}")
-
-            if len(latent_index) <= max_latent_tokens:
-                break
-            
-            scale -= 0.01
-
         image = self.prepare_image(image)
 
-        mesh = self.inference(image, self.sparse_vae_512, self.sparse_dit_512, 
-                            self.sparse_image_encoder, self.sparse_scheduler_512, 
-                            generator=generator, mode='sparse512', 
-                            mc_threshold=mc_threshold, latent_index=latent_index, 
-                            remove_interior=remove_interior, num_inference_steps=steps, guidance_scale=guidance_scale)[0]         
-        return mesh   
+        def run(max_latent_tokens):
+            if self.sparse_dit_512 is None:
+                # the legacy remove_interior path clears the models before its refiner runs, so a
+                # refiner OOM reaches the retry without them
+                self.clear_memory()
+                self.init_sparse_512()
+            latent_index = self.mesh_to_latent_index(mesh, 512, self.sparse_dit_512.selection_block_size, 
+                                                     max_latent_tokens, scale, method=index_method)
+            return self.inference(image, self.sparse_vae_512, self.sparse_dit_512, 
+                                self.sparse_image_encoder, self.sparse_scheduler_512, 
+                                generator=generator, mode='sparse512', 
+                                mc_threshold=mc_threshold, latent_index=latent_index, 
+                                remove_interior=remove_interior, num_inference_steps=steps, guidance_scale=guidance_scale, 
+                                **inference_kwargs)[0]
+
+        return self._run_with_token_fallback('sparse512', max_latent_tokens, run)
         
     @torch.no_grad()
-    def generate_dense(self, image, steps, guidance_scale, mc_threshold, seed):
+    @traced_job('generate_dense')
+    def generate_dense(self, image, steps, guidance_scale, mc_threshold, seed, **inference_kwargs):
         self.clear_memory()
         self.init_dense()
         
@@ -447,11 +824,13 @@ class Direct3DS2Pipeline(object):
                             self.sparse_image_encoder, self.dense_scheduler, 
                             generator=generator, mode='dense', 
                             mc_threshold=mc_threshold, 
-                            num_inference_steps=steps, guidance_scale=guidance_scale)[0]         
+                            num_inference_steps=steps, guidance_scale=guidance_scale, 
+                            **inference_kwargs)[0]         
         return mesh    
 
     @torch.no_grad()
-    def refine_dense_512(self, image, latent_index, steps, guidance_scale, remove_interior, mc_threshold, seed):
+    @traced_job('refine_dense_512')
+    def refine_dense_512(self, image, latent_index, steps, guidance_scale, remove_interior, mc_threshold, seed, **inference_kwargs):
         self.clear_memory()
         self.init_sparse_512()    
             
@@ -466,11 +845,13 @@ class Direct3DS2Pipeline(object):
                             self.sparse_image_encoder, self.sparse_scheduler_512, 
                             generator=generator, mode='sparse512', 
                             mc_threshold=mc_threshold, latent_index=latent_index, 
-                            remove_interior=remove_interior, num_inference_steps=steps, guidance_scale=guidance_scale)[0]         
+                            remove_interior=remove_interior, num_inference_steps=steps, guidance_scale=guidance_scale, 
+                            **inference_kwargs)[0]         
         return mesh 
 
     @torch.no_grad()
-    def refine_dense_1024(self, image, latent_index, steps, guidance_scale, remove_interior, mc_threshold, seed):
+    @traced_job('refine_dense_1024')
+    def refine_dense_1024(self, image, latent_index, steps, guidance_scale, remove_interior, mc_threshold, seed, **inference_kwargs):
         self.clear_memory()
         self.init_sparse_1024()
 
@@ -485,10 +866,12 @@ class Direct3DS2Pipeline(object):
                             self.sparse_image_encoder, self.sparse_scheduler_1024, 
                             generator=generator, mode='sparse1024', 
                             mc_threshold=mc_threshold, latent_index=latent_index, 
-                            remove_interior=remove_interior, num_inference_steps=steps, guidance_scale=guidance_scale)[0]         
+                            remove_interior=remove_interior, num_inference_steps=steps, guidance_scale=guidance_scale, 
+                            **inference_kwargs)[0]         
         return mesh     
     
     @torch.no_grad()
+    @traced_job('pipeline')
     def __call__(
         self,
         image: Union[str, List[str], Image.Image, List[Image.Image]] = None,
@@ -505,7 +888,9 @@ class Direct3DS2Pipeline(object):
         remove_interior_512: bool = False,
         remove_interior_1024: bool = False,
         target_facenum: int = 200000,
-        simplify_lib: str = "Pymeshlab"):
+        simplify_lib: str = "Pymeshlab",
+        remove_floaters: bool = False,
+        face_budget: int = 0):
 
         image = self.prepare_image(image)
         
@@ -551,7 +936,8 @@ class Direct3DS2Pipeline(object):
             del latent_index
             torch.cuda.empty_cache()
             mesh = normalize_mesh(mesh)
-            latent_index = mesh2index(mesh, size=1024, factor=8)
+            with self.telemetry.span('mesh2index', size=1024):
+                latent_index = mesh2index(mesh, size=1024, factor=8)
             latent_index = sort_block(latent_index, self.sparse_dit_1024.selection_block_size)
             print(f"number of latent tokens: {len(latent_index)}")
 
@@ -559,15 +945,18 @@ class Direct3DS2Pipeline(object):
                                 self.sparse_image_encoder, self.sparse_scheduler_1024, 
                                 generator=generator, mode='sparse1024', 
                                 mc_threshold=mc_threshold, latent_index=latent_index, 
-                                remove_interior=remove_interior_1024, **sparse_1024_sampler_params)[0]
+                                remove_interior=remove_interior_1024, remove_floaters=remove_floaters, 
+                                face_budget=face_budget, **sparse_1024_sampler_params)[0]
             
         if remesh:
-            if simplify_lib == "Pymeshlab":            
-                from .utils.postprocessors import postprocessmesh
-                mesh = postprocessmesh(mesh.vertices, mesh.faces, target_facenum)
-            elif simplify_lib == "Meshlib":
-                from .utils.meshlib import postprocessmesh
-                mesh = postprocessmesh(mesh.vertices, mesh.faces, target_facenum)               
+            with self.telemetry.span('postprocess', simplify_lib=simplify_lib, faces=len(mesh.faces)):
+                if simplify_lib == "Pymeshlab":            
+                    from .workers.postprocessors import postprocessmesh
+                    # floaters were already removed in voxel space
+                    mesh = postprocessmesh(mesh.vertices, mesh.faces, target_facenum, remove_floaters=not remove_floaters)
+                elif simplify_lib == "Meshlib":
+                    from .workers.meshlib import postprocessmesh
+                    mesh = postprocessmesh(mesh.vertices, mesh.faces, target_facenum, remove_floaters=not remove_floaters)               
             # import trimesh
             # from direct3d_s2.utils import postprocess_mesh
             # filled_mesh = postprocess_mesh(
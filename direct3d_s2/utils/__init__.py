@@ -1,6 +1,10 @@
 from .util import instantiate_from_config, get_obj_from_str
 from .image import preprocess_image
 from .rembg import BiRefNet
-from .sparse import sort_block, extract_tokens_and_coords
-from .mesh import mesh2index, normalize_mesh
-from .fill_hole import postprocess_mesh
\ No newline at end of file
+from .sparse import sort_block, extract_tokens_and_coords, voxel_components, remove_small_components
+from .mesh import mesh2index, mesh2index_coarse, benchmark_mesh2index, normalize_mesh, chamfer_distance, mark_floaters_removed, floaters_removed
+from .index_cache import LatentIndexCache, mesh_geometry_hash
+from .memory import MemoryPlan, plan_memory, estimate_stages
+from .fill_hole import postprocess_mesh
+from .samplers import SAMPLERS, SAMPLER_NAMES, STAGE_DEFAULTS, GUIDANCE_RAMPS, register_sampler, benchmark_samplers, benchmark_step_cache, benchmark_token_merge
+from .telemetry import Telemetry, get_telemetry, traced_job
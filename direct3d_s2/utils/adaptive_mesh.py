@@ -0,0 +1,161 @@
+from typing import *
+import time
+import numpy as np
+
+# Adaptive octree vertex clustering of a marching cubes surface.
+#
+# The fine marching cubes vertices are grouped into octree cells of 1 .. 2^max_level voxels. A cell
+# is kept whole when the surface inside it is flat, measured by the spread of the area-weighted
+# normals (the SDF gradient direction on the surface) scaled by the cell size; otherwise its
+# children are used. Each cluster is replaced by the minimizer of the quadric error of the planes
+# around it, so sharp features survive inside coarse cells. The flatness threshold is found by
+# bisection so that the number of faces lands just under a face budget.
+
+MAX_LEVEL = 5
+BISECTION_STEPS = 14
+
+
+def _corner_sums(faces, values, num_vertices):
+    # sum per-face values onto the three corners of every face
+    out = np.zeros((num_vertices,) + values.shape[1:], dtype=np.float64)
+    flat = values.reshape(len(values), -1)
+    out_flat = out.reshape(num_vertices, -1)
+    for corner in range(3):
+        for c in range(flat.shape[1]):
+            out_flat[:, c] += np.bincount(faces[:, corner], weights=flat[:, c], minlength=num_vertices)
+    return out
+
+
+def _cell_keys(vertices, size):
+    cells = np.floor(vertices / size).astype(np.int64)
+    return (cells[:, 0] << 42) | (cells[:, 1] << 21) | cells[:, 2]
+
+
+class AdaptiveClustering(object):
+    """
+    Precomputed octree levels of a triangle mesh, clustered for a flatness threshold with `cluster`.
+
+    Args:
+        vertices (np.ndarray): [V, 3] vertices in voxel units (non-negative).
+        faces (np.ndarray): [F, 3] faces.
+        max_level (int): Coarsest octree level, cells of 2^max_level voxels.
+    """
+    def __init__(self, vertices: np.ndarray, faces: np.ndarray, max_level: int = MAX_LEVEL):
+        self.vertices = vertices.astype(np.float64)
+        self.faces = faces.astype(np.int64)
+        self.max_level = max_level
+        V = len(self.vertices)
+
+        v0, v1, v2 = (self.vertices[self.faces[:, i]] for i in range(3))
+        cross = np.cross(v1 - v0, v2 - v0)
+        area = np.linalg.norm(cross, axis=1) / 2
+        normals = cross / np.maximum(2 * area, 1e-12)[:, None]
+        # quadric of every face plane n.x = n.p weighted by area: A = a n n^T, b = a n (n.p)
+        offsets = np.einsum('ij,ij->i', normals, v0)
+        quadric_A = area[:, None, None] * normals[:, :, None] * normals[:, None, :]
+        quadric_b = (area * offsets)[:, None] * normals
+        self.vertex_A = _corner_sums(self.faces, quadric_A, V) / 3
+        self.vertex_b = _corner_sums(self.faces, quadric_b, V) / 3
+        self.vertex_area = _corner_sums(self.faces, area[:, None], V)[:, 0] / 3
+        vertex_normal = _corner_sums(self.faces, area[:, None] * normals, V) / 3
+
+        # per level: cell id of every vertex and the flatness error of that cell
+        self.cell_ids = np.zeros((max_level + 1, V), dtype=np.int64)
+        self.errors = np.zeros((max_level + 1, V), dtype=np.float64)
+        self.offsets = np.zeros(max_level + 2, dtype=np.int64)
+        for level in range(max_level + 1):
+            size = 2 ** level
+            _, inverse = np.unique(_cell_keys(self.vertices, size), return_inverse=True)
+            inverse = inverse.reshape(-1)
+            num_cells = int(inverse.max()) + 1 if V > 0 else 0
+            cell_normal = np.stack([np.bincount(inverse, weights=vertex_normal[:, c], minlength=num_cells) for c in range(3)], axis=1)
+            cell_area = np.bincount(inverse, weights=self.vertex_area, minlength=num_cells)
+            flatness = 1 - np.linalg.norm(cell_normal, axis=1) / np.maximum(cell_area, 1e-12)
+            self.cell_ids[level] = inverse
+            self.errors[level] = (flatness * size)[inverse]
+            self.offsets[level + 1] = self.offsets[level] + num_cells
+
+    def levels(self, threshold: float) -> np.ndarray:
+        """
+        Octree level of every vertex: the coarsest level whose cell error is within `threshold`.
+        """
+        level = np.zeros(len(self.vertices), dtype=np.int64)
+        assigned = np.zeros(len(self.vertices), dtype=bool)
+        for l in range(self.max_level, 0, -1):
+            take = ~assigned & (self.errors[l] <= threshold)
+            level[take] = l
+            assigned |= take
+        return level
+
+    def clusters(self, threshold: float) -> Tuple[np.ndarray, np.ndarray]:
+        level = self.levels(threshold)
+        cluster = self.cell_ids[level, np.arange(len(self.vertices))] + self.offsets[level]
+        return cluster, level
+
+    def count_faces(self, threshold: float) -> int:
+        cluster, _ = self.clusters(threshold)
+        f = cluster[self.faces]
+        return int(((f[:, 0] != f[:, 1]) & (f[:, 1] != f[:, 2]) & (f[:, 0] != f[:, 2])).sum())
+
+    def cluster(self, threshold: float) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Clustered mesh for a flatness threshold (in voxels).
+        """
+        cluster, level = self.clusters(threshold)
+        _, inverse = np.unique(cluster, return_inverse=True)
+        inverse = inverse.reshape(-1)
+        K = int(inverse.max()) + 1
+        sums = lambda w: np.bincount(inverse, weights=w, minlength=K)
+        A = np.stack([sums(self.vertex_A[:, i, j]) for i in range(3) for j in range(3)], axis=1).reshape(K, 3, 3)
+        b = np.stack([sums(self.vertex_b[:, c]) for c in range(3)], axis=1)
+        count = sums(np.ones(len(self.vertices)))
+        centroid = np.stack([sums(self.vertices[:, c]) for c in range(3)], axis=1) / count[:, None]
+        # regularize towards the centroid, which also fixes the rank deficient flat and edge cases
+        reg = 1e-2 * np.maximum(sums(self.vertex_area), 1e-6)
+        A = A + reg[:, None, None] * np.eye(3)
+        b = b + reg[:, None] * centroid
+        points = np.linalg.solve(A, b[:, :, None])[:, :, 0]
+        # keep every point near its cell
+        size = (2.0 ** np.bincount(inverse, weights=level, minlength=K) / count)[:, None]
+        cell_min = np.floor(centroid / size) * size
+        points = np.clip(points, cell_min - 0.5, cell_min + size + 0.5)
+
+        faces = inverse[self.faces]
+        faces = faces[(faces[:, 0] != faces[:, 1]) & (faces[:, 1] != faces[:, 2]) & (faces[:, 0] != faces[:, 2])]
+        _, first = np.unique(np.sort(faces, axis=1), axis=0, return_index=True)
+        faces = faces[np.sort(first)]
+        used = np.zeros(K, dtype=bool)
+        used[faces.reshape(-1)] = True
+        compact = np.cumsum(used) - 1
+        return points[used], compact[faces]
+
+
+def adaptive_mesh(vertices: np.ndarray, faces: np.ndarray, face_budget: int, max_level: int = MAX_LEVEL):
+    """
+    Reduce a marching cubes mesh to at most about `face_budget` faces with adaptive octree clustering.
+
+    Args:
+        vertices (np.ndarray): [V, 3] vertices in voxel units.
+        faces (np.ndarray): [F, 3] faces.
+        face_budget (int): Target face count.
+        max_level (int): Coarsest octree level.
+    """
+    if face_budget <= 0 or len(faces) <= face_budget:
+        return vertices, faces
+    start = time.perf_counter()
+    clustering = AdaptiveClustering(vertices, faces, max_level)
+    lo, hi = 0.0, float(2 ** max_level)
+    if clustering.count_faces(hi) > face_budget:
+        # even the coarsest cells are above budget
+        lo = hi
+    else:
+        for _ in range(BISECTION_STEPS):
+            mid = (lo + hi) / 2
+            if clustering.count_faces(mid) > face_budget:
+                lo = mid
+            else:
+                hi = mid
+    out_vertices, out_faces = clustering.cluster(hi)
+    print(f"[AdaptiveMesh] {len(faces)} -> {len(out_faces)} faces (budget {face_budget}, "
+          f"flatness threshold {hi:.3f} voxels) in {time.perf_counter() - start:.2f}s")
+    return out_vertices.astype(np.float32), out_faces
@@ -0,0 +1,112 @@
+import os
+import time
+import atexit
+import numpy as np
+import trimesh
+
+# the job runs in a module that spawned workers can import without this package
+from direct3d_s2.workers.shared import SharedArray, spawn_pool, submit
+from direct3d_s2.workers.postprocess import postprocess_job
+from .mesh import floaters_removed, mark_floaters_removed
+
+# Mesh post-processing (floater removal and decimation) runs in a process pool, so the worker that
+# drives the GPU can go on with the next job. Vertex and face arrays are handed over in shared memory,
+# and the caller gets a MeshFuture that stands in for the trimesh until someone reads from it.
+#
+# Workers only import direct3d_s2.workers.postprocess, which loads pymeshlab or meshlib inside the
+# job, so they stay far lighter than the process driving the GPU.
+
+POSTPROCESS_WORKERS = 2
+
+def __from_env():
+    global POSTPROCESS_WORKERS
+    env_workers = os.environ.get('POSTPROCESS_WORKERS')
+    if env_workers is not None and env_workers.isdigit():
+        POSTPROCESS_WORKERS = max(int(env_workers), 1)
+        print(f"[Postprocess] Workers: {POSTPROCESS_WORKERS}")
+
+
+__from_env()
+
+
+_pool = None
+
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        _pool = spawn_pool(POSTPROCESS_WORKERS)
+    return _pool
+
+
+def shutdown_pool():
+    """
+    Stop the post-processing workers. Jobs that have not started are cancelled.
+    """
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(cancel_futures=True)
+    _pool = None
+
+
+atexit.register(shutdown_pool)
+
+
+class MeshFuture(object):
+    """
+    Handle of a mesh that is being post-processed in the background.
+
+    Attribute access is forwarded to the finished trimesh, which blocks until the job is done, so
+    the handle can be passed on wherever a TRIMESH is expected.
+    """
+    def __init__(self, future, blocks, submitted, floaters_removed=False):
+        object.__setattr__(self, '_future', future)
+        object.__setattr__(self, '_mesh', None)
+        object.__setattr__(self, '_submitted', submitted)
+        object.__setattr__(self, '_floaters_removed', floaters_removed)
+        future.add_done_callback(lambda _: [block.release() for block in blocks])
+
+    def done(self) -> bool:
+        return self._future.done()
+
+    def result(self) -> trimesh.Trimesh:
+        if self._mesh is None:
+            vertices, faces, seconds = self._future.result()
+            waited = time.perf_counter() - self._submitted
+            print(f"[Postprocess] {len(faces)} faces after {seconds:.2f}s of post-processing, "
+                  f"resolved {waited:.2f}s after submission")
+            mesh = trimesh.Trimesh(vertices=vertices, faces=faces, process=False)
+            if self._floaters_removed:
+                mark_floaters_removed(mesh)
+            object.__setattr__(self, '_mesh', mesh)
+        return self._mesh
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return getattr(self.result(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self.result(), name, value)
+
+
+def submit_postprocess(mesh: trimesh.Trimesh, face_num: int = 200000, simplify_lib: str = "Pymeshlab",
+                       remove_floaters: bool = True) -> MeshFuture:
+    """
+    Start floater removal and decimation of `mesh` in the post-processing pool. Floater removal is
+    skipped for meshes whose floaters the pipeline already removed in voxel space.
+    """
+    already_removed = floaters_removed(mesh)
+    vertices = SharedArray.create(np.asarray(mesh.vertices))
+    faces = SharedArray.create(np.asarray(mesh.faces))
+    future = submit(_get_pool(), postprocess_job, vertices, faces, face_num, simplify_lib,
+                    remove_floaters and not already_removed)
+    return MeshFuture(future, [vertices, faces], time.perf_counter(),
+                      already_removed or remove_floaters)
+
+
+def resolve_mesh(mesh):
+    """
+    The trimesh behind `mesh`, waiting for it if it is a MeshFuture.
+    """
+    return mesh.result() if isinstance(mesh, MeshFuture) else mesh
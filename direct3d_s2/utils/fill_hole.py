@@ -6,6 +6,11 @@ from pymeshfix import _meshfix
 import igraph
 import pyvista as pv
 
+# Caps of the CPU visibility fallback. It casts CPU_NUM_VIEWS * CPU_RAY_RESOLUTION^2 rays (about 1M),
+# a second or two with a BVH (open3d or embree); the GPU defaults (1000 views at 256^2) would be 65M.
+CPU_NUM_VIEWS = 64
+CPU_RAY_RESOLUTION = 128
+
 PRIMES = [2, 3, 5, 7, 11, 13, 17, 19, 23, 29, 31, 37, 41, 43, 47, 53]
 
 def radical_inverse(base, n):
@@ -35,6 +40,112 @@ def sphere_hammersley_sequence(n, num_samples, offset=(0, 0), remap=False):
     phi = v * 2 * np.pi
     return [phi, theta]
 
+def sphere_views(num_views, radius=2.0, device='cpu'):
+    """
+    Camera origins on a Hammersley sphere and their look-at view matrices, built in one batch.
+    """
+    angles = torch.tensor([sphere_hammersley_sequence(i, num_views) for i in range(num_views)], dtype=torch.float32, device=device)
+    yaws, pitchs = angles[:, 0], angles[:, 1]
+    origins = torch.stack([
+        torch.sin(yaws) * torch.cos(pitchs),
+        torch.cos(yaws) * torch.cos(pitchs),
+        torch.sin(pitchs),
+    ], dim=-1) * radius
+    look_at = torch.zeros_like(origins)
+    up = torch.tensor([0, 0, 1], dtype=torch.float32, device=device).expand_as(origins)
+    views = utils3d.torch.view_look_at(origins, look_at, up)
+    return origins, views
+
+def _visibility_raster(verts, faces, views, fov, resolution, view_batch=16, verbose=False):
+    """
+    Number of views each face is visible in, rasterizing `view_batch` views per call.
+    """
+    projection = utils3d.torch.perspective_from_fov_xy(fov, fov, 1, 3)
+    num_faces = faces.shape[0]
+    visibility = torch.zeros(num_faces, dtype=torch.int32, device=verts.device)
+    rastctx = utils3d.torch.RastContext(backend='cuda')
+    for start in tqdm(range(0, views.shape[0], view_batch), disable=not verbose, desc='Rasterizing'):
+        view = views[start:start + view_batch]
+        B = view.shape[0]
+        buffers = utils3d.torch.rasterize_triangle_faces(
+            rastctx, verts[None].float().expand(B, -1, -1), faces, resolution, resolution, view=view, projection=projection
+        )
+        mask = buffers['mask'] > 0.95
+        face_id = buffers['face_id'][mask].long() - 1
+        view_id = torch.arange(B, device=verts.device)[:, None, None].expand_as(mask)[mask]
+        # one (view, face) key per visible face and view
+        keys = torch.unique(view_id * num_faces + face_id)
+        visibility += torch.bincount(keys % num_faces, minlength=num_faces).int()
+    return visibility
+
+def _first_hit_function(vertices, faces):
+    """
+    Function mapping (ray origins, directions) to the first face hit, or -1, using a BVH:
+    open3d's RaycastingScene if available, else trimesh's embree intersector.
+    """
+    try:
+        import open3d as o3d
+    except ImportError:
+        o3d = None
+    if o3d is not None:
+        scene = o3d.t.geometry.RaycastingScene()
+        scene.add_triangles(o3d.core.Tensor(vertices.astype(np.float32)), o3d.core.Tensor(faces.astype(np.uint32)))
+        def first_hits(ray_origins, directions):
+            rays = np.concatenate([ray_origins, directions], axis=1).astype(np.float32)
+            ids = scene.cast_rays(o3d.core.Tensor(rays))['primitive_ids'].numpy().astype(np.int64)
+            ids[ids == o3d.t.geometry.RaycastingScene.INVALID_ID] = -1
+            return ids
+        return first_hits
+    import trimesh
+    if not getattr(trimesh.ray, 'has_embree', False):
+        # trimesh's pure numpy intersector needs hours for the rays of a single mesh
+        raise RuntimeError('CPU hole filling needs a BVH ray caster: install open3d or embreex')
+    mesh = trimesh.Trimesh(vertices, faces, process=False)
+    return mesh.ray.intersects_first
+
+def _visibility_raycast(verts, faces, origins, fov, resolution, view_batch=16, verbose=False):
+    """
+    CPU fallback of _visibility_raster: casts one ray per pixel against a BVH of the faces.
+    The cost is len(origins) * resolution^2 rays; _fill_holes caps them at CPU_NUM_VIEWS views of
+    CPU_RAY_RESOLUTION^2 pixels.
+    """
+    first_hits = _first_hit_function(verts.cpu().numpy(), faces.cpu().numpy())
+    num_faces = faces.shape[0]
+    origins = origins.cpu().numpy().astype(np.float64)
+    pixels = (np.arange(resolution) + 0.5) / resolution * 2 - 1
+    u, v = np.meshgrid(pixels, -pixels, indexing='xy')
+    tan_half = np.tan(float(fov) / 2)
+    visibility = np.zeros(num_faces, dtype=np.int64)
+    for start in tqdm(range(0, len(origins), view_batch), disable=not verbose, desc='Ray casting'):
+        eye = origins[start:start + view_batch]
+        forward = -eye / np.linalg.norm(eye, axis=-1, keepdims=True)
+        right = np.cross(forward, [0, 0, 1])
+        right /= np.maximum(np.linalg.norm(right, axis=-1, keepdims=True), 1e-8)
+        up = np.cross(right, forward)
+        directions = forward[:, None, None] + tan_half * (u[None, ..., None] * right[:, None, None] + v[None, ..., None] * up[:, None, None])
+        directions = directions.reshape(-1, 3)
+        ray_origins = np.repeat(eye, resolution * resolution, axis=0)
+        hits = first_hits(ray_origins, directions)
+        view_id = np.repeat(np.arange(len(eye)), resolution * resolution)
+        keys = np.unique(view_id[hits >= 0] * num_faces + hits[hits >= 0])
+        visibility += np.bincount(keys % num_faces, minlength=num_faces)
+    return torch.tensor(visibility, dtype=torch.int32, device=verts.device)
+
+def segment_quantile(values, labels, num_segments, q):
+    """
+    Per-segment linear-interpolated quantile of `values`, computed with one sort instead of a loop over segments.
+    """
+    order = torch.argsort(labels.double() * 2 + values.double().clamp(0, 1))
+    sorted_values = values[order]
+    counts = torch.bincount(labels, minlength=num_segments)
+    starts = torch.cumsum(counts, dim=0) - counts
+    pos = (counts - 1).clamp(min=0).to(values.dtype) * q
+    lo, hi = pos.floor().long(), pos.ceil().long()
+    last = sorted_values.shape[0] - 1
+    lo_values = sorted_values[(starts + lo).clamp(max=last)]
+    hi_values = sorted_values[(starts + hi).clamp(max=last)]
+    return lo_values + (hi_values - lo_values) * (pos - lo.to(values.dtype))
+
 @torch.no_grad()
 def _fill_holes(
     verts,
@@ -43,6 +154,8 @@ def _fill_holes(
     max_hole_nbe=32,
     resolution=128,
     num_views=500,
+    view_batch=16,
+    backend='auto',
     debug=False,
     verbose=False
 ):
@@ -58,42 +171,25 @@ def _fill_holes(
         max_hole_size (float): Maximum area of a hole to fill.
         resolution (int): Resolution of the rasterization.
         num_views (int): Number of views to rasterize the mesh.
+        view_batch (int): Number of views rasterized (or ray cast) per call.
+        backend (str): 'cuda' rasterization, 'cpu' ray casting, or 'auto' to pick by the device of `verts`.
+            The CPU path uses at most CPU_NUM_VIEWS views at CPU_RAY_RESOLUTION and needs open3d or embree.
         verbose (bool): Whether to print progress.
     """
-    # Construct cameras
-    yaws = []
-    pitchs = []
-    for i in range(num_views):
-        y, p = sphere_hammersley_sequence(i, num_views)
-        yaws.append(y)
-        pitchs.append(p)
-    yaws = torch.tensor(yaws).cuda()
-    pitchs = torch.tensor(pitchs).cuda()
-    radius = 2.0
-    fov = torch.deg2rad(torch.tensor(40)).cuda()
-    projection = utils3d.torch.perspective_from_fov_xy(fov, fov, 1, 3)
-    views = []
-    for (yaw, pitch) in zip(yaws, pitchs):
-        orig = torch.tensor([
-            torch.sin(yaw) * torch.cos(pitch),
-            torch.cos(yaw) * torch.cos(pitch),
-            torch.sin(pitch),
-        ]).cuda().float() * radius
-        view = utils3d.torch.view_look_at(orig, torch.tensor([0, 0, 0]).float().cuda(), torch.tensor([0, 0, 1]).float().cuda())
-        views.append(view)
-    views = torch.stack(views, dim=0)
+    device = verts.device
+    if backend == 'auto':
+        backend = 'cuda' if device.type == 'cuda' else 'cpu'
+    if backend == 'cpu':
+        num_views = min(num_views, CPU_NUM_VIEWS)
+        resolution = min(resolution, CPU_RAY_RESOLUTION)
 
-    # Rasterize
-    visblity = torch.zeros(faces.shape[0], dtype=torch.int32, device=verts.device)
-    rastctx = utils3d.torch.RastContext(backend='cuda')
-    for i in tqdm(range(views.shape[0]), total=views.shape[0], disable=not verbose, desc='Rasterizing'):
-        view = views[i]
-        buffers = utils3d.torch.rasterize_triangle_faces(
-            rastctx, verts[None].float(), faces, resolution, resolution, view=view, projection=projection
-        )
-        face_id = buffers['face_id'][0][buffers['mask'][0] > 0.95] - 1
-        face_id = torch.unique(face_id).long()
-        visblity[face_id] += 1
+    # Visibility
+    fov = torch.deg2rad(torch.tensor(40.0, device=device))
+    origins, views = sphere_views(num_views, radius=2.0, device=device)
+    if backend == 'cuda':
+        visblity = _visibility_raster(verts, faces, views, fov, resolution, view_batch, verbose)
+    else:
+        visblity = _visibility_raycast(verts, faces, origins, fov, resolution, view_batch, verbose)
     visblity = visblity.float() / num_views
     
     # Mincut
@@ -101,10 +197,11 @@ def _fill_holes(
     edges, face2edge, edge_degrees = utils3d.torch.compute_edges(faces)
     boundary_edge_indices = torch.nonzero(edge_degrees == 1).reshape(-1)
     connected_components = utils3d.torch.compute_connected_components(faces, edges, face2edge)
-    outer_face_indices = torch.zeros(faces.shape[0], dtype=torch.bool, device=faces.device)
+    component = torch.zeros(faces.shape[0], dtype=torch.long, device=faces.device)
     for i in range(len(connected_components)):
-        outer_face_indices[connected_components[i]] = visblity[connected_components[i]] > min(max(visblity[connected_components[i]].quantile(0.75).item(), 0.25), 0.5)
-    outer_face_indices = outer_face_indices.nonzero().reshape(-1)
+        component[connected_components[i]] = i
+    threshold = segment_quantile(visblity, component, len(connected_components), 0.75).clamp(0.25, 0.5)
+    outer_face_indices = torch.nonzero(visblity > threshold[component]).reshape(-1)
     
     ## construct inner faces
     inner_face_indices = torch.nonzero(visblity == 0).reshape(-1)
@@ -209,7 +306,7 @@ def _fill_holes(
     mesh.load_array(verts.cpu().numpy(), faces.cpu().numpy())
     mesh.fill_small_boundaries(nbe=max_hole_nbe, refine=True)
     verts, faces = mesh.return_arrays()
-    verts, faces = torch.tensor(verts, device='cuda', dtype=torch.float32), torch.tensor(faces, device='cuda', dtype=torch.int32)
+    verts, faces = torch.tensor(verts, device=device, dtype=torch.float32), torch.tensor(faces, device=device, dtype=torch.int32)
 
     return verts, faces
 
@@ -223,6 +320,7 @@ def postprocess_mesh(
     fill_holes_max_hole_nbe: int = 32,
     fill_holes_resolution: int = 1024,
     fill_holes_num_views: int = 1000,
+    fill_holes_backend: str = 'auto',
     debug: bool = False,
     verbose: bool = False,
 ):
@@ -239,6 +337,8 @@ def postprocess_mesh(
         fill_holes_max_hole_nbe (int): Maximum number of boundary edges of a hole to fill.
         fill_holes_resolution (int): Resolution of the rasterization.
         fill_holes_num_views (int): Number of views to rasterize the mesh.
+        fill_holes_backend (str): 'cuda' rasterization, 'cpu' ray casting, or 'auto' (CUDA when available).
+            CPU ray casting is capped at CPU_NUM_VIEWS views of CPU_RAY_RESOLUTION^2 rays and needs open3d or embree.
         verbose (bool): Whether to print progress.
     """
 
@@ -255,13 +355,15 @@ def postprocess_mesh(
 
     # Remove invisible faces
     if fill_holes:
-        vertices, faces = torch.tensor(vertices).cuda(), torch.tensor(faces.astype(np.int32)).cuda()
+        device = 'cuda' if fill_holes_backend == 'cuda' or (fill_holes_backend == 'auto' and torch.cuda.is_available()) else 'cpu'
+        vertices, faces = torch.tensor(vertices, device=device), torch.tensor(faces.astype(np.int32), device=device)
         vertices, faces = _fill_holes(
             vertices, faces,
             max_hole_size=fill_holes_max_hole_size,
             max_hole_nbe=fill_holes_max_hole_nbe,
             resolution=fill_holes_resolution,
             num_views=fill_holes_num_views,
+            backend=fill_holes_backend,
             debug=debug,
             verbose=verbose,
         )
@@ -0,0 +1,102 @@
+import os
+import hashlib
+from collections import OrderedDict
+import numpy as np
+import torch
+
+
+def mesh_geometry_hash(mesh):
+    """
+    Hash the vertex and face buffers of a mesh.
+
+    Args:
+        mesh (trimesh.Trimesh): Mesh to hash. It should be hashed before normalize_mesh is applied.
+
+    Returns:
+        str: Hex digest identifying the geometry.
+    """
+    vertices = np.ascontiguousarray(mesh.vertices)
+    faces = np.ascontiguousarray(mesh.faces)
+    h = hashlib.sha1()
+    h.update(str((vertices.shape, vertices.dtype.str, faces.shape, faces.dtype.str)).encode())
+    h.update(vertices.tobytes())
+    h.update(faces.tobytes())
+    return h.hexdigest()
+
+
+class LatentIndexCache(object):
+    """
+    Cache for the results of normalize_mesh + mesh2index + sort_block.
+
+    Entries live in an in-memory LRU and, when `cache_dir` is set, are also stored
+    on disk as compact int16 coordinates. Two kinds of entries are kept:
+    - index entries, keyed by (geometry hash, scale, size, factor, block size, method)
+    - token-budget search entries, keyed by the same fields plus max_latent_tokens,
+      which remember the scale the search settled on together with its latent index.
+    """
+    def __init__(self, max_entries: int = 16, cache_dir: str = None):
+        self.max_entries = max_entries
+        self.cache_dir = cache_dir if cache_dir else None
+        self._entries = OrderedDict()
+        if self.cache_dir is not None:
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+    @staticmethod
+    def index_key(geometry_hash, scale, size, factor, block_size, method='udf'):
+        return f'index_{geometry_hash}_{scale:.4f}_{size}_{factor}_{block_size}_{method}'
+
+    @staticmethod
+    def search_key(geometry_hash, scale, size, factor, block_size, max_latent_tokens, method='udf'):
+        return f'search_{geometry_hash}_{scale:.4f}_{size}_{factor}_{block_size}_{method}_{max_latent_tokens}'
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, hashlib.sha1(key.encode()).hexdigest() + '.npz')
+
+    def _remember(self, key, value):
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _lookup(self, key):
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            return self._entries[key]
+        if self.cache_dir is None:
+            return None
+        path = self._path(key)
+        if not os.path.isfile(path):
+            return None
+        try:
+            with np.load(path) as data:
+                value = (float(data['scale']), torch.from_numpy(data['latent_index'].astype(np.int64)))
+        except Exception as e:
+            print(f'Ignoring unreadable latent index cache file {path}: {e}')
+            return None
+        self._remember(key, value)
+        return value
+
+    def _store(self, key, scale, latent_index):
+        latent_index = latent_index.detach().cpu()
+        self._remember(key, (scale, latent_index))
+        if self.cache_dir is None:
+            return
+        assert latent_index.numel() == 0 or latent_index.max() <= torch.iinfo(torch.int16).max, \
+            'Latent index coordinates do not fit into int16'
+        np.savez(self._path(key), scale=np.float64(scale), latent_index=latent_index.numpy().astype(np.int16))
+
+    def get(self, geometry_hash, scale, size, factor, block_size, method='udf'):
+        value = self._lookup(self.index_key(geometry_hash, scale, size, factor, block_size, method))
+        return None if value is None else value[1]
+
+    def put(self, geometry_hash, scale, size, factor, block_size, latent_index, method='udf'):
+        self._store(self.index_key(geometry_hash, scale, size, factor, block_size, method), scale, latent_index)
+
+    def get_search(self, geometry_hash, scale, size, factor, block_size, max_latent_tokens, method='udf'):
+        return self._lookup(self.search_key(geometry_hash, scale, size, factor, block_size, max_latent_tokens, method))
+
+    def put_search(self, geometry_hash, scale, size, factor, block_size, max_latent_tokens, found_scale, latent_index, method='udf'):
+        self._store(self.search_key(geometry_hash, scale, size, factor, block_size, max_latent_tokens, method), found_scale, latent_index)
+
+    def clear(self):
+        self._entries.clear()
@@ -0,0 +1,163 @@
+from typing import *
+import os
+import time
+import atexit
+import numpy as np
+from .telemetry import span
+# the worker side lives in a module that spawned workers can import without this package
+from direct3d_s2.workers.shared import SharedArray, spawn_pool, submit
+from direct3d_s2.workers.marching_cubes import evaluate, mesh_slab, mesh_shared_slab, UpsampledSignField
+
+# Dense volumes are meshed in slabs along the first axis. Consecutive slabs share one plane of
+# samples, so marching cubes produces the same vertices on it from both sides; they are welded
+# afterwards. A volume can be a numpy array or a block-wise evaluator that returns the samples of
+# planes [x0, x1), which lets large fields (e.g. the 1024 sign refiner output) be evaluated one slab
+# at a time instead of being materialized.
+#
+# Large volumes are meshed by a process pool. The volume (or the arrays behind an evaluator) is placed
+# in shared memory once, and workers map it by name instead of receiving a copy of their slab. The
+# workers only import direct3d_s2.workers (numpy and skimage), and the pool is shut down at exit.
+
+SLAB_SIZE = 64
+# every worker is a separate interpreter, so the default stays well below the core count of big hosts
+MAX_DEFAULT_WORKERS = 8
+MC_WORKERS = min(os.cpu_count() or 1, MAX_DEFAULT_WORKERS)
+PARALLEL_MIN_SIZE = 256
+
+def __from_env():
+    global MC_WORKERS
+    env_workers = os.environ.get('MC_WORKERS')
+    if env_workers is not None and env_workers.isdigit():
+        MC_WORKERS = max(int(env_workers), 1)
+        print(f"[MC] Marching cubes workers: {MC_WORKERS}")
+
+
+__from_env()
+
+
+def set_mc_workers(workers: int):
+    global MC_WORKERS
+    MC_WORKERS = max(int(workers), 1)
+
+
+def _share(volume):
+    """
+    Shared-memory version of a volume and the blocks to release afterwards, or (None, []) if it cannot be shared.
+    """
+    if isinstance(volume, np.ndarray):
+        shared = SharedArray.create(volume)
+        return shared, [shared]
+    if hasattr(volume, 'share'):
+        return volume.share()
+    return None, []
+
+
+_pool = None
+_pool_workers = 0
+
+
+def _get_pool(workers):
+    global _pool, _pool_workers
+    if _pool is None or _pool_workers != workers:
+        shutdown_pool()
+        _pool = spawn_pool(workers)
+        _pool_workers = workers
+    return _pool
+
+
+def shutdown_pool():
+    """
+    Stop the marching cubes workers. The next parallel meshing starts a new pool.
+    """
+    global _pool, _pool_workers
+    if _pool is not None:
+        _pool.shutdown(cancel_futures=True)
+    _pool, _pool_workers = None, 0
+
+
+atexit.register(shutdown_pool)
+
+
+def _slab_ranges(size, slab_size):
+    # every slab includes the first plane of the next one
+    return [(x0, min(x0 + slab_size, size - 1) + 1) for x0 in range(0, size - 1, slab_size)]
+
+
+def weld_seams(vertices: np.ndarray, faces: np.ndarray, seams: Iterable[float], decimals: int = 5):
+    """
+    Merge the duplicate vertices that neighbouring slabs produced on their shared planes.
+    """
+    seams = np.asarray(list(seams), dtype=vertices.dtype)
+    idx = np.nonzero(np.isin(vertices[:, 0], seams))[0]
+    if len(idx) == 0:
+        return vertices, faces
+    _, first, inverse = np.unique(np.round(vertices[idx], decimals), axis=0, return_index=True, return_inverse=True)
+    remap = np.arange(len(vertices))
+    remap[idx] = idx[first[inverse.reshape(-1)]]
+    faces = remap[faces]
+    used = np.zeros(len(vertices), dtype=bool)
+    used[faces.reshape(-1)] = True
+    compact = np.cumsum(used) - 1
+    return vertices[used], compact[faces]
+
+
+def _mesh_slabs(volume, ranges, level, method, workers):
+    if workers > 1 and len(ranges) > 1:
+        shared, blocks = _share(volume)
+        if shared is not None:
+            try:
+                start = time.perf_counter()
+                pool = _get_pool(workers)
+                futures = [submit(pool, mesh_shared_slab, shared, x0, x1, level, method) for x0, x1 in ranges]
+                results = [future.result() for future in futures]
+                elapsed = time.perf_counter() - start
+                busy = sum(t for _, t in results)
+                print(f"[MC] {len(ranges)} slabs on {workers} workers: {elapsed:.2f}s wall, "
+                      f"{busy:.2f}s of slab meshing in the workers")
+                return [result for result, _ in results]
+            except Exception as e:
+                print(f"[MC] Parallel meshing failed ({e}), meshing serially")
+                shutdown_pool()
+            finally:
+                for block in blocks:
+                    block.release()
+    return [mesh_slab(evaluate(volume, x0, x1), x0, level, method) for x0, x1 in ranges]
+
+
+def slab_marching_cubes(volume: Union[np.ndarray, Callable[[int, int], np.ndarray]], level: float = 0.0,
+                        size: Optional[int] = None, slab_size: Optional[int] = None, method: str = 'lewiner',
+                        workers: Optional[int] = None):
+    """
+    Marching cubes over a dense volume, evaluated and meshed slab by slab.
+
+    Args:
+        volume: [X, Y, Z] array, or a callable returning the float32 samples of planes [x0, x1).
+        level (float): Iso level.
+        size (int): Number of planes along the first axis. Required when `volume` is a callable.
+        slab_size (int): Planes per slab. Defaults to SLAB_SIZE.
+        method (str): skimage marching cubes method.
+        workers (int): Worker processes. Defaults to MC_WORKERS for volumes of at least PARALLEL_MIN_SIZE
+            planes and to serial meshing below. Callables are meshed in parallel only if they provide
+            a `share()` method that moves their data into shared memory.
+
+    Returns:
+        vertices [V, 3] in voxel units of the volume and faces [F, 3].
+    """
+    size = volume.shape[0] if size is None else size
+    slab_size = SLAB_SIZE if slab_size is None else slab_size
+    if workers is None:
+        workers = MC_WORKERS if size >= PARALLEL_MIN_SIZE else 1
+    ranges = _slab_ranges(size, slab_size)
+    vertices, faces, offset = [], [], 0
+    with span('marching_cubes', size=size, slabs=len(ranges), workers=workers):
+        results = _mesh_slabs(volume, ranges, level, method, workers)
+    for result in results:
+        if result is None:
+            continue
+        vertices.append(result[0])
+        faces.append(result[1] + offset)
+        offset += len(result[0])
+    if not vertices:
+        return np.zeros((0, 3), dtype=np.float32), np.zeros((0, 3), dtype=np.int64)
+    vertices, faces = np.concatenate(vertices), np.concatenate(faces)
+    return weld_seams(vertices, faces, [x1 - 1 for _, x1 in ranges[:-1]])
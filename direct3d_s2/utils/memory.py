@@ -0,0 +1,217 @@
+import os
+import torch
+
+# Peak memory model of the sparse refine pipeline.
+#
+# Every stage is estimated as resident weights + per-token activations. The per-token factors count
+# the fp16 activations alive at the peak of one transformer block (inference only):
+# - residual stream and block input                         2 x C
+# - fused qkv / q, k, v projections                         3 x C
+# - SSA compressed, selection and window branches           3 x C
+# - gate average before the output projection               1 x C
+# - FFN hidden activation                           mlp_ratio x C   (chunk rows only with token chunking)
+# plus fp32 copies made by LayerNorm32 / RMS norm           2 x C x 2
+# The decoder peak is the last SparseSubdivideBlock3d, where every latent token became 512 voxels.
+
+GB = 1024 ** 3
+SAFETY = 0.85
+DECODER_CHUNKS = [1, 2, 4, 8]
+TOKEN_CHUNK = 16384
+
+
+def available_memory(device):
+    """
+    Free and total device memory, and available host memory, in bytes.
+    """
+    device = torch.device(device)
+    if device.type == 'cuda' and torch.cuda.is_available():
+        free_vram, total_vram = torch.cuda.mem_get_info(device)
+    else:
+        free_vram, total_vram = 0, 0
+    try:
+        import psutil
+        free_ram = psutil.virtual_memory().available
+    except ImportError:
+        free_ram = os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    return free_vram, total_vram, free_ram
+
+
+def _params(cfg):
+    return cfg.params if 'params' in cfg else cfg
+
+
+def dit_weight_bytes(cfg, dtype_bytes=2):
+    """
+    Weight bytes of a SparseDiT from its config.
+    """
+    p = _params(cfg)
+    C = p.model_channels
+    ctx = p.get('cond_channels', C)
+    heads = p.num_heads
+    kv = p.get('num_kv_heads', heads) * (C // heads)
+    mlp_ratio = p.get('mlp_ratio', 4)
+    per_block = (
+        2 * C * C + 2 * C * kv                # SSA q, o, k, v projections
+        + 2 * C * C + 2 * C * ctx             # cross attention
+        + 2 * mlp_ratio * C * C               # FFN
+        + (0 if p.get('share_mod', False) else 6 * C * C)    # adaLN modulation
+    )
+    return per_block * p.num_blocks * dtype_bytes
+
+
+def dit_token_bytes(cfg, token_chunk=0, dtype_bytes=2):
+    """
+    Activation bytes of one DiT forward, split into per-token bytes and a token-independent part.
+    """
+    p = _params(cfg)
+    C = p.model_channels
+    mlp_ratio = p.get('mlp_ratio', 4)
+    per_token = (2 + 3 + 3 + 1) * C * dtype_bytes + 2 * C * 4
+    if token_chunk > 0:
+        return per_token, token_chunk * (mlp_ratio * C * dtype_bytes + 2 * C * 4)
+    return per_token + mlp_ratio * C * dtype_bytes, 0
+
+
+def decoder_peak_bytes(cfg, num_tokens, chunk_size=1, token_chunk=0, dtype_bytes=2):
+    """
+    Peak activation bytes of SparseSDFDecoder for `num_tokens` latent tokens decoded in chunk_size^3 pieces.
+    """
+    p = _params(cfg)
+    C = p.model_channels_decoder
+    resolution = p.resolution
+    # tokens of the largest chunk, including the 4-voxel padding of split_for_meshing
+    sub_resolution = resolution // chunk_size
+    padded = min(sub_resolution + 8, resolution) / sub_resolution
+    chunk_tokens = num_tokens / chunk_size ** 3 * padded ** 3 if chunk_size > 1 else num_tokens
+    # uneven occupancy: the densest chunk holds more than the average
+    chunk_tokens = min(num_tokens, chunk_tokens * (2.0 if chunk_size > 1 else 1.0))
+    torso = num_tokens * ((2 + 3 + 1) * C * dtype_bytes + 2 * C * 4 + (0 if token_chunk > 0 else 4 * C * dtype_bytes))
+    # last subdivide block: C/8 -> C/16 channels on 64 -> 512 voxels per token, with conv maps
+    last_in = chunk_tokens * 64 * (C // 8) * dtype_bytes
+    last_out = chunk_tokens * 512 * (C // 16) * dtype_bytes * 3
+    kernel_maps = chunk_tokens * 512 * 27 * 4
+    return max(torso, last_in + last_out + kernel_maps)
+
+
+def mesh_host_bytes(voxel_resolution):
+    """
+    Host bytes of sparse2mesh: a float32 grid, two boolean masks and the marching cubes working set.
+    """
+    return voxel_resolution ** 3 * (4 + 1 + 1 + 4)
+
+
+def refiner_peak_bytes(cfg, dtype_bytes=2):
+    """
+    Device bytes of one refiner patch: UNet activations at full patch resolution dominate.
+    """
+    p = _params(cfg)
+    patch = p.get('patch_size', 192)
+    return patch ** 3 * 64 * dtype_bytes * 2
+
+
+class MemoryPlan(object):
+    """
+    Settings chosen by plan_memory together with the estimates behind them.
+    """
+    def __init__(self, mode, max_latent_tokens, decoder_chunk_size, token_chunk_size, offload_idle, estimates, budget, free_ram):
+        self.mode = mode
+        self.max_latent_tokens = max_latent_tokens
+        self.decoder_chunk_size = decoder_chunk_size
+        self.token_chunk_size = token_chunk_size
+        self.offload_idle = offload_idle
+        self.estimates = estimates
+        self.budget = budget
+        self.free_ram = free_ram
+
+    def report(self, measured=None):
+        lines = [
+            f'[MemoryPlan] {self.mode}: device budget {self.budget / GB:.2f} GB, host available {self.free_ram / GB:.2f} GB',
+            f'  max_latent_tokens {self.max_latent_tokens}, decoder chunk {self.decoder_chunk_size}, '
+            f'token chunk {self.token_chunk_size}, offload idle modules {self.offload_idle}',
+        ]
+        for stage, value in self.estimates.items():
+            lines.append(f'  {stage}: {value / GB:.2f} GB estimated')
+        if measured:
+            lines.append(f"  measured peaks of the last {self.mode} run ({measured['tokens']} tokens):")
+            for stage, value in measured['peaks'].items():
+                estimate = measured['estimates'].get(stage)
+                suffix = f', estimated {estimate / GB:.2f} GB' if estimate is not None else ''
+                lines.append(f'    {stage}: {value / GB:.2f} GB measured{suffix}')
+        return '\n'.join(lines)
+
+
+def estimate_stages(cfg, mode, num_tokens, decoder_chunk_size=1, token_chunk_size=0, offload_idle=False, dtype_bytes=2):
+    """
+    Estimated device peak of the sampling and decoding stages and host peak of meshing for `num_tokens` tokens.
+    """
+    dit_cfg = cfg.sparse_dit_1024 if mode == 'sparse1024' else cfg.sparse_dit_512
+    vae_cfg = cfg.sparse_vae_1024 if mode == 'sparse1024' else cfg.sparse_vae_512
+    voxel_resolution = 1024 if mode == 'sparse1024' else 512
+    dit_weights = dit_weight_bytes(dit_cfg, dtype_bytes)
+    # DINOv2-L image encoder and sparse VAE stay resident during sampling unless offloaded
+    encoder_weights = 304e6 * 4
+    vae_weights = 2 * 12 * _params(vae_cfg).model_channels_decoder ** 2 * _params(vae_cfg).num_blocks_decoder * dtype_bytes
+    per_token, fixed = dit_token_bytes(dit_cfg, token_chunk_size, dtype_bytes)
+    idle = 0 if offload_idle else encoder_weights + vae_weights
+    sampling = dit_weights + idle + fixed + per_token * num_tokens
+    decoding = vae_weights + (0 if offload_idle else dit_weights + encoder_weights) + \
+        decoder_peak_bytes(vae_cfg, num_tokens, decoder_chunk_size, token_chunk_size, dtype_bytes)
+    estimates = {
+        'sampling': sampling,
+        'decoding': decoding,
+        'meshing (host)': mesh_host_bytes(voxel_resolution),
+    }
+    # the legacy remove_interior path refines one patch at a time after the other models are released
+    refiner_cfg = cfg.get('refiner_1024' if mode == 'sparse1024' else 'refiner')
+    if refiner_cfg is not None:
+        estimates['refining (per patch)'] = refiner_peak_bytes(refiner_cfg, dtype_bytes)
+    return estimates
+
+
+def plan_memory(cfg, device, mode='sparse1024', vram_budget=None, max_tokens_limit=200000, reclaimable=0):
+    """
+    Choose max_latent_tokens, decoder chunking, token chunking and idle-module offload for a device.
+
+    Args:
+        cfg: Loaded pipeline config.
+        device: Device the pipeline runs on.
+        mode (str): 'sparse512' or 'sparse1024'.
+        vram_budget (float): Device budget in bytes. Defaults to the currently free device memory.
+        max_tokens_limit (int): Upper bound for max_latent_tokens.
+        reclaimable (int): Device bytes held by models that are released before the run starts.
+    """
+    free_vram, total_vram, free_ram = available_memory(device)
+    budget = vram_budget if vram_budget else (free_vram + reclaimable) * SAFETY
+    vae_cfg = cfg.sparse_vae_1024 if mode == 'sparse1024' else cfg.sparse_vae_512
+    resolution = _params(vae_cfg).resolution
+    decoder_chunks = [c for c in DECODER_CHUNKS if (resolution // c) % 4 == 0]
+
+    def fits(tokens, chunk, token_chunk, offload):
+        estimates = estimate_stages(cfg, mode, tokens, chunk, token_chunk, offload)
+        return estimates['sampling'] <= budget and estimates['decoding'] <= budget
+
+    # prefer the cheapest settings that fit: no offload, no token chunking, the fewest decoder chunks
+    candidates = [(offload, token_chunk, chunk)
+                  for offload in [False, True]
+                  for token_chunk in [0, TOKEN_CHUNK]
+                  for chunk in decoder_chunks]
+    best = None
+    for offload, token_chunk, chunk in candidates:
+        lo, hi = 0, max_tokens_limit
+        while lo < hi:
+            mid = (lo + hi + 1) // 2
+            if fits(mid, chunk, token_chunk, offload):
+                lo = mid
+            else:
+                hi = mid - 1
+        if best is None or lo > best[0] + max_tokens_limit // 20:
+            best = (lo, chunk, token_chunk, offload)
+        if lo >= max_tokens_limit:
+            break
+    tokens, chunk, token_chunk, offload = best
+    tokens = tokens // 1000 * 1000
+    estimates = estimate_stages(cfg, mode, tokens, chunk, token_chunk, offload)
+    if estimates['meshing (host)'] > free_ram:
+        print(f"[MemoryPlan] meshing needs about {estimates['meshing (host)'] / GB:.1f} GB of host memory, "
+              f"{free_ram / GB:.1f} GB available")
+    return MemoryPlan(mode, tokens, chunk, token_chunk, offload, estimates, budget, free_ram)
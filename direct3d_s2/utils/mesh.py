@@ -1,9 +1,10 @@
+import time
 import torch
 import numpy as np  
-import udf_ext
 
 
 def compute_valid_udf(vertices, faces, dim=512, threshold=8.0):
+    import udf_ext
     if faces.device.type != vertices.device.type:
         raise ValueError("Both maze and visited tensors must be CUDA tensors")
     
@@ -32,7 +33,22 @@ def normalize_mesh(mesh, scale=0.95):
     mesh.vertices = vertices
     return mesh
 
-def mesh2index(mesh, size=1024, factor=8):
+# set in mesh.metadata by the pipeline once small floating components were removed, so later
+# post-processing does not run its own (mesh-level) floater filter again
+FLOATERS_REMOVED = 'floaters_removed'
+
+def mark_floaters_removed(mesh):
+    mesh.metadata[FLOATERS_REMOVED] = True
+    return mesh
+
+def floaters_removed(mesh) -> bool:
+    return bool(getattr(mesh, 'metadata', {}).get(FLOATERS_REMOVED, False))
+
+def mesh2index(mesh, size=1024, factor=8, method='udf'):
+    if method == 'coarse':
+        return mesh2index_coarse(mesh, size=size, factor=factor)
+    elif method != 'udf':
+        raise ValueError(f"Unknown mesh2index method: {method}")
     vertices = torch.Tensor(mesh.vertices).float().cuda() * 0.5
     faces = torch.Tensor(mesh.faces).int().cuda()
     sdf = compute_valid_udf(vertices, faces, dim=size, threshold=4.0)
@@ -42,3 +58,147 @@ def mesh2index(mesh, size=1024, factor=8):
     sparse_index[..., 1:] = sparse_index[..., 1:] // factor
     latent_index = torch.unique(sparse_index, dim=0)
     return latent_index
+
+
+def _triangle_box_overlap(v0, v1, v2, center, half):
+    """
+    Separating axis test between triangles and axis-aligned boxes (Akenine-Moller).
+    All inputs are [N, 3] except `half`, which is a [3] half extent shared by all boxes.
+    Degenerate triangles yield zero axes, which never separate, so the test stays conservative.
+    """
+    v0, v1, v2 = v0 - center, v1 - center, v2 - center
+    eps = 1e-6
+    overlap = torch.ones(v0.shape[0], dtype=torch.bool, device=v0.device)
+
+    def separated(p0, p1, p2, rad):
+        return (torch.minimum(torch.minimum(p0, p1), p2) > rad + eps) | (torch.maximum(torch.maximum(p0, p1), p2) < -rad - eps)
+
+    # box face normals
+    for i in range(3):
+        overlap &= ~separated(v0[:, i], v1[:, i], v2[:, i], half[i])
+    edges = [v1 - v0, v2 - v1, v0 - v2]
+    # triangle normal
+    normal = torch.cross(edges[0], edges[1], dim=-1)
+    rad = (normal.abs() * half).sum(dim=-1)
+    overlap &= (normal * v0).sum(dim=-1).abs() <= rad + eps
+    # cross products of triangle edges with box axes
+    for e in edges:
+        for i in range(3):
+            axis = torch.zeros_like(e)
+            j, k = (i + 1) % 3, (i + 2) % 3
+            axis[:, j] = -e[:, k]
+            axis[:, k] = e[:, j]
+            rad = (axis.abs() * half).sum(dim=-1)
+            overlap &= ~separated((axis * v0).sum(-1), (axis * v1).sum(-1), (axis * v2).sum(-1), rad)
+    return overlap
+
+
+@torch.no_grad()
+def mesh2index_coarse(mesh, size=1024, factor=8, threshold=4.0, device=None, max_pairs=1 << 21):
+    """
+    Compute the latent index of mesh2index directly on the coarse (size // factor)^3 grid.
+
+    mesh2index marks fine grid point i (world position i / (size - 1) - 0.5) when its distance
+    to the surface is below r = threshold / size, then keeps the cells i // factor. A cell is
+    therefore active only if some triangle lies within r of one of its factor^3 grid points,
+    which implies that the triangle intersects the axis-aligned box spanned by those points
+    dilated by r. Testing that dilated box with a triangle/box separating axis test thus yields
+    the same cells as mesh2index or a superset of them (cells near the rounded corners of the band),
+    while only a coarse occupancy grid is allocated instead of a full-resolution UDF.
+    Runs on CUDA or CPU and does not need the udf_ext extension.
+    """
+    if device is None:
+        device = 'cuda' if torch.cuda.is_available() else 'cpu'
+    res = size // factor
+    h = 1.0 / (size - 1)
+    # slightly inflated band covering the int32 truncation of the UDF kernel
+    r = threshold / size * (1 + 1e-5) + 2e-7
+    half = torch.full((3,), (factor - 1) * h / 2 + r, dtype=torch.float32, device=device)
+
+    vertices = torch.as_tensor(np.asarray(mesh.vertices), dtype=torch.float32, device=device) * 0.5
+    faces = torch.as_tensor(np.asarray(mesh.faces), dtype=torch.int64, device=device)
+    tris = vertices[faces]
+    lo = torch.ceil(((tris.min(dim=1).values - r + 0.5) * (size - 1) - (factor - 1)) / factor).long().clamp(0, res - 1)
+    hi = torch.floor((tris.max(dim=1).values + r + 0.5) * (size - 1) / factor).long().clamp(-1, res - 1)
+    extent = (hi - lo + 1).clamp(min=0)
+    counts = extent.prod(dim=-1)
+
+    occupancy = torch.zeros(res ** 3, dtype=torch.bool, device=device)
+    cumulative = torch.cumsum(counts, dim=0)
+    total = int(cumulative[-1]) if len(cumulative) > 0 else 0
+    start = 0
+    while start < len(faces) and total > 0:
+        offset = int(cumulative[start - 1]) if start > 0 else 0
+        end = int(torch.searchsorted(cumulative, torch.tensor(offset + max_pairs, device=device), right=True))
+        end = min(max(end, start + 1), len(faces))
+        chunk_counts = counts[start:end]
+        tri_ids = torch.repeat_interleave(torch.arange(start, end, device=device), chunk_counts)
+        if len(tri_ids) > 0:
+            local = torch.arange(len(tri_ids), device=device) - (torch.cumsum(chunk_counts, 0) - chunk_counts).repeat_interleave(chunk_counts)
+            ext = extent[tri_ids]
+            cz = local % ext[:, 2]
+            cy = (local // ext[:, 2]) % ext[:, 1]
+            cx = local // (ext[:, 2] * ext[:, 1])
+            cells = lo[tri_ids] + torch.stack([cx, cy, cz], dim=-1)
+            center = (cells * factor + (factor - 1) / 2).float() * h - 0.5
+            t = tris[tri_ids]
+            hit = _triangle_box_overlap(t[:, 0], t[:, 1], t[:, 2], center, half)
+            cells = cells[hit]
+            occupancy[(cells[:, 0] * res + cells[:, 1]) * res + cells[:, 2]] = True
+        start = end
+
+    coords = occupancy.reshape(res, res, res).nonzero()
+    latent_index = torch.cat([torch.zeros_like(coords[:, :1]), coords], dim=-1)
+    return latent_index
+
+
+def benchmark_mesh2index(mesh, size=1024, factor=8, repeats=3):
+    """
+    Time mesh2index against mesh2index_coarse on a normalized mesh and check that the
+    coarse result contains every cell of the full-resolution one.
+    """
+    def timed(fn):
+        best, result = float('inf'), None
+        for _ in range(repeats):
+            if torch.cuda.is_available():
+                torch.cuda.synchronize()
+            t0 = time.perf_counter()
+            result = fn()
+            if torch.cuda.is_available():
+                torch.cuda.synchronize()
+            best = min(best, time.perf_counter() - t0)
+        return best, result
+
+    t_udf, full = timed(lambda: mesh2index(mesh, size=size, factor=factor))
+    t_coarse, coarse = timed(lambda: mesh2index_coarse(mesh, size=size, factor=factor))
+    res = size // factor
+    full_keys = ((full[:, 1] * res + full[:, 2]) * res + full[:, 3]).to(coarse.device)
+    coarse_keys = (coarse[:, 1] * res + coarse[:, 2]) * res + coarse[:, 3]
+    missing = int((~torch.isin(full_keys, coarse_keys)).sum())
+    stats = {
+        'udf_seconds': t_udf,
+        'coarse_seconds': t_coarse,
+        'speedup': t_udf / max(t_coarse, 1e-9),
+        'udf_tokens': len(full),
+        'coarse_tokens': len(coarse),
+        'missing_tokens': missing,
+        'udf_grid_bytes': size ** 3 * 4,
+        'coarse_grid_bytes': res ** 3,
+    }
+    print(f"mesh2index: udf {t_udf:.3f}s ({len(full)} tokens), coarse {t_coarse:.3f}s ({len(coarse)} tokens), "
+          f"speedup {stats['speedup']:.1f}x, missing {missing}")
+    return stats
+
+
+def chamfer_distance(mesh_a, mesh_b, num_points=100000, seed=0):
+    """
+    Symmetric Chamfer distance between two meshes: the mean distance from points sampled on
+    either surface to the closest sampled point of the other one.
+    """
+    from scipy.spatial import cKDTree
+    import trimesh
+    points_a, _ = trimesh.sample.sample_surface(mesh_a, num_points, seed=seed)
+    points_b, _ = trimesh.sample.sample_surface(mesh_b, num_points, seed=seed)
+    a_to_b, _ = cKDTree(points_b).query(points_a)
+    b_to_a, _ = cKDTree(points_a).query(points_b)
+    return float(a_to_b.mean() + b_to_a.mean()) / 2
@@ -0,0 +1,314 @@
+from typing import *
+import math
+import time
+import torch
+from tqdm import tqdm
+
+# Flow-matching samplers in sigma space.
+#
+# The DiTs predict the velocity v = noise - x0 of the path x = (1 - sigma) * x0 + sigma * noise, and
+# are conditioned on the timestep sigma * num_train_timesteps. A sampler receives `model(x, sigma)`,
+# which returns the (guided) velocity, the starting noise and a decreasing list of sigmas ending in 0.
+# The sigmas come from the stage's scheduler, so every sampler walks the same shifted schedule as the
+# diffusers Euler scheduler configured for that stage.
+#
+# The multistep solvers work on the data prediction x0 = x - sigma * v with alpha = 1 - sigma and
+# lambda = log(alpha / sigma), as DPM-Solver++ and UniPC do for the VP case. lambda is -inf at sigma 1,
+# so the step leaving pure noise is always first order.
+
+SAMPLERS = {}
+
+# Sampler and step count used for a stage when `sampler` is 'auto', about half the model calls of the
+# config scheduler at its default steps (50 dense, 30 sparse512, 15 sparse1024).
+STAGE_DEFAULTS = {
+    'dense': ('midpoint', 13),
+    'sparse512': ('midpoint', 8),
+    'sparse1024': ('midpoint', 4),
+}
+
+
+def register_sampler(name):
+    def decorator(fn):
+        SAMPLERS[name] = fn
+        return fn
+    return decorator
+
+
+def _steps(sigmas, desc):
+    return tqdm(range(len(sigmas) - 1), desc=desc)
+
+
+def _lambda(sigma):
+    if sigma >= 1:
+        return -math.inf
+    if sigma <= 0:
+        return math.inf
+    return math.log((1 - sigma) / sigma)
+
+
+def _data_update(x, x0, sigma, sigma_next):
+    # first-order DPM-Solver++ step from sigma to sigma_next with data prediction x0
+    if sigma_next == 0:
+        return x0
+    # exp(lambda - lambda_next), which is 0 at sigma 1
+    ratio = (1 - sigma) * sigma_next / (sigma * (1 - sigma_next))
+    return (sigma_next / sigma) * x - (1 - sigma_next) * (ratio - 1) * x0
+
+
+@register_sampler('euler')
+def sample_euler(model, x, sigmas, desc=None):
+    for i in _steps(sigmas, desc):
+        x = x + (sigmas[i + 1] - sigmas[i]) * model(x, sigmas[i])
+    return x
+
+
+@register_sampler('heun')
+def sample_heun(model, x, sigmas, desc=None):
+    """
+    Heun's method (trapezoidal rule), two model calls per step except for the last one.
+    """
+    for i in _steps(sigmas, desc):
+        sigma, sigma_next = sigmas[i], sigmas[i + 1]
+        v = model(x, sigma)
+        x_euler = x + (sigma_next - sigma) * v
+        if sigma_next == 0:
+            x = x_euler
+        else:
+            x = x + (sigma_next - sigma) * (v + model(x_euler, sigma_next)) / 2
+    return x
+
+
+@register_sampler('midpoint')
+def sample_midpoint(model, x, sigmas, desc=None):
+    """
+    Explicit midpoint method, two model calls per step.
+    """
+    for i in _steps(sigmas, desc):
+        sigma, sigma_next = sigmas[i], sigmas[i + 1]
+        sigma_mid = (sigma + sigma_next) / 2
+        x_mid = x + (sigma_mid - sigma) * model(x, sigma)
+        x = x + (sigma_next - sigma) * model(x_mid, sigma_mid)
+    return x
+
+
+@register_sampler('dpmpp_2m')
+def sample_dpmpp_2m(model, x, sigmas, desc=None):
+    """
+    DPM-Solver++(2M): second-order multistep in lambda, one model call per step.
+    The first and the last step are first order.
+    """
+    x0_prev, h_prev = None, None
+    for i in _steps(sigmas, desc):
+        sigma, sigma_next = sigmas[i], sigmas[i + 1]
+        x0 = x - sigma * model(x, sigma)
+        h = _lambda(sigma_next) - _lambda(sigma)
+        if x0_prev is None or sigma_next == 0 or math.isinf(h_prev):
+            x = _data_update(x, x0, sigma, sigma_next)
+        else:
+            r = h_prev / h
+            x = _data_update(x, (1 + 1 / (2 * r)) * x0 - (1 / (2 * r)) * x0_prev, sigma, sigma_next)
+        x0_prev, h_prev = x0, h
+    return x
+
+
+def _unipc_coefficients(h, r1):
+    # B(h) = expm1(-h) (bh2) and the corrector weights of UniC for the ratios [r1, 1], or [1] if r1 is None
+    hh = -h
+    h_phi_1 = math.expm1(hh)
+    B_h = h_phi_1
+    if r1 is None:
+        return h_phi_1, B_h, [0.5]
+    rks = [r1, 1.0]
+    h_phi_k = h_phi_1 / hh - 1
+    factorial = 1
+    R, b = [], []
+    for k in range(1, 3):
+        R.append([rk ** (k - 1) for rk in rks])
+        b.append(h_phi_k * factorial / B_h)
+        factorial *= k + 1
+        h_phi_k = h_phi_k / hh - 1 / factorial
+    det = R[0][0] * R[1][1] - R[0][1] * R[1][0]
+    rhos = [(b[0] * R[1][1] - R[0][1] * b[1]) / det, (R[0][0] * b[1] - b[0] * R[1][0]) / det]
+    return h_phi_1, B_h, rhos
+
+
+@register_sampler('unipc')
+def sample_unipc(model, x, sigmas, desc=None):
+    """
+    UniPC (bh2) of order 2: a multistep predictor, corrected with the model output at the predicted
+    point once it is evaluated for the next step, so the corrector costs no extra model call.
+    """
+    prev = None
+    for i in _steps(sigmas, desc):
+        sigma, sigma_next = sigmas[i], sigmas[i + 1]
+        x0 = x - sigma * model(x, sigma)
+        if prev is not None:
+            # UniC: redo the previous step with the new data prediction
+            x_start, x0_start, D1, r1, s0 = prev
+            h = _lambda(sigma) - _lambda(s0)
+            h_phi_1, B_h, rhos = _unipc_coefficients(h, r1)
+            x = (sigma / s0) * x_start - (1 - sigma) * h_phi_1 * x0_start
+            correction = rhos[-1] * (x0 - x0_start)
+            if D1 is not None:
+                correction = correction + rhos[0] * D1
+            x = x - (1 - sigma) * B_h * correction
+        if sigma_next == 0:
+            return x0
+        # UniP: predict sigma_next from x0 and the previous data prediction
+        h = _lambda(sigma_next) - _lambda(sigma)
+        D1, r1 = None, None
+        if prev is not None and prev[4] < 1:
+            r1 = (_lambda(prev[4]) - _lambda(sigma)) / h
+            D1 = (prev[1] - x0) / r1
+        h_phi_1, B_h, _ = _unipc_coefficients(h, r1)
+        x_next = (sigma_next / sigma) * x - (1 - sigma_next) * h_phi_1 * x0
+        if D1 is not None:
+            x_next = x_next - (1 - sigma_next) * B_h * 0.5 * D1
+        prev = (x, x0, D1, r1, sigma)
+        x = x_next
+    return x
+
+
+SAMPLER_NAMES = ['scheduler', 'auto'] + list(SAMPLERS)
+GUIDANCE_RAMPS = ['constant', 'linear', 'cosine']
+
+
+def guidance_scale_at(sigma: float, guidance_scale: float, guidance_start: float = 1.0, guidance_end: float = 0.0,
+                      ramp: str = 'constant') -> Optional[float]:
+    """
+    Classifier-free guidance scale at `sigma`, or None outside the interval [guidance_end, guidance_start],
+    where only the conditional pass runs.
+
+    With a 'linear' or 'cosine' ramp the scale falls from `guidance_scale` at guidance_start to 1 (no
+    guidance) at guidance_end.
+    """
+    if sigma > guidance_start or sigma < guidance_end:
+        return None
+    if ramp == 'constant' or guidance_start <= guidance_end:
+        return guidance_scale
+    p = (sigma - guidance_end) / (guidance_start - guidance_end)
+    if ramp == 'linear':
+        weight = p
+    elif ramp == 'cosine':
+        weight = (1 - math.cos(math.pi * p)) / 2
+    else:
+        raise ValueError(f"Unknown guidance ramp: {ramp}, expected one of {GUIDANCE_RAMPS}")
+    return 1 + (guidance_scale - 1) * weight
+
+
+def resolve_sampler(sampler: str, mode: str, num_inference_steps: int) -> Tuple[str, int]:
+    """
+    Sampler name and step count for a stage, replacing 'auto' by the stage default.
+    """
+    if sampler == 'auto':
+        return STAGE_DEFAULTS[mode]
+    if sampler != 'scheduler' and sampler not in SAMPLERS:
+        raise ValueError(f"Unknown sampler: {sampler}, expected one of {SAMPLER_NAMES}")
+    return sampler, num_inference_steps
+
+
+def scheduler_sigmas(scheduler, num_inference_steps: int, device=None) -> List[float]:
+    """
+    The shifted sigma schedule of a flow-matching scheduler, including the final 0.
+    """
+    scheduler.set_timesteps(num_inference_steps, device=device)
+    return [float(s) for s in scheduler.sigmas]
+
+
+def sample(sampler: str, model: Callable[[torch.Tensor, float], torch.Tensor], x: torch.Tensor,
+           sigmas: List[float], desc: Optional[str] = None) -> torch.Tensor:
+    return SAMPLERS[sampler](model, x, sigmas, desc=desc)
+
+
+DEFAULT_BENCHMARK = {
+    'sparse512': [('euler', 30), ('euler', 15), ('heun', 8), ('midpoint', 8), ('dpmpp_2m', 15), ('unipc', 15), ('unipc', 10)],
+    'sparse1024': [('euler', 15), ('euler', 8), ('heun', 4), ('midpoint', 4), ('dpmpp_2m', 8), ('unipc', 8), ('unipc', 6)],
+}
+
+
+def _benchmark_refine(pipeline, image, mesh, sdf_resolution, configs, reference, seeds, num_points,
+                      guidance_scale, mc_threshold, max_latent_tokens, scale, refine_kwargs):
+    # refine with every config (steps plus refine keyword arguments) on every seed, Chamfer distance to the reference
+    from .mesh import chamfer_distance
+    mode = f'sparse{sdf_resolution}'
+    refine = pipeline.refine_1024 if sdf_resolution == 1024 else pipeline.refine_512
+
+    def run(config, seed):
+        config = dict(config)
+        steps = config.pop('steps')
+        result = refine(image, mesh, steps, guidance_scale, False, mc_threshold, seed, max_latent_tokens, scale,
+                        **{**refine_kwargs, **config})
+        return result, dict(pipeline.sampling_stats[mode])
+
+    references = {seed: run(reference, seed)[0] for seed in seeds}
+    results = []
+    for config in configs:
+        distances, stats = [], []
+        for seed in seeds:
+            result, stat = run(config, seed)
+            distances.append(chamfer_distance(result, references[seed], num_points))
+            stats.append(stat)
+        entry = dict(config)
+        for key in ('nfe', 'dit_calls', 'cache_hits', 'cache_misses', 'merged_tokens'):
+            if key in stats[0]:
+                entry[key] = sum(s[key] for s in stats) / len(stats)
+        entry['chamfer'] = sum(distances) / len(distances)
+        entry['seconds'] = sum(s['seconds'] for s in stats) / len(stats)
+        print(f"[Benchmark] {config}: {entry['nfe']:.0f} NFE, {entry['dit_calls']:.0f} DiT calls, "
+              f"chamfer {entry['chamfer']:.5f}, {entry['seconds']:.1f}s")
+        results.append(entry)
+    return results
+
+
+def benchmark_samplers(pipeline, image, mesh, sdf_resolution: int = 1024, configs=None, seeds=(0, 1, 2),
+                       reference: Optional[Tuple[str, int]] = None, num_points: int = 100000,
+                       guidance_scale: float = 7.0, mc_threshold: float = 0.2, max_latent_tokens: int = 100000,
+                       scale: float = 0.95, **refine_kwargs):
+    """
+    Refine `mesh` with several (sampler, steps) configurations on fixed seeds and compare each result
+    with the reference configuration (the config scheduler at its default step count) by Chamfer distance.
+
+    Returns one dict per configuration with the mean Chamfer distance, the model evaluations (NFE) and
+    DiT calls per run and the mean sampling time.
+    """
+    configs = DEFAULT_BENCHMARK[f'sparse{sdf_resolution}'] if configs is None else configs
+    reference = reference or ('scheduler', 15 if sdf_resolution == 1024 else 30)
+    return _benchmark_refine(pipeline, image, mesh, sdf_resolution,
+                             [{'sampler': sampler, 'steps': steps} for sampler, steps in configs],
+                             {'sampler': reference[0], 'steps': reference[1]}, seeds, num_points,
+                             guidance_scale, mc_threshold, max_latent_tokens, scale, refine_kwargs)
+
+
+def benchmark_step_cache(pipeline, image, mesh, sdf_resolution: int = 1024, thresholds=(0.02, 0.05, 0.1, 0.2),
+                         steps: Optional[int] = None, seeds=(0, 1, 2), num_points: int = 100000,
+                         guidance_scale: float = 7.0, mc_threshold: float = 0.2, max_latent_tokens: int = 100000,
+                         scale: float = 0.95, **refine_kwargs):
+    """
+    Quality against speed of the sparse DiT step cache: refine `mesh` with each threshold on fixed seeds
+    and compare with the uncached result by Chamfer distance. The image and mesh are meant to be the
+    inputs of the shipped workflows (workflow_examples/).
+
+    Returns one dict per threshold with the mean Chamfer distance, cache hits and misses and sampling time.
+    """
+    steps = steps or (15 if sdf_resolution == 1024 else 30)
+    return _benchmark_refine(pipeline, image, mesh, sdf_resolution,
+                             [{'step_cache_threshold': t, 'steps': steps} for t in thresholds],
+                             {'step_cache_threshold': 0.0, 'steps': steps}, seeds, num_points,
+                             guidance_scale, mc_threshold, max_latent_tokens, scale, refine_kwargs)
+
+
+def benchmark_token_merge(pipeline, image, mesh, sdf_resolution: int = 1024, ratios=(0.1, 0.2, 0.3, 0.4),
+                          steps: Optional[int] = None, seeds=(0, 1, 2), num_points: int = 100000,
+                          guidance_scale: float = 7.0, mc_threshold: float = 0.2, max_latent_tokens: int = 100000,
+                          scale: float = 0.95, **refine_kwargs):
+    """
+    Quality against speed of token merging in the sparse DiT: refine `mesh` with each merge ratio on
+    fixed seeds and compare with the unmerged result by Chamfer distance.
+
+    Returns one dict per ratio with the mean Chamfer distance, merged tokens per pass and sampling time.
+    """
+    steps = steps or (15 if sdf_resolution == 1024 else 30)
+    return _benchmark_refine(pipeline, image, mesh, sdf_resolution,
+                             [{'token_merge_ratio': r, 'steps': steps} for r in ratios],
+                             {'token_merge_ratio': 0.0, 'steps': steps}, seeds, num_points,
+                             guidance_scale, mc_threshold, max_latent_tokens, scale, refine_kwargs)
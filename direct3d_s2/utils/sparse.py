@@ -1,23 +1,66 @@
+import itertools
 import torch
 import numpy as np
+from direct3d_s2.modules.sparse.keys import block_keys, stable_argsort, pack_coords, lookup_keys, COORD_BITS
+
+# half of the 26-neighbourhood, every neighbour pair is visited once
+NEIGHBOR_OFFSETS = [o for o in itertools.product((-1, 0, 1), repeat=3) if o > (0, 0, 0)]
 
 def sort_block(latent_index, block_size):
-    device = latent_index.device
-    latent_index_block = latent_index.cpu().numpy()
-    latent_index_block[..., 1:] = latent_index_block[..., 1:] // block_size
-    latent_index_inblock = latent_index.cpu().numpy()
-    latent_index_inblock[..., 1:] = latent_index_inblock[..., 1:] % block_size
-    sort_index = np.lexsort((
-        latent_index_inblock[..., 3],
-        latent_index_inblock[..., 2],
-        latent_index_inblock[..., 1],
-        latent_index_block[..., 3],
-        latent_index_block[..., 2],
-        latent_index_block[..., 1])
-    )
-    sort_index = torch.from_numpy(sort_index).to(device)
+    _, sort_index = stable_argsort(block_keys(latent_index, block_size))
     return latent_index[sort_index]
 
+def voxel_components(coords):
+    """
+    Connected components of sparse voxels [N, 4] (batch, x, y, z) under 26-connectivity.
+
+    Neighbours are found by looking up shifted coordinate keys in the sorted keys, and components
+    are merged by hooking the larger root onto the smaller one followed by pointer jumping, so the
+    pass runs on the device in O(N) memory and a logarithmic number of rounds.
+
+    Returns:
+        (torch.Tensor): [N] component label of each voxel (the index of one voxel of the component).
+    """
+    sorted_keys, order = stable_argsort(pack_coords(coords))
+    sorted_coords = coords[order].long()
+    index = torch.arange(len(coords), device=coords.device)
+    limit = 1 << COORD_BITS
+    labels = index.clone()
+    while True:
+        merged = False
+        for offset in NEIGHBOR_OFFSETS:
+            shifted = sorted_coords.clone()
+            shifted[:, 1:] += torch.tensor(offset, device=coords.device)
+            valid = ((shifted[:, 1:] >= 0) & (shifted[:, 1:] < limit)).all(dim=1)
+            found, pos = lookup_keys(sorted_keys, pack_coords(shifted[valid]))
+            src, dst = labels[index[valid][found]], labels[pos[found]]
+            differ = src != dst
+            if differ.any():
+                labels.scatter_reduce_(0, torch.maximum(src, dst)[differ], torch.minimum(src, dst)[differ], reduce='amin')
+                merged = True
+        while True:
+            jumped = labels[labels]
+            if torch.equal(jumped, labels):
+                break
+            labels = jumped
+        if not merged:
+            break
+    out = torch.empty_like(labels)
+    out[order] = labels
+    return out
+
+def remove_small_components(coords, min_ratio=0.005):
+    """
+    Mask of the voxels kept after dropping components holding less than `min_ratio` of their batch's voxels.
+    """
+    labels = voxel_components(coords)
+    sizes = torch.bincount(labels, minlength=len(labels))
+    batch_sizes = torch.bincount(coords[:, 0].long())
+    keep = sizes[labels] >= min_ratio * batch_sizes[coords[:, 0].long()]
+    print(f"[Floaters] Removed {int((~keep).sum())} of {len(keep)} voxels in "
+          f"{labels[~keep].unique().numel()} small components")
+    return keep
+
 def extract_tokens_and_coords(conditions, token_mask, num_cls=1, num_reg=4):
     device = conditions.device
     B = conditions.size(0)
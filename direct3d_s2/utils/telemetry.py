@@ -0,0 +1,281 @@
+from typing import *
+import os
+import sys
+import json
+import time
+import threading
+import functools
+from contextlib import contextmanager, nullcontext
+import torch
+
+# Per-job stage telemetry of the pipeline.
+#
+# A job (one generate / refine call) collects spans and counters. Every span records its wall time,
+# the GPU time between two CUDA events, the allocated and peak allocated device memory and the host
+# RSS at its end. The CUDA events are only resolved when the job ends, so recording never
+# synchronizes the device. Outside of a job, spans and counters cost a function call.
+#
+# Finished jobs are kept in memory (the last one as `last_job`) and, with TELEMETRY_DIR set, written
+# as <job>.json (events and per-stage totals) and <job>.trace.json for chrome://tracing or Perfetto.
+#
+# Instrumented modules import this module as `direct3d_s2.utils.telemetry` (the pipeline puts the
+# node folder on sys.path), so that the nodes and the models share one recorder.
+
+TELEMETRY = True
+TELEMETRY_DIR = None
+CUDA_TIMING = True
+
+def __from_env():
+    global TELEMETRY, TELEMETRY_DIR, CUDA_TIMING
+    env_telemetry = os.environ.get('TELEMETRY')
+    env_dir = os.environ.get('TELEMETRY_DIR')
+    env_cuda_timing = os.environ.get('TELEMETRY_CUDA_TIMING')
+    if env_telemetry is not None:
+        TELEMETRY = env_telemetry == '1'
+    if env_dir:
+        TELEMETRY_DIR = env_dir
+    if env_cuda_timing is not None:
+        CUDA_TIMING = env_cuda_timing == '1'
+    if env_telemetry is not None or env_dir:
+        print(f"[Telemetry] Enabled: {TELEMETRY}, output: {TELEMETRY_DIR}")
+
+
+__from_env()
+
+
+def host_rss() -> int:
+    """
+    Resident set size of this process in bytes, or 0 where it cannot be read.
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError, AttributeError):
+        pass
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        pass
+    try:
+        import resource
+    except ImportError:
+        # Windows without psutil
+        return 0
+    # peak instead of current RSS; kilobytes on Linux, already bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+class Telemetry(object):
+    """
+    Recorder of the spans and counters of one job at a time.
+
+    Args:
+        enabled (bool): Record anything at all.
+        output_dir (str): Directory the JSON and Chrome trace of every job are written to, or None.
+        cuda_timing (bool): Time spans with CUDA events as well.
+    """
+    def __init__(self, enabled: bool = TELEMETRY, output_dir: Optional[str] = TELEMETRY_DIR,
+                 cuda_timing: bool = CUDA_TIMING):
+        self.enabled = enabled
+        self.output_dir = output_dir
+        self.cuda_timing = cuda_timing
+        self.job_name = None
+        self.job_args = {}
+        self.events = []
+        self.last_job = None
+        self._origin = 0.0
+        self._pending = []
+        self._jobs = 0
+
+    @property
+    def active(self) -> bool:
+        return self.enabled and self.job_name is not None
+
+    def _memory(self):
+        if torch.cuda.is_available() and torch.cuda.is_initialized():
+            return torch.cuda.memory_allocated(), torch.cuda.max_memory_allocated()
+        return 0, 0
+
+    def _cuda_event(self):
+        if self.cuda_timing and torch.cuda.is_available() and torch.cuda.is_initialized():
+            event = torch.cuda.Event(enable_timing=True)
+            event.record()
+            return event
+        return None
+
+    @contextmanager
+    def job(self, name: str, **args):
+        """
+        Record a job. Nested jobs are recorded as spans of the outer one.
+        """
+        if not self.enabled:
+            yield
+            return
+        if self.job_name is not None:
+            with self.span(name, cat='job', **args):
+                yield
+            return
+        self.job_name, self.job_args = name, dict(args)
+        self.events, self._pending = [], []
+        self._origin = time.perf_counter()
+        try:
+            with self.span(name, cat='job', **args):
+                yield
+        finally:
+            try:
+                self._end_job()
+            except Exception as e:
+                # telemetry must never fail the job it measures
+                print(f"[Telemetry] Could not finish job {name}: {e}")
+            self.job_name, self.events, self._pending = None, [], []
+
+    @contextmanager
+    def _span(self, name, cat, args):
+        start = time.perf_counter()
+        start_event = self._cuda_event()
+        try:
+            yield
+        finally:
+            try:
+                self._record_span(name, cat, args, start, start_event)
+            except Exception as e:
+                print(f"[Telemetry] Could not record span {name}: {e}")
+
+    def _record_span(self, name, cat, args, start, start_event):
+        end_event = self._cuda_event()
+        allocated, peak = self._memory()
+        event = {
+            'name': name,
+            'cat': cat,
+            'ts': (start - self._origin) * 1e6,
+            'dur': (time.perf_counter() - start) * 1e6,
+            'tid': threading.get_ident(),
+            'args': dict(args, allocated_mb=allocated / 2 ** 20, peak_allocated_mb=peak / 2 ** 20,
+                         rss_mb=host_rss() / 2 ** 20),
+        }
+        self.events.append(event)
+        if start_event is not None:
+            self._pending.append((event, start_event, end_event))
+
+    def span(self, name: str, cat: str = 'stage', **args):
+        """
+        Context manager recording a span of the current job; does nothing outside of a job.
+        """
+        if not self.active:
+            return nullcontext()
+        return self._span(name, cat, args)
+
+    def counter(self, name: str, **values):
+        """
+        Record counter values (e.g. tokens, vertices) at the current time of the job.
+        """
+        if not self.active:
+            return
+        self.events.append({
+            'name': name,
+            'cat': 'counter',
+            'ph': 'C',
+            'ts': (time.perf_counter() - self._origin) * 1e6,
+            'tid': threading.get_ident(),
+            'args': values,
+        })
+
+    def annotate(self, **args):
+        """
+        Add arguments to the current job.
+        """
+        if self.active:
+            self.job_args.update(args)
+
+    def _end_job(self):
+        if self._pending:
+            torch.cuda.synchronize()
+            for event, start_event, end_event in self._pending:
+                event['args']['cuda_ms'] = start_event.elapsed_time(end_event)
+        self._jobs += 1
+        job = {
+            'job': self.job_name,
+            'args': self.job_args,
+            'events': self.events,
+            'stages': self._stage_totals(self.events),
+        }
+        self.job_name, self.events, self._pending = None, [], []
+        self.last_job = job
+        total = job['stages'].get(job['job'], {}).get('wall_s', 0.0)
+        top = sorted(((k, v) for k, v in job['stages'].items() if k != job['job']), key=lambda kv: -kv[1]['wall_s'])[:4]
+        print(f"[Telemetry] {job['job']}: {total:.2f}s, " + ", ".join(f"{k} {v['wall_s']:.2f}s" for k, v in top))
+        if self.output_dir:
+            self.export(job)
+
+    @staticmethod
+    def _stage_totals(events):
+        stages = {}
+        for event in events:
+            if event['cat'] == 'counter':
+                continue
+            stage = stages.setdefault(event['name'], {'count': 0, 'wall_s': 0.0, 'cuda_s': 0.0, 'peak_allocated_mb': 0.0})
+            stage['count'] += 1
+            stage['wall_s'] += event['dur'] / 1e6
+            stage['cuda_s'] += event['args'].get('cuda_ms', 0.0) / 1e3
+            stage['peak_allocated_mb'] = max(stage['peak_allocated_mb'], event['args']['peak_allocated_mb'])
+        return stages
+
+    @staticmethod
+    def chrome_trace(job) -> dict:
+        """
+        The events of a finished job in the Chrome trace event format.
+        """
+        pid = os.getpid()
+        events = []
+        for event in job['events']:
+            trace_event = {'name': event['name'], 'cat': event['cat'], 'ph': event.get('ph', 'X'),
+                           'ts': event['ts'], 'pid': pid, 'tid': event['tid'], 'args': event['args']}
+            if 'dur' in event:
+                trace_event['dur'] = event['dur']
+            events.append(trace_event)
+        return {'traceEvents': events, 'displayTimeUnit': 'ms', 'otherData': {'job': job['job'], **job['args']}}
+
+    def export(self, job=None, output_dir: Optional[str] = None) -> str:
+        """
+        Write the JSON record and the Chrome trace of a finished job (the last one by default).
+        Returns the path prefix of the two files.
+        """
+        job = job or self.last_job
+        output_dir = output_dir or self.output_dir
+        os.makedirs(output_dir, exist_ok=True)
+        prefix = os.path.join(output_dir, f"{time.strftime('%Y%m%d-%H%M%S')}_{self._jobs:04d}_{job['job']}")
+        with open(prefix + '.json', 'w') as f:
+            json.dump(job, f, default=str)
+        with open(prefix + '.trace.json', 'w') as f:
+            json.dump(self.chrome_trace(job), f, default=str)
+        return prefix
+
+
+_telemetry = Telemetry()
+
+
+def get_telemetry() -> Telemetry:
+    return _telemetry
+
+
+def span(name: str, cat: str = 'stage', **args):
+    return _telemetry.span(name, cat, **args)
+
+
+def counter(name: str, **values):
+    _telemetry.counter(name, **values)
+
+
+def traced_job(name: str):
+    """
+    Decorator recording every call of a function as a telemetry job.
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with _telemetry.job(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,6 @@
+# Entry points of the process pools (marching cubes, mesh post-processing).
+#
+# Spawned pool workers import these modules when they unpickle a job, so they must stay light: numpy
+# at module level, and every other library imported inside the job that needs it. Nothing here may
+# import torch or the direct3d_s2.utils package, whose __init__ pulls in the whole model stack.
+# They are imported as `direct3d_s2.workers...` (the pipeline puts the node folder on sys.path).
@@ -0,0 +1,71 @@
+import time
+import numpy as np
+from .shared import SharedArray
+
+
+def evaluate(volume, x0, x1):
+    if callable(volume):
+        return volume(x0, x1)
+    # copy, so no view into shared memory outlives the slab
+    return np.array(volume[x0:x1], dtype=np.float32)
+
+
+def mesh_slab(samples, x0, level, method):
+    from skimage import measure
+    if samples.shape[0] < 2 or samples.min() > level or samples.max() < level:
+        return None
+    vertices, faces, _, _ = measure.marching_cubes(samples, level=level, method=method)
+    vertices[:, 0] += x0
+    return vertices, faces
+
+
+def mesh_shared_slab(volume, x0, x1, level, method):
+    start = time.perf_counter()
+    result = mesh_slab(evaluate(volume, x0, x1), x0, level, method)
+    return result, time.perf_counter() - start
+
+
+class UpsampledSignField(object):
+    """
+    Block-wise evaluator of a coarse sign volume upsampled by `factor`, overridden by sparse SDF values.
+
+    The field is sign[x // factor] everywhere except at `coords`, where it is `values`. The sign is kept
+    as int8 at the coarse resolution and the sparse values as float16; only the requested planes are
+    expanded to float32.
+
+    Args:
+        sign (np.ndarray): [R, R, R] coarse signs (+1 outside, -1 inside).
+        coords (np.ndarray): [N, 3] fine voxel coordinates of the sparse values.
+        values (np.ndarray): [N] sparse SDF values.
+        factor (int): Upsampling factor of the sign volume.
+    """
+    def __init__(self, sign: np.ndarray, coords: np.ndarray, values: np.ndarray, factor: int = 2):
+        self.sign = np.ascontiguousarray(sign, dtype=np.int8)
+        self.factor = factor
+        self.size = self.sign.shape[0] * factor
+        order = np.argsort(coords[:, 0], kind='stable')
+        self.coords = np.ascontiguousarray(coords[order], dtype=np.int32)
+        self.values = np.ascontiguousarray(values[order], dtype=np.float16)
+
+    @property
+    def shape(self):
+        return (self.size,) * 3
+
+    def share(self):
+        """
+        Copy of the field backed by shared memory, and the shared blocks to release.
+        """
+        field = UpsampledSignField.__new__(UpsampledSignField)
+        field.factor, field.size = self.factor, self.size
+        field.sign, field.coords, field.values = [SharedArray.create(a) for a in (self.sign, self.coords, self.values)]
+        return field, [field.sign, field.coords, field.values]
+
+    def __call__(self, x0: int, x1: int) -> np.ndarray:
+        f = self.factor
+        coarse = self.sign[x0 // f:(x1 - 1) // f + 1]
+        samples = coarse.repeat(f, axis=0)[x0 - x0 // f * f:][:x1 - x0]
+        samples = samples.repeat(f, axis=1).repeat(f, axis=2).astype(np.float32)
+        start, end = np.searchsorted(self.coords[:, 0], [x0, x1])
+        c = self.coords[start:end]
+        samples[c[:, 0] - x0, c[:, 1], c[:, 2]] = self.values[start:end]
+        return samples
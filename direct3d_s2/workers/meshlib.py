@@ -0,0 +1,105 @@
+# Hunyuan 3D is licensed under the TENCENT HUNYUAN NON-COMMERCIAL LICENSE AGREEMENT
+# except for the third-party components listed below.
+# Hunyuan 3D does not impose any additional limitations beyond what is outlined
+# in the repsective licenses of these third-party components.
+# Users must comply with all terms and conditions of original licenses of these third-party
+# components and must ensure that the usage of the third party components adheres to
+# all relevant laws and regulations.
+
+# For avoidance of doubts, Hunyuan 3D means the large language models and
+# their software and algorithms, including trained model weights, parameters (including
+# optimizer states), machine-learning model code, inference-enabling code, training-enabling code,
+# fine-tuning enabling code and other elements of the foregoing made publicly available
+# by Tencent in accordance with TENCENT HUNYUAN COMMUNITY LICENSE AGREEMENT.
+
+import time
+import numpy as np
+import meshlib.mrmeshnumpy as mrmeshnumpy
+import meshlib.mrmeshpy as mrmeshpy
+import trimesh
+
+# same share of the faces as nbfaceratio of the pymeshlab floater filter
+FLOATER_FACE_RATIO = 0.005
+
+
+def remove_floater(vertices: np.array, faces: np.array, face_ratio: float = FLOATER_FACE_RATIO):
+    """
+    Drop connected components with fewer than `face_ratio` of all faces, like the pymeshlab filter.
+    """
+    mesh = trimesh.Trimesh(vertices=vertices, faces=faces)
+    labels = trimesh.graph.connected_component_labels(mesh.face_adjacency, node_count=len(mesh.faces))
+    keep = np.bincount(labels)[labels] >= face_ratio * len(mesh.faces)
+    if not keep.all():
+        mesh.update_faces(keep)
+        mesh.remove_unreferenced_vertices()
+    return np.asarray(mesh.vertices), np.asarray(mesh.faces)
+
+    
+def postprocessmesh(vertices: np.array, faces: np.array, face_num: int = 200000, subdivided_parts: int = 16,
+                    remove_floaters: bool = True):
+    print(f"Number of Vertices: {len(vertices)} - Number of Faces: {len(faces)}")
+    if remove_floaters:
+        print('Removing Floaters ...')
+        vertices, faces = remove_floater(vertices, faces)
+    num_faces = len(faces)
+    
+    if face_num >= num_faces:
+        mesh = trimesh.Trimesh(vertices=vertices, faces=faces)
+    else:                            
+        print('Generating Meshlib Mesh ...')
+        mesh = mrmeshnumpy.meshFromFacesVerts(faces, vertices)
+        print('Loading Pack Optimally ...')
+        mesh.packOptimally()
+        
+        settings = mrmeshpy.DecimateSettings()
+        faces_to_delete = num_faces - face_num
+        print(f'Number of Faces to delete: {faces_to_delete}')
+        settings.maxDeletedFaces = faces_to_delete # Number of faces to be deleted
+        settings.maxError = 0.05 # Maximum error when decimation stops
+        settings.packMesh = True
+        
+        # Recommended to set to number of CPU cores or more available for the best performance
+        settings.subdivideParts = subdivided_parts
+        
+        mrmeshpy.decimateMesh(mesh, settings)
+        
+        out_verts = mrmeshnumpy.getNumpyVerts(mesh)
+        out_faces = mrmeshnumpy.getNumpyFaces(mesh.topology)
+        
+        mesh = trimesh.Trimesh(vertices=out_verts, faces=out_faces)   
+        print(f"Reduced faces, resulting in {mesh.vertices.shape[0]} vertices and {mesh.faces.shape[0]} faces")
+        
+    return mesh
+
+
+def postprocessmesh_lods(vertices: np.array, faces: np.array, face_nums: list, subdivided_parts: int = 16,
+                        remove_floaters: bool = True):
+    """
+    Decimate progressively to every face target: the largest target from the full mesh and every
+    further level from the previous one, reusing the same MeshLib mesh.
+    Returns the LOD meshes, largest first, and the seconds spent on each level.
+    """
+    face_nums = sorted(set(face_nums), reverse=True)
+    print(f"Number of Vertices: {len(vertices)} - Number of Faces: {len(faces)}")
+    if remove_floaters:
+        print('Removing Floaters ...')
+        vertices, faces = remove_floater(vertices, faces)
+    mesh = mrmeshnumpy.meshFromFacesVerts(faces, vertices)
+    mesh.packOptimally()
+    meshes, times = [], []
+    for face_num in face_nums:
+        start = time.perf_counter()
+        num_faces = mesh.topology.numValidFaces()
+        if face_num < num_faces:
+            settings = mrmeshpy.DecimateSettings()
+            settings.maxDeletedFaces = num_faces - face_num
+            settings.maxError = 0.05
+            settings.packMesh = True
+            settings.subdivideParts = subdivided_parts
+            mrmeshpy.decimateMesh(mesh, settings)
+        out_verts = mrmeshnumpy.getNumpyVerts(mesh)
+        out_faces = mrmeshnumpy.getNumpyFaces(mesh.topology)
+        meshes.append(trimesh.Trimesh(vertices=out_verts, faces=out_faces, process=False))
+        times.append(time.perf_counter() - start)
+        print(f"LOD {len(meshes) - 1}: {out_faces.shape[0]} faces in {times[-1]:.2f}s")
+    return meshes, times
@@ -0,0 +1,18 @@
+import time
+import numpy as np
+
+
+def postprocess_job(vertices, faces, face_num, simplify_lib, remove_floaters):
+    """
+    Floater removal and decimation of a mesh handed over in shared memory.
+    pymeshlab or meshlib is only imported by the job that uses it.
+    """
+    start = time.perf_counter()
+    vertices, faces = np.array(vertices[:]), np.array(faces[:])
+    if simplify_lib == "Pymeshlab":
+        from .postprocessors import postprocessmesh
+        mesh = postprocessmesh(vertices, faces, face_num, remove_floaters=remove_floaters)
+    else:
+        from .meshlib import postprocessmesh
+        mesh = postprocessmesh(vertices, faces, face_num, remove_floaters=remove_floaters)
+    return np.asarray(mesh.vertices), np.asarray(mesh.faces), time.perf_counter() - start
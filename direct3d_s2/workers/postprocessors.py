@@ -13,12 +13,12 @@
 # by Tencent in accordance with TENCENT HUNYUAN COMMUNITY LICENSE AGREEMENT.
 
 import os
+import time
 import tempfile
 from typing import Union
 
 import numpy as np
 import pymeshlab
-import torch
 import trimesh
 
 
@@ -102,14 +102,15 @@ def import_mesh(mesh: Union[pymeshlab.MeshSet, trimesh.Trimesh, str]) -> pymeshl
 
     return mesh
     
-def postprocessmesh(vertices: np.array, faces: np.array, face_num: int = 200000):
+def postprocessmesh(vertices: np.array, faces: np.array, face_num: int = 200000, remove_floaters: bool = True):
     print(f"Number of Vertices: {len(vertices)} - Number of Faces: {len(faces)}")
     print('Generating Trimesh ...')
     mesh = trimesh.Trimesh(vertices=vertices, faces=faces)
     print('Loading Pymeshlab MeshSet ...')
     ms = import_mesh(mesh)
-    print('Removing Floaters ...')
-    ms = remove_floater(ms)
+    if remove_floaters:
+        print('Removing Floaters ...')
+        ms = remove_floater(ms)
     print('Degenerate Face Remover ...')
     with tempfile.NamedTemporaryFile(suffix='.ply', delete=False) as temp_file:
         ms.save_current_mesh(temp_file.name)
@@ -122,6 +123,34 @@ def postprocessmesh(vertices: np.array, faces: np.array, face_num: int = 200000)
     return mesh
 
 
+def postprocessmesh_lods(vertices: np.array, faces: np.array, face_nums: list, remove_floaters: bool = True):
+    """
+    Decimate progressively to every face target: the largest target from the full mesh and every
+    further level from the previous one, reusing the same MeshSet.
+    Returns the LOD meshes, largest first, and the seconds spent on each level.
+    """
+    face_nums = sorted(set(face_nums), reverse=True)
+    print(f"Number of Vertices: {len(vertices)} - Number of Faces: {len(faces)}")
+    ms = import_mesh(trimesh.Trimesh(vertices=vertices, faces=faces))
+    if remove_floaters:
+        print('Removing Floaters ...')
+        ms = remove_floater(ms)
+    with tempfile.NamedTemporaryFile(suffix='.ply', delete=False) as temp_file:
+        ms.save_current_mesh(temp_file.name)
+        ms = pymeshlab.MeshSet()
+        ms.load_new_mesh(temp_file.name)
+    meshes, times = [], []
+    for face_num in face_nums:
+        start = time.perf_counter()
+        ms = reduce_face(ms, max_facenum=face_num)
+        current = ms.current_mesh()
+        mesh = trimesh.Trimesh(vertices=current.vertex_matrix(), faces=current.face_matrix(), process=False)
+        times.append(time.perf_counter() - start)
+        meshes.append(mesh)
+        print(f"LOD {len(meshes) - 1}: {mesh.faces.shape[0]} faces in {times[-1]:.2f}s")
+    return meshes, times
+
+
 def mesh_normalize(mesh):
     """
     Normalize mesh vertices to sphere
@@ -133,7 +162,7 @@ def mesh_normalize(mesh):
 
     center = (max_bb + min_bb) / 2
 
-    scale = torch.norm(torch.tensor(vtx_pos - center, dtype=torch.float32), dim=1).max() * 2.0
+    scale = np.linalg.norm((vtx_pos - center).astype(np.float32), axis=1).max() * 2.0
 
     vtx_pos = (vtx_pos - center) * (scale_factor / float(scale))
     mesh.vertices = vtx_pos
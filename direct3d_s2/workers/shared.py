@@ -0,0 +1,76 @@
+import sys
+import types
+from contextlib import contextmanager
+import numpy as np
+
+
+class SharedArray(object):
+    """
+    Numpy array in shared memory. It pickles by name, so pool workers attach to it instead of copying it.
+    """
+    def __init__(self, shm, shape, dtype, owner=False):
+        self.shm = shm
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.owner = owner
+        self.array = np.ndarray(self.shape, dtype=self.dtype, buffer=shm.buf)
+
+    @staticmethod
+    def create(array: np.ndarray) -> 'SharedArray':
+        from multiprocessing import shared_memory
+        array = np.ascontiguousarray(array)
+        shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        shared = SharedArray(shm, array.shape, array.dtype, owner=True)
+        shared.array[...] = array
+        return shared
+
+    @staticmethod
+    def attach(name, shape, dtype) -> 'SharedArray':
+        from multiprocessing import shared_memory
+        return SharedArray(shared_memory.SharedMemory(name=name), shape, dtype)
+
+    def __reduce__(self):
+        return (SharedArray.attach, (self.shm.name, self.shape, self.dtype.str))
+
+    def __getitem__(self, idx):
+        return self.array[idx]
+
+    def __len__(self):
+        return self.shape[0]
+
+    def release(self):
+        self.array = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+def spawn_pool(workers: int):
+    """
+    Process pool with spawned workers: the parent holds a CUDA context and many threads, which do
+    not survive a fork. Submit to it with `submit`.
+    """
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    return ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn'))
+
+
+@contextmanager
+def _hidden_main():
+    # spawn re-runs the parent's __main__ (e.g. ComfyUI's main.py) as __mp_main__ in every new worker,
+    # unless the main module has neither a spec nor a file
+    main = sys.modules.get('__main__')
+    sys.modules['__main__'] = types.ModuleType('__main__')
+    try:
+        yield
+    finally:
+        sys.modules['__main__'] = main
+
+
+def submit(pool, fn, *args):
+    """
+    pool.submit(fn, *args). Spawned pools start their workers on demand inside submit, so the
+    parent's main module is hidden from them here.
+    """
+    with _hidden_main():
+        return pool.submit(fn, *args)
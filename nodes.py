@@ -1,4 +1,5 @@
 import os
+import time
 import torch
 import torchvision.transforms as transforms
 import torch.nn.functional as F
@@ -10,6 +11,9 @@ from tqdm import tqdm
 import gc
 
 from .direct3d_s2.pipeline import Direct3DS2Pipeline
+from .direct3d_s2.modules.sparse.chunk import set_token_chunk_size
+from .direct3d_s2.utils.samplers import SAMPLER_NAMES, GUIDANCE_RAMPS
+from .direct3d_s2.utils.mesh import floaters_removed, mark_floaters_removed
 
 import folder_paths
 
@@ -160,6 +164,11 @@ class Hy3DDirect3DS2ModelLoader:
                 "subfolder": (["direct3d-s2-v-1-0","direct3d-s2-v-1-1"],{"default":"direct3d-s2-v-1-1"}),
                 "use_legacy_config": ("BOOLEAN",{"default":False}),
             },
+            "optional": {
+                "index_cache_dir": ("STRING",{"default":""}),
+                "token_chunk_size": ("INT",{"default":0,"min":0,"max":200000,"step":1024}),
+                "stream_blocks": ("INT",{"default":0,"min":0,"max":24}),
+            },
         }
 
     RETURN_TYPES = ("HY3DS2PIPELINE", )
@@ -167,11 +176,12 @@ class Hy3DDirect3DS2ModelLoader:
     FUNCTION = "process"
     CATEGORY = "Hy3DS2Wrapper"
 
-    def process(self, pipeline_path, subfolder, use_legacy_config):
+    def process(self, pipeline_path, subfolder, use_legacy_config, index_cache_dir="", token_chunk_size=0, stream_blocks=0):
         device = mm.get_torch_device()
+        set_token_chunk_size(token_chunk_size)
         offload_device = mm.unet_offload_device()
         
-        pipe = Direct3DS2Pipeline(device)
+        pipe = Direct3DS2Pipeline(device, index_cache_dir=index_cache_dir.strip() or None, stream_blocks=stream_blocks)
         pipe.init_config(pipeline_path, subfolder=subfolder, use_legacy_config=use_legacy_config)
         
         return (pipe,) 
@@ -192,6 +202,18 @@ class Hy3DRefineMeshWithDirect3DS2:
                 "max_latent_tokens": ("INT",{"default":100000,"min":0,"max":200000}),
                 "scale": ("FLOAT",{"default":0.95,"min":0.01,"max":0.99, "step": 0.01}),
                 "remove_interior": ("BOOLEAN",{"default":False}),
+                "index_method": (["udf","coarse"],{"default":"udf"}),
+                "prune_decoder": ("BOOLEAN",{"default":False}),
+                "sparse_refiner": ("BOOLEAN",{"default":False}),
+                "remove_floaters": ("BOOLEAN",{"default":False}),
+                "face_budget": ("INT",{"default":0,"min":0,"max":10000000}),
+                "sampler": (SAMPLER_NAMES,{"default":"scheduler"}),
+                "guidance_start": ("FLOAT",{"default":1.0,"min":0.0,"max":1.0, "step": 0.01}),
+                "guidance_end": ("FLOAT",{"default":0.0,"min":0.0,"max":1.0, "step": 0.01}),
+                "guidance_ramp": (GUIDANCE_RAMPS,{"default":"constant"}),
+                "step_cache_threshold": ("FLOAT",{"default":0.0,"min":0.0,"max":1.0, "step": 0.01}),
+                "token_merge_ratio": ("FLOAT",{"default":0.0,"min":0.0,"max":0.5, "step": 0.05}),
+                "ssa_profile": ("BOOLEAN",{"default":False}),
             },
         }
 
@@ -200,12 +222,12 @@ class Hy3DRefineMeshWithDirect3DS2:
     FUNCTION = "process"
     CATEGORY = "Hy3DS2Wrapper"
 
-    def process(self, pipeline, image, trimesh, sdf_resolution, steps, guidance_scale, mc_threshold, seed, max_latent_tokens, scale, remove_interior):
+    def process(self, pipeline, image, trimesh, sdf_resolution, steps, guidance_scale, mc_threshold, seed, max_latent_tokens, scale, remove_interior, index_method="udf", prune_decoder=False, sparse_refiner=False, remove_floaters=False, face_budget=0, sampler="scheduler", guidance_start=1.0, guidance_end=0.0, guidance_ramp="constant", step_cache_threshold=0.0, token_merge_ratio=0.0, ssa_profile=False):
         image = tensor2pil(image)
         if sdf_resolution==1024:
-            trimesh = pipeline.refine_1024(image,trimesh,steps,guidance_scale,remove_interior,mc_threshold,seed, max_latent_tokens, scale)
+            trimesh = pipeline.refine_1024(image,trimesh,steps,guidance_scale,remove_interior,mc_threshold,seed, max_latent_tokens, scale, index_method=index_method, prune_decoder=prune_decoder, sparse_refiner=sparse_refiner, remove_floaters=remove_floaters, face_budget=face_budget, sampler=sampler, guidance_start=guidance_start, guidance_end=guidance_end, guidance_ramp=guidance_ramp, step_cache_threshold=step_cache_threshold, token_merge_ratio=token_merge_ratio, ssa_profile=ssa_profile)
         elif sdf_resolution==512:
-            trimesh = pipeline.refine_512(image,trimesh,steps,guidance_scale,remove_interior,mc_threshold,seed, max_latent_tokens, scale)
+            trimesh = pipeline.refine_512(image,trimesh,steps,guidance_scale,remove_interior,mc_threshold,seed, max_latent_tokens, scale, index_method=index_method, prune_decoder=prune_decoder, sparse_refiner=sparse_refiner, remove_floaters=remove_floaters, face_budget=face_budget, sampler=sampler, guidance_start=guidance_start, guidance_end=guidance_end, guidance_ramp=guidance_ramp, step_cache_threshold=step_cache_threshold, token_merge_ratio=token_merge_ratio, ssa_profile=ssa_profile)
         else:
             print(f'Unknown sdf_resolution: {sdf_resolution}')
         
@@ -222,6 +244,10 @@ class Hy3DGenerateDenseMeshWithDirect3DS2:
                 "guidance_scale": ("FLOAT",{"default":7.0,"min":0.0,"max":100.0}),
                 "mc_threshold": ("FLOAT",{"default":0.20,"min":0.00,"max":1.00, "step": 0.01}),
                 "seed": ("INT",{"default":0,"min":0,"max":0x7fffffff}),
+                "sampler": (SAMPLER_NAMES,{"default":"scheduler"}),
+                "guidance_start": ("FLOAT",{"default":1.0,"min":0.0,"max":1.0, "step": 0.01}),
+                "guidance_end": ("FLOAT",{"default":0.0,"min":0.0,"max":1.0, "step": 0.01}),
+                "guidance_ramp": (GUIDANCE_RAMPS,{"default":"constant"}),
             },
         }
 
@@ -230,9 +256,9 @@ class Hy3DGenerateDenseMeshWithDirect3DS2:
     FUNCTION = "process"
     CATEGORY = "Hy3DS2Wrapper"
 
-    def process(self, pipeline, image, steps, guidance_scale, mc_threshold, seed):     
+    def process(self, pipeline, image, steps, guidance_scale, mc_threshold, seed, sampler="scheduler", guidance_start=1.0, guidance_end=0.0, guidance_ramp="constant"):     
         image = tensor2pil(image)        
-        latent_index = pipeline.generate_dense(image,steps,guidance_scale,mc_threshold,seed)
+        latent_index = pipeline.generate_dense(image,steps,guidance_scale,mc_threshold,seed, sampler=sampler, guidance_start=guidance_start, guidance_end=guidance_end, guidance_ramp=guidance_ramp)
         
         return (latent_index, pipeline, )      
 
@@ -249,6 +275,16 @@ class Hy3DRefineDenseMeshWithDirect3DS2:
                 "guidance_scale": ("FLOAT",{"default":7.0,"min":0.0,"max":100.0}),
                 "mc_threshold": ("FLOAT",{"default":0.20,"min":0.00,"max":1.00, "step": 0.01}),
                 "seed": ("INT",{"default":0,"min":0,"max":0x7fffffff}),
+                "prune_decoder": ("BOOLEAN",{"default":False}),
+                "remove_floaters": ("BOOLEAN",{"default":False}),
+                "face_budget": ("INT",{"default":0,"min":0,"max":10000000}),
+                "sampler": (SAMPLER_NAMES,{"default":"scheduler"}),
+                "guidance_start": ("FLOAT",{"default":1.0,"min":0.0,"max":1.0, "step": 0.01}),
+                "guidance_end": ("FLOAT",{"default":0.0,"min":0.0,"max":1.0, "step": 0.01}),
+                "guidance_ramp": (GUIDANCE_RAMPS,{"default":"constant"}),
+                "step_cache_threshold": ("FLOAT",{"default":0.0,"min":0.0,"max":1.0, "step": 0.01}),
+                "token_merge_ratio": ("FLOAT",{"default":0.0,"min":0.0,"max":0.5, "step": 0.05}),
+                "ssa_profile": ("BOOLEAN",{"default":False}),
             },
         }
 
@@ -257,17 +293,130 @@ class Hy3DRefineDenseMeshWithDirect3DS2:
     FUNCTION = "process"
     CATEGORY = "Hy3DS2Wrapper"
 
-    def process(self, pipeline, image, latent_index, sdf_resolution, steps, guidance_scale, mc_threshold, seed):
+    def process(self, pipeline, image, latent_index, sdf_resolution, steps, guidance_scale, mc_threshold, seed, prune_decoder=False, remove_floaters=False, face_budget=0, sampler="scheduler", guidance_start=1.0, guidance_end=0.0, guidance_ramp="constant", step_cache_threshold=0.0, token_merge_ratio=0.0, ssa_profile=False):
         image = tensor2pil(image)
         remove_interior = False #no longer required
         if sdf_resolution==1024:
-            trimesh = pipeline.refine_dense_1024(image,latent_index,steps,guidance_scale,remove_interior,mc_threshold,seed)
+            trimesh = pipeline.refine_dense_1024(image,latent_index,steps,guidance_scale,remove_interior,mc_threshold,seed, prune_decoder=prune_decoder, remove_floaters=remove_floaters, face_budget=face_budget, sampler=sampler, guidance_start=guidance_start, guidance_end=guidance_end, guidance_ramp=guidance_ramp, step_cache_threshold=step_cache_threshold, token_merge_ratio=token_merge_ratio, ssa_profile=ssa_profile)
         elif sdf_resolution==512:
-            trimesh = pipeline.refine_dense_512(image,latent_index,steps,guidance_scale,remove_interior,mc_threshold,seed)
+            trimesh = pipeline.refine_dense_512(image,latent_index,steps,guidance_scale,remove_interior,mc_threshold,seed, prune_decoder=prune_decoder, remove_floaters=remove_floaters, face_budget=face_budget, sampler=sampler, guidance_start=guidance_start, guidance_end=guidance_end, guidance_ramp=guidance_ramp, step_cache_threshold=step_cache_threshold, token_merge_ratio=token_merge_ratio, ssa_profile=ssa_profile)
         else:
             print(f'Unknown sdf_resolution: {sdf_resolution}')
         
         return (trimesh, pipeline,)        
+
+class Hy3DDirect3DS2MemoryPlanner:
+    @classmethod
+    def INPUT_TYPES(s):
+        return {
+            "required": {
+                "pipeline": ("HY3DS2PIPELINE",),
+                "sdf_resolution": ([512,1024],{"default":1024}),
+                "vram_budget_gb": ("FLOAT",{"default":0.0,"min":0.0,"max":256.0, "step": 0.5}),
+                "apply": ("BOOLEAN",{"default":True}),
+            },
+        }
+
+    RETURN_TYPES = ("INT","STRING","HY3DS2PIPELINE", )
+    RETURN_NAMES = ("max_latent_tokens","report","pipeline", )
+    FUNCTION = "process"
+    CATEGORY = "Hy3DS2Wrapper"
+
+    def process(self, pipeline, sdf_resolution, vram_budget_gb, apply):
+        mode = 'sparse1024' if sdf_resolution==1024 else 'sparse512'
+        plan, report = pipeline.plan_memory(mode, vram_budget_gb=vram_budget_gb, apply=apply)
+        print(report)
+        
+        return (plan.max_latent_tokens, report, pipeline,)
+        
+
+class Hy3DDirect3DS2MeshLODs:
+    @classmethod
+    def INPUT_TYPES(s):
+        return {
+            "required": {
+                "trimesh": ("TRIMESH",),
+                "face_targets": ("STRING",{"default":"20000,10000,5000"}),
+                "simplify_lib": (["Pymeshlab","Meshlib"],{"default":"Pymeshlab"}),
+                "remove_floaters": ("BOOLEAN",{"default":True}),
+            },
+        }
+
+    RETURN_TYPES = ("TRIMESH","STRING", )
+    RETURN_NAMES = ("trimesh","report", )
+    OUTPUT_IS_LIST = (True, False, )
+    FUNCTION = "process"
+    CATEGORY = "Hy3DS2Wrapper"
+
+    def process(self, trimesh, face_targets, simplify_lib, remove_floaters):
+        face_nums = [n for n in parse_string_to_int_list(face_targets) if n > 0]
+        if not face_nums:
+            raise ValueError(f'No valid face targets in "{face_targets}"')
+        already_removed = floaters_removed(trimesh)
+        if remove_floaters and already_removed:
+            print('Floaters were already removed by the refine node, skipping the mesh-level filter')
+            remove_floaters = False
+        start = time.perf_counter()
+        if simplify_lib == "Pymeshlab":
+            from .direct3d_s2.workers.postprocessors import postprocessmesh_lods
+            meshes, times = postprocessmesh_lods(trimesh.vertices, trimesh.faces, face_nums, remove_floaters=remove_floaters)
+        else:
+            from .direct3d_s2.workers.meshlib import postprocessmesh_lods
+            meshes, times = postprocessmesh_lods(trimesh.vertices, trimesh.faces, face_nums, remove_floaters=remove_floaters)
+        if already_removed or remove_floaters:
+            meshes = [mark_floaters_removed(mesh) for mesh in meshes]
+        lines = [f'{simplify_lib}: {len(trimesh.faces)} faces -> {len(meshes)} LODs in {time.perf_counter() - start:.2f}s']
+        for i, (mesh, seconds) in enumerate(zip(meshes, times)):
+            lines.append(f'  LOD {i}: {len(mesh.faces)} faces, {seconds:.2f}s')
+        report = '\n'.join(lines)
+        print(report)
+        
+        return (meshes, report,)
+        
+
+class Hy3DDirect3DS2PostprocessAsync:
+    @classmethod
+    def INPUT_TYPES(s):
+        return {
+            "required": {
+                "trimesh": ("TRIMESH",),
+                "target_facenum": ("INT",{"default":200000,"min":1000,"max":10000000}),
+                "simplify_lib": (["Pymeshlab","Meshlib"],{"default":"Pymeshlab"}),
+                "remove_floaters": ("BOOLEAN",{"default":True}),
+            },
+        }
+
+    RETURN_TYPES = ("TRIMESH", )
+    RETURN_NAMES = ("trimesh", )
+    FUNCTION = "process"
+    CATEGORY = "Hy3DS2Wrapper"
+
+    def process(self, trimesh, target_facenum, simplify_lib, remove_floaters):
+        # imported by its top-level name so the pool workers can import it as well
+        from direct3d_s2.utils.async_postprocess import submit_postprocess, resolve_mesh
+        mesh = submit_postprocess(resolve_mesh(trimesh), target_facenum, simplify_lib, remove_floaters)
+        
+        return (mesh,)
+
+
+class Hy3DDirect3DS2ResolveMesh:
+    @classmethod
+    def INPUT_TYPES(s):
+        return {
+            "required": {
+                "trimesh": ("TRIMESH",),
+            },
+        }
+
+    RETURN_TYPES = ("TRIMESH", )
+    RETURN_NAMES = ("trimesh", )
+    FUNCTION = "process"
+    CATEGORY = "Hy3DS2Wrapper"
+
+    def process(self, trimesh):
+        from direct3d_s2.utils.async_postprocess import resolve_mesh
+        
+        return (resolve_mesh(trimesh),)
         
 
 NODE_CLASS_MAPPINGS = {
@@ -275,6 +424,10 @@ NODE_CLASS_MAPPINGS = {
     "Hy3DRefineMeshWithDirect3DS2": Hy3DRefineMeshWithDirect3DS2,
     "Hy3DGenerateDenseMeshWithDirect3DS2": Hy3DGenerateDenseMeshWithDirect3DS2,
     "Hy3DRefineDenseMeshWithDirect3DS2": Hy3DRefineDenseMeshWithDirect3DS2,
+    "Hy3DDirect3DS2MemoryPlanner": Hy3DDirect3DS2MemoryPlanner,
+    "Hy3DDirect3DS2MeshLODs": Hy3DDirect3DS2MeshLODs,
+    "Hy3DDirect3DS2PostprocessAsync": Hy3DDirect3DS2PostprocessAsync,
+    "Hy3DDirect3DS2ResolveMesh": Hy3DDirect3DS2ResolveMesh,
     }
 
 NODE_DISPLAY_NAME_MAPPINGS = {
@@ -282,5 +435,9 @@ NODE_DISPLAY_NAME_MAPPINGS = {
     "Hy3DRefineMeshWithDirect3DS2": "Hy3D Refine Mesh With Direct3DS2",
     "Hy3DGenerateDenseMeshWithDirect3DS2": "Hy3D Generate Dense Mesh With Direct3DS2",
     "Hy3DRefineDenseMeshWithDirect3DS2": "Hy3D Refine Dense Mesh With Direct3DS2",
+    "Hy3DDirect3DS2MemoryPlanner": "Hy3D Direct3DS2 Memory Planner",
+    "Hy3DDirect3DS2MeshLODs": "Hy3D Direct3DS2 Mesh LODs",
+    "Hy3DDirect3DS2PostprocessAsync": "Hy3D Direct3DS2 Postprocess (Async)",
+    "Hy3DDirect3DS2ResolveMesh": "Hy3D Direct3DS2 Resolve Mesh",
     }
 
@@ -0,0 +1,26 @@
+import os
+import sys
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# the node folder is what ComfyUI puts on sys.path, so `direct3d_s2` imports the same way here
+sys.path.insert(0, ROOT)
+# the sparse package picks its backend at import time; the pure PyTorch one runs anywhere
+os.environ.setdefault('SPARSE_BACKEND', 'torch')
+
+
+class NodeFolderAsDirectory:
+    """
+    The node folder is a package whose __init__ only imports inside ComfyUI, so pytest must collect it
+    as a plain directory instead of importing it. Registered as a plugin because conftest hooks do not
+    apply to the parents of their folder.
+    """
+    @pytest.hookimpl(tryfirst=True)
+    def pytest_collect_directory(self, path, parent):
+        if str(path) == ROOT:
+            return pytest.Dir.from_parent(parent, path=path)
+
+
+def pytest_configure(config):
+    config.pluginmanager.register(NodeFolderAsDirectory(), 'node_folder_as_directory')
@@ -0,0 +1,177 @@
+import pytest
+import torch
+import torch.nn.functional as F
+
+from direct3d_s2.modules import sparse as sp
+
+if sp.BACKEND != 'torch':
+    pytest.skip('the torch convolution tests need SPARSE_BACKEND=torch', allow_module_level=True)
+
+from direct3d_s2.modules.sparse import SparseTensor
+from direct3d_s2.modules.sparse.conv.conv_torch import (
+    kernel_offsets, build_neighbor_table, subdivide_neighbor_table, gather_gemm_scatter,
+    sparseconv3d_func, SparseConv3d,
+)
+
+
+def random_coords(batch_size: int, resolution: int, count: int, seed: int = 0) -> torch.Tensor:
+    """
+    [batch_size * count, 4] unique coordinates, contiguous per batch.
+    """
+    generator = torch.Generator().manual_seed(seed)
+    coords = []
+    for b in range(batch_size):
+        idx = torch.randperm(resolution ** 3, generator=generator)[:count]
+        xyz = torch.stack([idx // resolution ** 2, idx // resolution % resolution, idx % resolution], dim=-1)
+        coords.append(torch.cat([torch.full((count, 1), b), xyz], dim=-1))
+    return torch.cat(coords).int()
+
+
+def dense_reference(coords, feats, kernel, kernel_size, stride, out_coords, resolution):
+    """
+    The same convolution with F.conv3d on a zero-filled dense grid, read back at `out_coords`.
+    """
+    offsets = kernel_offsets(kernel_size)
+    lo, hi = offsets.min(dim=0).values.tolist(), offsets.max(dim=0).values.tolist()
+    weight = torch.zeros(kernel.shape[-1], kernel.shape[-2], *[h - l + 1 for l, h in zip(lo, hi)], dtype=feats.dtype)
+    for k, (x, y, z) in enumerate((offsets - torch.tensor(lo)).tolist()):
+        weight[:, :, x, y, z] = kernel[k].T
+    coords = coords.long()
+    dense = torch.zeros(int(coords[:, 0].max()) + 1, feats.shape[1], resolution, resolution, resolution, dtype=feats.dtype)
+    dense[coords[:, 0], :, coords[:, 1], coords[:, 2], coords[:, 3]] = feats
+    dense = F.pad(dense, (-lo[2], hi[2], -lo[1], hi[1], -lo[0], hi[0]))
+    out = F.conv3d(dense, weight, stride=stride)
+    out_coords = out_coords.long()
+    return out[out_coords[:, 0], :, out_coords[:, 1], out_coords[:, 2], out_coords[:, 3]]
+
+
+def test_kernel_offsets_order():
+    offsets = kernel_offsets(3)
+    assert offsets.shape == (27, 3)
+    # odd kernel volumes: x varies fastest
+    assert offsets[:4].tolist() == [[-1, -1, -1], [0, -1, -1], [1, -1, -1], [-1, 0, -1]]
+    assert offsets[13].tolist() == [0, 0, 0]
+    assert offsets[-1].tolist() == [1, 1, 1]
+
+    # even kernel volumes: z varies fastest
+    offsets = kernel_offsets(2)
+    assert offsets.tolist() == [[x, y, z] for x in range(2) for y in range(2) for z in range(2)]
+
+    assert torch.equal(kernel_offsets(3, dilation=2), kernel_offsets(3) * 2)
+
+
+@pytest.mark.parametrize('stride', [1, 2])
+def test_build_neighbor_table(stride):
+    coords = random_coords(2, 6, 60)
+    out_coords = coords if stride == 1 else torch.unique(
+        torch.cat([coords[:, :1], coords[:, 1:] // stride], dim=-1), dim=0)
+    offsets = kernel_offsets(3)
+    table = build_neighbor_table(coords, out_coords, offsets, stride)
+
+    index = {tuple(c): i for i, c in enumerate(coords.tolist())}
+    expected = [
+        [index.get((b, x * stride + dx, y * stride + dy, z * stride + dz), -1) for b, x, y, z in out_coords.tolist()]
+        for dx, dy, dz in offsets.tolist()
+    ]
+    assert table.tolist() == expected
+
+
+def test_subdivide_neighbor_table_matches_rehash():
+    parents = random_coords(2, 5, 40, seed=1)
+    parent_table = build_neighbor_table(parents, parents, kernel_offsets(3))
+
+    # children in SparseSubdivide order: child p * 8 + (ox * 4 + oy * 2 + oz) sits at 2 * p + o
+    code = torch.arange(8)
+    bits = torch.stack([(code >> 2) & 1, (code >> 1) & 1, code & 1], dim=-1)
+    children = parents.long().unsqueeze(1).repeat(1, 8, 1)
+    children[:, :, 1:] = children[:, :, 1:] * 2 + bits
+    children = children.reshape(-1, 4).int()
+
+    expected = build_neighbor_table(children, children, kernel_offsets(3))
+    assert torch.equal(subdivide_neighbor_table(parent_table), expected)
+
+
+def test_gather_gemm_scatter_matches_dense():
+    torch.manual_seed(0)
+    coords = random_coords(2, 8, 100)
+    feats = torch.randn(coords.shape[0], 4, dtype=torch.float64)
+    kernel = torch.randn(27, 4, 5, dtype=torch.float64)
+    table = build_neighbor_table(coords, coords, kernel_offsets(3))
+
+    out = gather_gemm_scatter(feats, table, kernel, coords.shape[0])
+    expected = dense_reference(coords, feats, kernel, 3, 1, coords, 8)
+    assert torch.allclose(out, expected)
+
+
+def test_submanifold_conv_matches_dense():
+    torch.manual_seed(0)
+    coords = random_coords(2, 8, 100)
+    feats = torch.randn(coords.shape[0], 4)
+    conv = SparseConv3d(4, 5, 3)
+
+    out = conv(SparseTensor(feats, coords))
+    expected = dense_reference(coords, feats.double(), conv.conv.kernel.detach().double(), 3, 1, coords, 8)
+    assert torch.equal(out.coords, coords)
+    assert torch.allclose(out.feats.double(), expected + conv.conv.bias.detach().double(), atol=1e-5)
+
+
+def test_strided_conv_matches_dense():
+    torch.manual_seed(0)
+    coords = random_coords(2, 8, 100)
+    feats = torch.randn(coords.shape[0], 4, dtype=torch.float64)
+    kernel = torch.randn(8, 4, 5, dtype=torch.float64)
+
+    out = sparseconv3d_func(SparseTensor(feats, coords), kernel, 2, stride=2)
+    expected_coords = torch.unique(torch.cat([coords[:, :1], coords[:, 1:] // 2], dim=-1), dim=0)
+    assert torch.equal(out.coords.long(), expected_coords.long())
+    assert torch.allclose(out.feats, dense_reference(coords, feats, kernel, 2, 2, out.coords, 8))
+
+
+def _cuda_or_skip():
+    if not torch.cuda.is_available():
+        pytest.skip('the reference sparse convolution libraries run on CUDA')
+    return torch.device('cuda')
+
+
+def test_matches_torchsparse():
+    torchsparse = pytest.importorskip('torchsparse')
+    device = _cuda_or_skip()
+    torch.manual_seed(0)
+    coords = random_coords(2, 8, 100)
+    feats = torch.randn(coords.shape[0], 4)
+    conv = SparseConv3d(4, 5, 3)
+
+    # same parameter names and layout, so the weights load as a torchsparse checkpoint would
+    reference = torchsparse.nn.Conv3d(4, 5, 3, bias=True)
+    reference.load_state_dict(conv.conv.state_dict())
+    reference = reference.to(device)
+    expected = reference(torchsparse.SparseTensor(feats.to(device), coords.to(device))).feats.cpu()
+
+    out = conv(SparseTensor(feats, coords))
+    assert torch.allclose(out.feats, expected, atol=1e-4)
+
+
+def test_matches_spconv():
+    spconv = pytest.importorskip('spconv.pytorch')
+    device = _cuda_or_skip()
+    torch.manual_seed(0)
+    coords = random_coords(2, 8, 100)
+    feats = torch.randn(coords.shape[0], 4)
+    conv = SparseConv3d(4, 5, 3, bias=False)
+
+    # spconv keeps a dense [C_out, kx, ky, kz, C_in] (or [kx, ky, kz, C_in, C_out]) filter
+    kernel = conv.conv.kernel.detach()
+    dense = torch.zeros(5, 4, 3, 3, 3)
+    for k, (x, y, z) in enumerate((kernel_offsets(3) + 1).tolist()):
+        dense[:, :, x, y, z] = kernel[k].T
+    reference = spconv.SubMConv3d(4, 5, 3, bias=False)
+    if reference.weight.shape == (5, 3, 3, 3, 4):
+        reference.weight.data = dense.permute(0, 2, 3, 4, 1).contiguous()
+    else:
+        reference.weight.data = dense.permute(2, 3, 4, 1, 0).contiguous()
+    reference = reference.to(device)
+    x = spconv.SparseConvTensor(feats.to(device), coords.to(device), [8, 8, 8], 2)
+    expected = reference(x).features.cpu()
+
+    out = conv(SparseTensor(feats, coords))
+    assert torch.allclose(out.feats, expected, atol=1e-4)
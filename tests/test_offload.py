@@ -0,0 +1,81 @@
+import copy
+import torch
+import torch.nn as nn
+
+from direct3d_s2.modules.offload import BlockStreamer
+
+
+def make_blocks(n: int) -> nn.ModuleList:
+    torch.manual_seed(0)
+    return nn.ModuleList([nn.Linear(4, 4) for _ in range(n)])
+
+
+def watch_residency(streamer: BlockStreamer, blocks: nn.ModuleList) -> list:
+    """
+    Record the resident blocks when each block starts and finishes (after the streamer's hooks).
+    """
+    seen = []
+    for block in blocks:
+        block.register_forward_pre_hook(lambda module, args: seen.append(streamer.resident_blocks()))
+        block.register_forward_hook(lambda module, args, output: seen.append(streamer.resident_blocks()))
+    return seen
+
+
+def test_sequential_trace_and_bound():
+    blocks = make_blocks(4)
+    reference = copy.deepcopy(blocks)
+    streamer = BlockStreamer(blocks, 'cpu', resident=2, pin_memory=False)
+    seen = watch_residency(streamer, blocks)
+
+    x = torch.randn(3, 4)
+    y, y_ref = x, x
+    for block, ref in zip(blocks, reference):
+        y, y_ref = block(y), ref(y_ref)
+
+    assert streamer.trace == [
+        ('load', 0), ('load', 1), ('evict', 0),
+        ('load', 2), ('evict', 1),
+        ('load', 3), ('evict', 2),
+        ('load', 0), ('evict', 3),
+    ]
+    assert all(len(resident) <= 2 for resident in seen)
+    assert streamer.resident_blocks() == [0]
+    assert torch.allclose(y, y_ref)
+
+    streamer.release()
+    assert streamer.resident_blocks() == []
+
+
+def test_skipped_blocks_keep_bound():
+    # the step cache runs the first and the last block only and skips the middle ones
+    blocks = make_blocks(4)
+    reference = copy.deepcopy(blocks)
+    streamer = BlockStreamer(blocks, 'cpu', resident=2, pin_memory=False)
+    seen = watch_residency(streamer, blocks)
+
+    x = torch.randn(3, 4)
+    for _ in range(3):
+        y = blocks[-1](blocks[0](x))
+        assert torch.allclose(y, reference[-1](reference[0](x)))
+
+    assert streamer.trace[:7] == [
+        ('load', 0), ('load', 1), ('evict', 0),
+        ('evict', 1), ('load', 3), ('load', 0), ('evict', 3),
+    ]
+    assert all(len(resident) <= 2 for resident in seen)
+    assert streamer.resident_blocks() == [0]
+
+
+def test_resident_covers_all_blocks():
+    blocks = make_blocks(3)
+    streamer = BlockStreamer(blocks, 'cpu', resident=5, pin_memory=False)
+    assert streamer.resident == 3
+
+    x = torch.randn(2, 4)
+    for _ in range(2):
+        for block in blocks:
+            x = block(x)
+
+    # everything fits, so blocks are loaded once and never evicted
+    assert streamer.trace == [('load', 0), ('load', 1), ('load', 2)]
+    assert streamer.resident_blocks() == [0, 1, 2]